@@ -0,0 +1,172 @@
+"""
+Load test comparing the WSGI and ASGI serving paths at high concurrency.
+
+By default both applications are driven in-process, which measures the
+handlers and their thread pools without a web server in the way:
+
+    python -m benchmarks.bench_asgi --concurrency 200 --requests 5000
+
+To compare real deployments, start the two servers and point the harness at them,
+eg `gunicorn -w 4 profiles_project.wsgi` against `uvicorn --workers 4 profiles_project.asgi:application`:
+
+    python -m benchmarks.bench_asgi --url http://localhost:8000 --url http://localhost:8001 --token <key>
+"""
+import argparse
+import asyncio
+import http.client
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from benchmarks.common import setup_django
+
+
+def summarize(name, timings, elapsed, errors):
+    """Print requests/sec and latency percentiles, timings in seconds"""
+    timings.sort()
+    count = len(timings)
+    print('%-28s %6d req  %8.1f req/s  p50 %7.1fms  p99 %7.1fms  errors %d' % (
+        name, count, count / elapsed,
+        timings[count // 2] * 1e3, timings[max(int(count * 0.99) - 1, 0)] * 1e3, errors,
+    ))
+
+
+def run_wsgi(app, paths, headers, concurrency, total):
+    """Call the WSGI app from `concurrency` threads, like a threaded WSGI server would"""
+    timings, errors = [], [0]
+    lock = threading.Lock()
+
+    def one(index):
+        path = paths[index % len(paths)]
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+            'wsgi.multiprocess': False, 'wsgi.run_once': False, 'HTTP_HOST': 'testserver',
+        }
+        environ.update(('HTTP_' + name.upper().replace('-', '_'), value) for name, value in headers.items())
+        status = []
+        start = time.perf_counter()
+        response = app(environ, lambda s, h, exc_info=None: status.append(s))
+        b''.join(response)
+        response.close()
+        with lock:
+            timings.append(time.perf_counter() - start)
+            errors[0] += not status[0].startswith('200')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return timings, time.perf_counter() - start, errors[0]
+
+
+def run_asgi(app, paths, headers, concurrency, total):
+    """Keep `concurrency` requests in flight against the ASGI app on one event loop"""
+    timings, errors = [], [0]
+    raw_headers = [(b'host', b'testserver')] + [(k.encode(), v.encode()) for k, v in headers.items()]
+
+    async def one(index):
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': paths[index % len(paths)], 'query_string': b'',
+            'headers': raw_headers, 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+        }
+        start = time.perf_counter()
+        await app(scope, receive, send)
+        timings.append(time.perf_counter() - start)
+        errors[0] += sent[0]['status'] != 200
+
+    async def main():
+        queue = iter(range(total))
+
+        async def worker():
+            for index in queue:
+                await one(index)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return timings, time.perf_counter() - start, errors[0]
+
+
+def run_http(url, paths, headers, concurrency, total):
+    """Closed-loop HTTP load against a running server, one keep-alive connection per client"""
+    parts = urlsplit(url)
+    timings, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        for index in counter: # the iterator is shared, so the clients split the total between them
+            start = time.perf_counter()
+            try:
+                connection.request('GET', parts.path.rstrip('/') + paths[index % len(paths)], headers=headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status != 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+                failed = True
+            with lock:
+                timings.append(time.perf_counter() - start)
+                errors[0] += failed
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, time.perf_counter() - start, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--url', action='append', default=[], help='base URL of a running server, repeatable')
+    parser.add_argument('--token', help='auth token for the feed endpoints when using --url')
+    args = parser.parse_args()
+
+    if args.url:
+        headers = {'Authorization': 'Token ' + args.token} if args.token else {}
+        paths = ['/api/hello-view/', '/api/feed/'] if args.token else ['/api/hello-view/']
+        for url in args.url:
+            summarize(url, *run_http(url, paths, headers, args.concurrency, args.requests))
+        return
+
+    setup_django()
+
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test.utils import override_settings
+    from rest_framework.authtoken.models import Token
+
+    from profiles_api.asgi import AsgiHandler
+    from profiles_api.models import ProfileFeedItem, UserProfile
+
+    user = UserProfile.objects.create_user(email='bench@example.com', name='Bench', password='benchpass123')
+    ProfileFeedItem.objects.bulk_create([ProfileFeedItem(user_profile=user, status_text='status %d' % i) for i in range(200)])
+    headers = {'Authorization': 'Token ' + Token.objects.create(user=user).key}
+    paths = ['/api/hello-view/', '/api/feed/', '/api/profile/%d/' % user.id]
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        summarize('WSGI (%d threads)' % args.concurrency, *run_wsgi(WSGIHandler(), paths, headers, args.concurrency, args.requests))
+        summarize('ASGI (%d in flight)' % args.concurrency, *run_asgi(AsgiHandler(), paths, headers, args.concurrency, args.requests))
+
+
+if __name__ == '__main__':
+    main()
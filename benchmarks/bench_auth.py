@@ -0,0 +1,41 @@
+"""Compare token authentication overhead with and without the token cache"""
+import argparse
+
+from benchmarks.common import measure, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.authentication import TokenAuthentication
+    from rest_framework.authtoken.models import Token
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from profiles_api.authentication import CachedTokenAuthentication
+    from profiles_api.models import UserProfile
+
+    user = UserProfile.objects.create_user(email='bench@example.com', name='Bench')
+    token = Token.objects.create(user=user)
+    factory = APIRequestFactory()
+
+    for name, backend in (('TokenAuthentication', TokenAuthentication()),
+                          ('CachedTokenAuthentication', CachedTokenAuthentication())):
+        def authenticate():
+            request = Request(factory.get('/api/feed/', HTTP_AUTHORIZATION='Token ' + token.key))
+            backend.authenticate(request)
+
+        stats = measure(authenticate, repeat=args.repeat)
+        with CaptureQueriesContext(connection) as context:
+            authenticate()
+        report('%s (%d queries)' % (name, len(context.captured_queries)), stats)
+
+
+if __name__ == '__main__':
+    main()
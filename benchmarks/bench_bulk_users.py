@@ -0,0 +1,41 @@
+"""Compare user provisioning throughput of create_user() against bulk_create_users()"""
+import argparse
+import os
+import time
+
+from benchmarks.common import setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    setup_django()
+
+    from profiles_api.models import UserProfile
+
+    def users(prefix):
+        return [
+            {'email': '%s%d@example.com' % (prefix, i), 'name': 'User %d' % i, 'password': 'password-%d' % i}
+            for i in range(args.users)
+        ]
+
+    start = time.perf_counter()
+    for user in users('single'):
+        UserProfile.objects.create_user(**user)
+    single = time.perf_counter() - start
+
+    results = [('create_user() loop', single)]
+    for processes in sorted({1, args.processes}):
+        start = time.perf_counter()
+        UserProfile.objects.bulk_create_users(users('bulk%d-' % processes), processes=processes)
+        results.append(('bulk_create_users(processes=%d)' % processes, time.perf_counter() - start))
+
+    for name, elapsed in results:
+        print('%-36s %8.1f users/s  (%.2fs for %d users)' % (name, args.users / elapsed, elapsed, args.users))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Payload size and encode/decode time of the response formats on seeded feed data:
+indented JSON (what the browsable API shows), compact JSON, orjson and MessagePack,
+each uncompressed, gzipped and zstd-compressed. Formats and encodings whose
+package isn't installed are skipped.
+
+    python -m benchmarks.bench_formats --items 1000,10000
+"""
+import argparse
+import json
+import os
+import zlib
+
+from benchmarks.common import measure, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', default='1000,10000', help='feed items per payload')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.items.split(',')]
+
+    setup_django()
+
+    from django.conf import settings
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+
+    from profiles_api import compression, models, serializers
+    from profiles_api.renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+
+    call_command('seed_data', users=100, items=max(sizes), seed=args.seed, stdout=open(os.devnull, 'w'))
+    values_serializer = serializers.ValuesSerializer.for_serializer(serializers.ProfileFeedItemSerializer)
+
+    formats = [
+        ('json indented', lambda data: JSONRenderer().render(data, 'application/json; indent=4'), json.loads),
+        ('json compact', JSONRenderer().render, json.loads),
+    ]
+    if orjson is not None:
+        formats.append(('orjson', FastJSONRenderer().render, orjson.loads))
+    if msgpack is not None:
+        formats.append(('msgpack', MessagePackRenderer().render, lambda content: msgpack.unpackb(content, raw=False)))
+
+    encodings = [('gzip', lambda content: zlib.compress(content, settings.COMPRESSION_GZIP_LEVEL))]
+    if compression.zstandard is not None:
+        zstd = compression.zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL)
+        encodings.append(('zstd', zstd.compress))
+
+    print('%7s %-14s %10s %9s %9s' % ('items', 'format', 'bytes', 'encode', 'decode') +
+          ''.join(' %10s %9s' % (name, 'time') for name, compress in encodings))
+    for size in sizes:
+        data = values_serializer.to_representation(values_serializer.values(models.ProfileFeedItem.objects.order_by('id')[:size]))
+        for name, encode, decode in formats:
+            content = encode(data)
+            line = '%7d %-14s %10d %7.2fms %7.2fms' % (
+                size, name, len(content),
+                measure(lambda: encode(data), repeat=args.repeat, warmup=1)['p50_us'] / 1e3,
+                measure(lambda: decode(content), repeat=args.repeat, warmup=1)['p50_us'] / 1e3,
+            )
+            for encoding, compress in encodings:
+                line += ' %10d %7.2fms' % (
+                    len(compress(content)), measure(lambda: compress(content), repeat=args.repeat, warmup=1)['p50_us'] / 1e3,
+                )
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Login storm: many concurrent logins while another client keeps reading the API.
+Compares verifying passwords in the request threads with the login process pool,
+reporting login throughput and the latency of the reads running alongside.
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.common import setup_django
+
+
+def storm(users, threads, logins_per_thread, probe_path, probe_headers):
+    """Run the storm, return (logins/s, probe p50 ms, probe p99 ms, failed logins)"""
+    from rest_framework.test import APIClient
+
+    failures = []
+    done = threading.Event()
+
+    def login(index):
+        client = APIClient()
+        for attempt in range(logins_per_thread):
+            user = users[(index + attempt) % len(users)]
+            res = client.post('/api/login/', {'username': user.email, 'password': 'benchpass123'})
+            if res.status_code != 200:
+                failures.append(res.status_code)
+
+    probes = []
+
+    def probe():
+        client = APIClient()
+        client.credentials(**probe_headers)
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get(probe_path)
+            probes.append((time.perf_counter() - start) * 1e3)
+
+    workers = [threading.Thread(target=login, args=(index,)) for index in range(threads)]
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+
+    probes.sort()
+    return (
+        threads * logins_per_thread / elapsed,
+        probes[len(probes) // 2], probes[max(int(len(probes) * 0.99) - 1, 0)],
+        len(failures),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=32, help='concurrent login clients')
+    parser.add_argument('--logins', type=int, default=8, help='logins per client')
+    parser.add_argument('--processes', type=int, default=None, help='login pool size, defaults to the setting')
+    parser.add_argument('--iterations', type=int, default=None, help='PBKDF2 iterations, defaults to the setting')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.test.utils import override_settings
+    from rest_framework.authtoken.models import Token
+
+    from profiles_api import hashing
+    from profiles_api.models import UserProfile
+
+    overrides = {'ALLOWED_HOSTS': ['testserver'], 'LOGIN_MAX_PENDING': args.threads}
+    if args.iterations:
+        overrides['PASSWORD_PBKDF2_ITERATIONS'] = args.iterations
+
+    with override_settings(**overrides):
+        users = UserProfile.objects.bulk_create_users(
+            [{'email': 'bench%d@example.com' % i, 'name': 'Bench', 'password': 'benchpass123'} for i in range(50)],
+            processes=1,
+        )
+        tokens = [Token.objects.create(user=user) for user in users] # returning users, logins only read
+        reader = users[0]
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + tokens[0].key}
+        path = '/api/profile/%d/' % reader.id
+
+        for label, processes in (('request threads', 0), ('login pool', args.processes)):
+            with override_settings(LOGIN_HASHING_PROCESSES=processes):
+                if processes != 0:
+                    hashing.verify_password('warm', None) # spawns the pool before the clock starts
+                rate, p50, p99, failed = storm(users, args.threads, args.logins, path, headers)
+            print('%-16s %7.1f logins/s  reads alongside: p50 %7.1fms  p99 %7.1fms  failed logins %d' % (
+                label, rate, p50, p99, failed,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Overhead of the metrics middleware, on its own and on the hot read endpoints"""
+import argparse
+
+from benchmarks.common import measure, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    from profiles_api.metrics import MetricsMiddleware
+    from profiles_api.models import ProfileFeedItem, UserProfile
+
+    # the middleware around a view that does nothing, ie its fixed cost per request
+    response = HttpResponse(b'x' * 1000)
+    middleware = MetricsMiddleware(lambda request: response)
+    request = RequestFactory().get('/api/hello-view/')
+    report('middleware alone', measure(lambda: middleware(request), repeat=args.repeat * 10))
+
+    user = UserProfile.objects.create_user(email='bench@example.com', name='Bench')
+    ProfileFeedItem.objects.bulk_create([ProfileFeedItem(user_profile=user, status_text='status %d' % i) for i in range(50)])
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+
+    # the response cache would hide most of the work being measured
+    with override_settings(RESPONSE_CACHE_TIMEOUT=0, ALLOWED_HOSTS=['testserver']):
+        for path in ('/api/feed/?page_size=50', '/api/profile/%d/' % user.id, '/api/hello-view/'):
+            best = {}
+            for _ in range(args.rounds): # interleaved, so drift affects both sides alike
+                for enabled in (False, True):
+                    with override_settings(METRICS_ENABLED=enabled):
+                        stats = measure(lambda: client.get(path), repeat=args.repeat)
+                    best[enabled] = min(best.get(enabled, stats), stats, key=lambda s: s['p50_us'])
+            report('%s without metrics' % path, best[False])
+            report('%s with metrics' % path, best[True])
+            print('%-40s overhead %+.1f%% (p50)' % (path, (best[True]['p50_us'] / best[False]['p50_us'] - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Profile lists with the stored feed aggregates (UserProfile.feed_item_count and
+last_posted_at) against computing them with COUNT / MAX over the feed items,
+on seeded data: the whole list, one page and a single heavy poster.
+
+    python -m benchmarks.bench_profile_counters --users 1000 --items 100000
+"""
+import argparse
+import os
+
+from benchmarks.common import measure, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.core.management import call_command
+    from django.db.models import Count, Max
+
+    from profiles_api import counters, models, serializers
+    from profiles_api.renderers import FastJSONRenderer
+
+    call_command('seed_data', users=args.users, items=args.items, seed=args.seed, stdout=open(os.devnull, 'w'))
+    assert counters.reconcile(dry_run=True) == [], 'the seeded counters drifted'
+
+    values_serializer = serializers.ValuesSerializer.for_serializer(serializers.UserProfileSerializer)
+    renderer = FastJSONRenderer()
+    profiles = models.UserProfile.objects.order_by('id')
+
+    def stored(queryset):
+        return renderer.render(values_serializer.to_representation(values_serializer.values(queryset)))
+
+    def aggregated(queryset):
+        rows = queryset.annotate(
+            item_count=Count('profilefeeditem'), latest=Max('profilefeeditem__created_on'),
+        ).values('id', 'email', 'name', 'item_count', 'latest')
+        for row in rows:
+            row['feed_item_count'] = row.pop('item_count')
+            row['last_posted_at'] = row.pop('latest')
+        return renderer.render(values_serializer.to_representation(rows))
+
+    heavy = models.ProfileFeedItem.objects.values('user_profile').annotate(n=Count('id')).order_by('-n')[0]['user_profile']
+    for label, queryset in (
+            ('%d profiles' % args.users, profiles),
+            ('page of %d' % args.page_size, profiles[:args.page_size]),
+            ('heavy poster', profiles.filter(pk=heavy))):
+        assert stored(queryset.all()) == aggregated(queryset.all()), 'outputs differ'
+        report('%-16s stored' % label, measure(lambda: stored(queryset.all()), repeat=args.repeat, warmup=2))
+        report('%-16s COUNT/MAX' % label, measure(lambda: aggregated(queryset.all()), repeat=args.repeat, warmup=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare profile search through the trigram index with icontains scans.
+Selective searches through the index stay roughly flat as the table grows,
+while icontains scans grow linearly. Terms matching a large share of the
+table cost time proportional to the number of matches, since they all get ranked.
+"""
+import argparse
+import random
+
+from benchmarks.common import measure, report, setup_django
+
+WORDS = ('amber', 'birch', 'cedar', 'delta', 'ember', 'fjord', 'grove', 'haven', 'indigo', 'juniper')
+
+
+def seed_profiles(count, start):
+    """Insert profiles with unusable passwords so no hashing is involved"""
+    from profiles_api.models import UserProfile
+
+    rng = random.Random(start)
+    batch = []
+    for i in range(start, start + count):
+        name = '%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS).title(), i)
+        batch.append(UserProfile(email='user%d@%s.example.com' % (i, rng.choice(WORDS)), name=name, password='!'))
+        if len(batch) == 10000:
+            UserProfile.objects.bulk_create(batch)
+            batch = []
+    UserProfile.objects.bulk_create(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10000,100000', help='comma separated table sizes, eg 10000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from rest_framework import filters
+
+    from profiles_api.filters import FullTextSearchFilter
+    from profiles_api.models import UserProfile
+    from profiles_api.views import UserProfileViewSet
+
+    factory = APIRequestFactory()
+    view = UserProfileViewSet()
+    seeded = 0
+    for size in [int(size) for size in args.sizes.split(',')]:
+        seed_profiles(size - seeded, seeded)
+        seeded = size
+
+        for term in ('user4242', 'cedar'): # a selective lookup and a term matching a tenth of the table
+            request = Request(factory.get('/api/profile/', {'search': term}))
+            for name, backend in (('icontains', filters.SearchFilter()), ('trigram index', FullTextSearchFilter())):
+                def run():
+                    list(backend.filter_queryset(request, UserProfile.objects.all(), view)[:50])
+
+                report('%8d rows  %-14s %-13s' % (size, repr(term), name), measure(run, repeat=args.repeat, warmup=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare ModelSerializer + JSONRenderer with the values() fast path + FastJSONRenderer
+on feed item and profile lists of 1k/10k/100k rows.
+"""
+import argparse
+
+from benchmarks.common import measure, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+
+    from profiles_api import models, serializers
+    from profiles_api.renderers import FastJSONRenderer
+
+    author = models.UserProfile.objects.create_user(email='author@example.com', name='Author')
+    seeded = 0
+    for size in [int(size) for size in args.sizes.split(',')]:
+        models.ProfileFeedItem.objects.bulk_create(
+            [models.ProfileFeedItem(user_profile=author, status_text='status number %d' % i) for i in range(seeded, size)],
+            batch_size=500,
+        )
+        models.UserProfile.objects.bulk_create(
+            [models.UserProfile(email='user%d@example.com' % i, name='User %d' % i, password='!') for i in range(seeded, size - 1)],
+            batch_size=500,
+        )
+        seeded = size
+
+        for label, model, serializer_class in (
+                ('feed', models.ProfileFeedItem, serializers.ProfileFeedItemSerializer),
+                ('profiles', models.UserProfile, serializers.UserProfileSerializer)):
+            queryset = model.objects.order_by('id')
+            values_serializer = serializers.ValuesSerializer.for_serializer(serializer_class)
+
+            def regular():
+                return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+            def fast():
+                return FastJSONRenderer().render(values_serializer.to_representation(values_serializer.values(queryset.all())))
+
+            assert regular() == fast(), 'outputs differ'
+            report('%7d %-8s ModelSerializer' % (size, label), measure(regular, repeat=args.repeat, warmup=1))
+            report('%7d %-8s ValuesSerializer' % (size, label), measure(fast, repeat=args.repeat, warmup=1))
+
+
+if __name__ == '__main__':
+    main()
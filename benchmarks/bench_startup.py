@@ -0,0 +1,159 @@
+"""
+Startup time and memory per worker of the full settings (profiles_project.settings)
+against the API-only ones (profiles_project.settings_api), with and without the
+warm-up of profiles_project.preload.
+
+Each configuration runs in a fresh interpreter, which imports the WSGI application
+and forks --workers workers the way `gunicorn --preload` does. Each worker times its
+first request to every endpoint, then serves --requests more, and once all of them
+are done their memory is read together: RSS, PSS (shared pages split between the
+processes sharing them) and the private pages, which is what each extra worker costs.
+Linux only (fork and /proc/<pid>/smaps_rollup).
+
+    python -m benchmarks.bench_startup --workers 4 --requests 200
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SEEDED_EMAIL = 'user0@seed.example.com' # the first user of manage.py seed_data, whose token the workers use
+PATHS = ('/api/hello-view/', '/api/profile/', '/api/feed/')
+CONFIGURATIONS = (
+    ('profiles_project.settings', False),
+    ('profiles_project.settings', True),
+    ('profiles_project.settings_api', False),
+    ('profiles_project.settings_api', True),
+)
+
+
+def memory(pid='self'):
+    """{'rss', 'pss', 'private'} of a process in MiB, from /proc"""
+    fields = {}
+    with open('/proc/%s/smaps_rollup' % pid) as smaps:
+        for line in smaps:
+            parts = line.split()
+            if parts[0].endswith(':') and len(parts) == 3:
+                fields[parts[0][:-1]] = int(parts[1]) / 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'], 'private': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def get(application, path, token):
+    """Make an authenticated GET request through the WSGI application, returns the status line"""
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': False,
+        'wsgi.multiprocess': True, 'wsgi.run_once': False, 'HTTP_HOST': 'localhost',
+        'HTTP_AUTHORIZATION': 'Token ' + token,
+    }
+    status = []
+    response = application(environ, lambda s, h, exc_info=None: status.append(s))
+    b''.join(response)
+    response.close()
+    return status[0]
+
+
+def serve(application, requests, token):
+    """A worker's requests, returns (ms of the first request to each path, mean ms of the others, errors)"""
+    errors = 0
+    start = time.perf_counter()
+    for path in PATHS:
+        errors += not get(application, path, token).startswith('200')
+    first = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    for index in range(requests):
+        errors += not get(application, PATHS[index % len(PATHS)], token).startswith('200')
+    return first, (time.perf_counter() - start) * 1e3 / max(requests, 1), errors
+
+
+def child(args):
+    """One configuration, in a fresh interpreter. Prints its results as JSON."""
+    start = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    imported = time.perf_counter() - start
+    warmed = 0
+    if args.preload:
+        start = time.perf_counter()
+        from profiles_project import preload
+        preload.warm_up()
+        warmed = time.perf_counter() - start
+    result = {'import_s': imported, 'warm_up_s': warmed, 'modules': len(sys.modules), 'parent': memory(), 'workers': []}
+
+    workers = []
+    go_read, go_write = os.pipe() # closed once every worker is done and measured, which lets them exit
+    for _ in range(args.workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            os.close(go_write)
+            os.write(write, json.dumps(serve(application, args.requests, args.token)).encode())
+            os.close(write)
+            os.read(go_read, 1)
+            os._exit(0)
+        os.close(write)
+        workers.append((pid, read))
+
+    for pid, read in workers:
+        with os.fdopen(read) as pipe:
+            first_ms, mean_ms, errors = json.loads(pipe.read())
+        result['workers'].append(dict(memory(pid), first_ms=first_ms, mean_ms=mean_ms, errors=errors))
+    os.close(go_write)
+    for pid, read in workers:
+        os.waitpid(pid, 0)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='requests per worker after the first ones')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--child', help=argparse.SUPPRESS) # settings module, when run by main()
+    parser.add_argument('--preload', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--token', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        os.environ['DJANGO_SETTINGS_MODULE'] = args.child
+        return child(args)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        environ = dict(
+            os.environ, THROTTLE_ENABLED='0', FEED_WRITE_BEHIND='0',
+            DATABASE_URL='sqlite:///' + os.path.join(tmpdir, 'bench.sqlite3'),
+            DJANGO_SETTINGS_MODULE='profiles_project.settings',
+        )
+        devnull = subprocess.DEVNULL
+        subprocess.check_call([sys.executable, 'manage.py', 'migrate'], env=environ, stdout=devnull)
+        subprocess.check_call([sys.executable, 'manage.py', 'seed_data', '--users', str(args.users),
+                               '--items', str(args.items)], env=environ, stdout=devnull)
+        output = subprocess.check_output([sys.executable, 'manage.py', 'drf_create_token', SEEDED_EMAIL], env=environ)
+        token = output.split()[2].decode() # "Generated token <key> for user <email>"
+
+        for settings_module, preload in CONFIGURATIONS:
+            command = [sys.executable, '-m', 'benchmarks.bench_startup', '--child', settings_module,
+                       '--workers', str(args.workers), '--requests', str(args.requests), '--token', token]
+            result = json.loads(subprocess.check_output(command + ['--preload'] * preload, env=environ))
+            workers = result['workers']
+            print('%-30s %-10s import %5.0fms  warm-up %4.0fms  %4d modules  parent RSS %5.1fMiB' % (
+                settings_module, 'warmed' if preload else 'cold', result['import_s'] * 1e3,
+                result['warm_up_s'] * 1e3, result['modules'], result['parent']['rss'],
+            ))
+            print('%-41s per worker: first requests %6.1fms  then %5.2fms  RSS %5.1f  PSS %5.1f  private %5.1fMiB  errors %d' % (
+                '', *(sum(worker[key] for worker in workers) / len(workers)
+                      for key in ('first_ms', 'mean_ms', 'rss', 'pss', 'private')),
+                sum(worker['errors'] for worker in workers),
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Cost of a throttle check: the token buckets against DRF's SimpleRateThrottle, and per request"""
+import argparse
+
+from benchmarks.common import measure, report, setup_django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20000)
+    parser.add_argument('--rate', default='100000/min', help='high enough that no check fails')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.conf import settings
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+    from rest_framework.authtoken.models import Token
+    from rest_framework.request import Request
+    from rest_framework.test import APIClient
+    from rest_framework.throttling import AnonRateThrottle
+
+    from profiles_api import throttling
+    from profiles_api.models import UserProfile
+
+    rates = {scope: args.rate for scope in ('anon_read', 'anon_write', 'user_read', 'user_write', 'login', 'anon')}
+    capacity, refill = throttling.parse_rate(args.rate)
+    with override_settings(
+        THROTTLE_ENABLED=True, ADMISSION_RATE=args.rate, ALLOWED_HOSTS=['testserver'],
+        REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates),
+    ):
+        local = throttling.LocalBuckets(max_entries=100000)
+        report('local bucket', measure(lambda: local.take('key', capacity, refill), repeat=args.repeat))
+        shared = throttling.CacheBuckets('default')
+        report('cache bucket (locmem)', measure(lambda: shared.take('key', capacity, refill), repeat=args.repeat))
+
+        # the check as DRF runs it, for an anonymous client; SimpleRateThrottle's history grows with the rate
+        request = Request(RequestFactory().get('/api/profile/'))
+        drf = type('Throttle', (AnonRateThrottle,), {'THROTTLE_RATES': rates})() # the rates are read at import
+        report('DRF AnonRateThrottle', measure(lambda: drf.allow_request(request, None), repeat=args.repeat))
+        bucket = throttling.ReadWriteThrottle()
+        report('ReadWriteThrottle', measure(lambda: bucket.allow_request(request, None), repeat=args.repeat))
+
+        response = HttpResponse()
+        middleware = throttling.AdmissionMiddleware(lambda request: response)
+        plain = RequestFactory().get('/api/hello-view/')
+        report('admission middleware', measure(lambda: middleware(plain), repeat=args.repeat))
+
+        user = UserProfile.objects.create_user(email='bench@example.com', name='Bench')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        best = {}
+        for _ in range(5): # interleaved, so drift affects both sides alike
+            for enabled in (False, True):
+                with override_settings(THROTTLE_ENABLED=enabled):
+                    stats = measure(lambda: client.get('/api/hello-view/'), repeat=args.repeat // 10)
+                best[enabled] = min(best.get(enabled, stats), stats, key=lambda s: s['p50_us'])
+        report('/api/hello-view/ unthrottled', best[False])
+        report('/api/hello-view/ throttled', best[True])
+
+
+if __name__ == '__main__':
+    main()
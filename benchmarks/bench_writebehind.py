@@ -0,0 +1,101 @@
+"""
+Feed posts with synchronous inserts against the write-behind queue, from concurrent clients.
+The database is a throwaway SQLite file in WAL mode, whose single writer lock is
+where synchronous posts queue up; write-behind posts only append to the journal.
+
+    python -m benchmarks.bench_writebehind --concurrency 16 --posts 2000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run(client_for, concurrency, posts):
+    """Post from `concurrency` threads, returns (latencies, status codes, elapsed)"""
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+
+    def post(index):
+        if not hasattr(local, 'client'):
+            local.client = client_for()
+        start = time.perf_counter()
+        res = local.client.post('/api/feed/', {'status_text': 'post %d' % index}, format='json')
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(post, range(posts)))
+    return sorted(latencies), statuses, time.perf_counter() - started
+
+
+def report(name, latencies, statuses, elapsed):
+    print('%-24s %8.1f posts/s  p50 %7.2fms  p99 %7.2fms  %s' % (
+        name, len(latencies) / elapsed, latencies[len(latencies) // 2] * 1e3,
+        latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1e3, statuses,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--fsync', action='store_true', help='fsync the journal on every post, as in production')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run_benchmark(args, tmpdir)
+
+
+def run_benchmark(args, tmpdir):
+    # a file, the shared-cache in-memory test database fails concurrent writers with "table is locked"
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'bench.sqlite3')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+    os.environ.setdefault('THROTTLE_ENABLED', '0')
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+
+    from profiles_api import writebehind
+    from profiles_api.models import ProfileFeedItem, UserProfile
+
+    call_command('migrate', verbosity=0)
+    user = UserProfile.objects.create_user(email='bench@example.com', name='Bench')
+    token = Token.objects.create(user=user).key
+
+    def client_for():
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        return client
+
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        report('synchronous', *run(client_for, args.concurrency, args.posts))
+
+        journal_dir = os.path.join(tmpdir, 'journal')
+        with override_settings(
+            FEED_WRITE_BEHIND=True, FEED_WRITE_BEHIND_JOURNAL_DIR=journal_dir, FEED_WRITE_BEHIND_FSYNC=args.fsync,
+            FEED_WRITE_BEHIND_MAX_QUEUE=args.posts,
+        ):
+            before = ProfileFeedItem.objects.count()
+            latencies, statuses, elapsed = run(client_for, args.concurrency, args.posts)
+            report('write-behind (accepted)', latencies, statuses, elapsed)
+            started = time.perf_counter()
+            writebehind.writer().stop()
+            print('%-24s %8.1fms to drain, %d items inserted in %d batches' % (
+                'write-behind', (time.perf_counter() - started) * 1e3,
+                ProfileFeedItem.objects.count() - before, writebehind.stats()['batches'],
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+Shared helpers for the benchmark scripts.
+Run the scripts from the project root, eg `python -m benchmarks.bench_auth`.
+"""
+import os
+import statistics
+import time
+
+
+def setup_django():
+    """Configure Django and create a throwaway in-memory test database"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+    os.environ.setdefault('THROTTLE_ENABLED', '0') # the benchmarks hammer the API from a single client
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+
+def measure(func, repeat=1000, warmup=10):
+    """Call func repeatedly and return timing statistics in microseconds"""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1e6)
+
+    timings.sort()
+    return {
+        'mean_us': statistics.mean(timings),
+        'p50_us': timings[len(timings) // 2],
+        'p95_us': timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def report(name, stats):
+    """Print one line of timing statistics"""
+    print('%-40s mean %9.1fus  p50 %9.1fus  p95 %9.1fus' % (
+        name, stats['mean_us'], stats['p50_us'], stats['p95_us'],
+    ))
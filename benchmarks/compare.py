@@ -0,0 +1,68 @@
+"""
+Compare benchmark suite results against a stored baseline.
+
+    python -m benchmarks.compare baseline.json current.json --throughput-tolerance 0.1 --latency-tolerance 0.15
+
+Exits with status 1 when a scenario's throughput dropped, or its p95 latency grew,
+by more than the tolerance, or when it has errors the baseline didn't have.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(baseline, current, throughput_tolerance=0.10, latency_tolerance=0.15):
+    """Return (rows, regressions), one row per scenario of the baseline"""
+    rows, regressions = [], []
+    for name, base in sorted(baseline['scenarios'].items()):
+        result = current['scenarios'].get(name)
+        if result is None:
+            regressions.append('%s: missing from the current results' % name)
+            continue
+
+        throughput_change = result['throughput_rps'] / base['throughput_rps'] - 1
+        latency_change = result['p95_ms'] / base['p95_ms'] - 1
+        rows.append((name, base['throughput_rps'], result['throughput_rps'], throughput_change,
+                     base['p95_ms'], result['p95_ms'], latency_change))
+
+        if throughput_change < -throughput_tolerance:
+            regressions.append('%s: throughput %.1f%% lower' % (name, -throughput_change * 100))
+        if latency_change > latency_tolerance:
+            regressions.append('%s: p95 latency %.1f%% higher' % (name, latency_change * 100))
+        if result['errors'] > base['errors']:
+            regressions.append('%s: %d errors, the baseline had %d' % (name, result['errors'], base['errors']))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--throughput-tolerance', type=float, default=0.10, help='allowed relative drop, eg 0.1 for 10%%')
+    parser.add_argument('--latency-tolerance', type=float, default=0.15, help='allowed relative p95 increase')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    for key in ('workers', 'users', 'items', 'target'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print('warning: %s differs (%s vs %s), the runs may not be comparable' % (
+                key, baseline['meta'].get(key), current['meta'].get(key)))
+
+    rows, regressions = compare(baseline, current, args.throughput_tolerance, args.latency_tolerance)
+    print('%-16s %12s %12s %8s %10s %10s %8s' % ('scenario', 'base req/s', 'req/s', 'change', 'base p95', 'p95', 'change'))
+    for name, base_rps, rps, rps_change, base_p95, p95, p95_change in rows:
+        print('%-16s %12.1f %12.1f %+7.1f%% %8.2fms %8.2fms %+7.1f%%' % (
+            name, base_rps, rps, rps_change * 100, base_p95, p95, p95_change * 100))
+
+    if regressions:
+        print('\nRegressions:\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+API benchmark suite on a seeded dataset, with JSON results.
+
+    python -m benchmarks.suite --users 1000 --items 10000 --requests 500 --output current.json
+    python -m benchmarks.suite --workers 4 --output current-4w.json
+    python -m benchmarks.compare baseline.json current.json
+
+Every scenario runs through the full Django stack (middleware, auth, caches).
+With --workers 1 the requests are made in this process; with more, each worker
+process serves its share of the requests against a shared SQLite database in WAL
+mode, like a multi-process WSGI deployment. Pass --url to run the same scenarios
+over HTTP against a running server seeded with `manage.py seed_data` and started
+with THROTTLE_ENABLED=0, or the rate limits will answer most requests with a 429.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+
+SEED = 42
+PASSWORD = 'benchpass123'
+SEARCH_TERMS = ('ada', 'hopper', 'lovelace', 'ken', 'turing', 'grace', 'user1')
+
+
+class Scenario:
+    """A named request factory, `make(rng, ctx)` returns (method, path, data, expected status)"""
+
+    def __init__(self, name, make, authenticated=True):
+        self.name = name
+        self.make = make
+        self.authenticated = authenticated
+
+
+SCENARIOS = (
+    Scenario('login', lambda rng, ctx: (
+        'post', '/api/login/', {'username': rng.choice(ctx['emails']), 'password': PASSWORD}, 200,
+    ), authenticated=False),
+    Scenario('profile_search', lambda rng, ctx: (
+        'get', '/api/profile/?search=%s' % rng.choice(SEARCH_TERMS), None, 200,
+    )),
+    Scenario('feed_list', lambda rng, ctx: ('get', '/api/feed/', None, 200)),
+    Scenario('feed_create', lambda rng, ctx: (
+        'post', '/api/feed/', {'status_text': 'benchmark status %d' % rng.randrange(10 ** 6)}, 201,
+    )),
+    Scenario('profile_update', lambda rng, ctx: (
+        'patch', '/api/profile/%d/' % ctx['user_id'], {'name': 'Bench %d' % rng.randrange(10 ** 6)}, 200,
+    )),
+)
+
+
+class InProcessClient:
+    """Sends requests through Django's test client, ie the whole stack minus the network"""
+
+    def __init__(self, token=None):
+        from rest_framework.test import APIClient
+        self.client = APIClient()
+        if token:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+    def request(self, method, path, data):
+        response = getattr(self.client, method)(path, data, format='json') if data else getattr(self.client, method)(path)
+        return response.status_code
+
+
+class HttpClient:
+    """Sends requests to a running server over a keep-alive connection"""
+
+    def __init__(self, url, token=None):
+        import http.client
+        from urllib.parse import urlsplit
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+        self.prefix = parts.path.rstrip('/')
+        self.headers = {'Content-Type': 'application/json'}
+        if token:
+            self.headers['Authorization'] = 'Token ' + token
+
+    def request(self, method, path, data):
+        body = json.dumps(data) if data else None
+        self.connection.request(method.upper(), self.prefix + path, body=body, headers=self.headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status
+
+
+def run_scenario(scenario, client, ctx, requests, seed):
+    """Time `requests` requests of a scenario, returns (latencies in seconds, errors, elapsed)"""
+    rng = random.Random(seed)
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        method, path, data, expected = scenario.make(rng, ctx)
+        start = time.perf_counter()
+        status = client.request(method, path, data)
+        latencies.append(time.perf_counter() - start)
+        errors += status != expected
+    return latencies, errors, time.perf_counter() - started
+
+
+def worker(index, options, ctx):
+    """Run every scenario in one process, returns {scenario: (latencies, errors, elapsed)}"""
+    if not options['url']:
+        import django
+        django.setup()
+        from django.test.utils import override_settings
+        override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']).enable() # DEBUG would log every query
+    # each worker acts as its own user, so their writes don't contend on the same rows
+    user_ctx = dict(ctx, user_id=ctx['user_ids'][index], token=ctx['tokens'][index])
+    results = {}
+    for scenario in SCENARIOS:
+        if options['scenarios'] and scenario.name not in options['scenarios']:
+            continue
+        token = user_ctx['token'] if scenario.authenticated else None
+        client = HttpClient(options['url'], token) if options['url'] else InProcessClient(token)
+        run_scenario(scenario, client, user_ctx, options['warmup'], SEED + index + 1000)
+        results[scenario.name] = run_scenario(scenario, client, user_ctx, options['requests'], SEED + index)
+    return results
+
+
+def _worker_entry(args):
+    return worker(*args)
+
+
+def prepare_database(options):
+    """Create and seed the database, returns the context the scenarios need"""
+    import django
+    os.environ.setdefault('THROTTLE_ENABLED', '0') # every worker is a single client, also inherited by the spawned ones
+    if not options['url']:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(options['tmpdir'], 'bench.sqlite3')
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+        django.setup()
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0)
+        call_command('seed_data', users=options['users'], items=options['items'], seed=SEED, password=PASSWORD, stdout=open(os.devnull, 'w'))
+    else:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+        django.setup() # only to read the seeded users of the server's database, see --url
+
+    from rest_framework.authtoken.models import Token
+    from profiles_api.management.commands.seed_data import EMAIL_DOMAIN
+    from profiles_api.models import UserProfile
+
+    users = list(UserProfile.objects.filter(email__endswith='@' + EMAIL_DOMAIN).order_by('id')[:max(options['workers'], 50)])
+    if len(users) < options['workers']:
+        raise SystemExit('Seed at least as many users as workers')
+    tokens = [Token.objects.get_or_create(user=user)[0].key for user in users[:options['workers']]]
+    return {
+        'emails': [user.email for user in users],
+        'user_ids': [user.id for user in users[:options['workers']]],
+        'tokens': tokens,
+    }
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    percentile = lambda p: latencies[max(int(len(latencies) * p) - 1, 0)] * 1e3
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1e3, 3),
+        'p50_ms': round(percentile(0.5), 3),
+        'p95_ms': round(percentile(0.95), 3),
+        'p99_ms': round(percentile(0.99), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=300, help='timed requests per scenario and worker')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per scenario and worker')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=[s.name for s in SCENARIOS])
+    parser.add_argument('--url', help='benchmark a running server (seeded with manage.py seed_data) instead')
+    parser.add_argument('--output', help='write the JSON results here as well as to stdout')
+    options = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        options['tmpdir'] = tmpdir
+        ctx = prepare_database(options)
+        started = time.perf_counter()
+        if options['workers'] == 1:
+            per_worker = [worker(0, options, ctx)]
+        else:
+            # spawned workers start from a clean interpreter and read DATABASE_URL from the environment
+            with multiprocessing.get_context('spawn').Pool(options['workers']) as pool:
+                per_worker = pool.map(_worker_entry, [(index, options, ctx) for index in range(options['workers'])])
+        wall = time.perf_counter() - started
+
+    scenarios = {}
+    for name in per_worker[0]:
+        latencies = [latency for results in per_worker for latency in results[name][0]]
+        errors = sum(results[name][1] for results in per_worker)
+        elapsed = max(results[name][2] for results in per_worker) # the workers run each scenario side by side
+        scenarios[name] = summarize(latencies, errors, elapsed)
+
+    import django
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'cpus': os.cpu_count(),
+            'workers': options['workers'],
+            'users': options['users'],
+            'items': options['items'],
+            'requests_per_worker': options['requests'],
+            'target': options['url'] or 'in-process',
+            'wall_seconds': round(wall, 2),
+        },
+        'scenarios': scenarios,
+    }
+    output = json.dumps(report, indent=2)
+    if options['output']:
+        with open(options['output'], 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProfilesApiConfig(AppConfig):
     name = 'profiles_api'
+
+    def ready(self):
+        from profiles_api import signals # noqa: F401 connects the signal handlers
+        from profiles_project import routers # noqa: F401 registers the replica pin cache check
@@ -0,0 +1,154 @@
+"""
+Retention for the feed: old statuses move out of ProfileFeedItem into compressed
+FeedArchiveChunk rows, monthly partitions of the history.
+ProfileFeedItem then only holds the recent items, so its indexes, the range
+queries over recent created_on values and the CASCADE deletes when a heavy
+poster's profile goes stay small. Archived items are read-only and remain
+readable through the feed API: retrieve() falls back to archive.get_item() and
+ArchiveKeysetPagination continues into the archive once the table runs out.
+Archived statuses of deleted profiles are skipped on read and dropped by
+`manage.py archive_feed --purge-deleted`.
+"""
+import datetime
+import json
+import zlib
+
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from profiles_api import caching
+from profiles_api import models
+
+CHUNK_ITEMS = 1000 # items per chunk, bigger chunks compress better but cost more to read for one page
+
+
+def encode(items):
+    """Compress (id, user_profile_id, created_on, status_text) tuples into a chunk payload"""
+    rows = [[pk, author, created_on.isoformat(), text] for pk, author, created_on, text in items]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode())
+
+
+def decode(chunk):
+    """Return the items of a chunk as unsaved-looking ProfileFeedItem instances, oldest first"""
+    items = []
+    for pk, author, created_on, text in json.loads(zlib.decompress(bytes(chunk.payload))):
+        item = models.ProfileFeedItem(id=pk, user_profile_id=author, created_on=parse_datetime(created_on), status_text=text)
+        item._state.adding = False
+        item.archived = True
+        items.append(item)
+    return items
+
+
+def live_items(items):
+    """Drop the items of profiles deleted since they were archived"""
+    authors = {item.user_profile_id for item in items}
+    existing = set(models.UserProfile.objects.filter(id__in=authors).values_list('id', flat=True))
+    return [item for item in items if item.user_profile_id in existing]
+
+
+def month_of(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def archive_before(cutoff, chunk_items=CHUNK_ITEMS):
+    """
+    Move the feed items created before `cutoff` into the archive, oldest first.
+    Every chunk is written and its items deleted in one transaction, so the command
+    can be interrupted and rerun. Returns the number of items archived.
+    The change stream doesn't report the moves, the items read the same from the archive.
+    """
+    using = router.db_for_write(models.ProfileFeedItem)
+    archived = 0
+    while True:
+        rows = list(
+            models.ProfileFeedItem.objects.using(using).filter(created_on__lt=cutoff)
+            .order_by('created_on', 'id').values_list('id', 'user_profile_id', 'created_on', 'status_text')[:chunk_items]
+        )
+        if not rows:
+            break
+
+        month = month_of(timezone.localtime(rows[0][2]))
+        rows = [row for row in rows if month_of(timezone.localtime(row[2])) == month] # a chunk never spans two months
+        ids = [row[0] for row in rows]
+        with transaction.atomic(using=using):
+            models.FeedArchiveChunk.objects.using(using).create(
+                month=month,
+                first_created_on=rows[0][2], first_id=rows[0][0],
+                last_created_on=rows[-1][2], last_id=rows[-1][0],
+                item_count=len(rows),
+                payload=encode(rows),
+            )
+            # raw deletes skip the collector, which would load every item to send its post_delete signal,
+            # the timeline entries that the CASCADE would drop go first
+            models.TimelineEntry.objects.using(using).filter(item_id__in=ids)._raw_delete(using)
+            models.ProfileFeedItem.objects.using(using).filter(id__in=ids)._raw_delete(using)
+        archived += len(rows)
+
+    if archived:
+        caching.bump_version(models.ProfileFeedItem) # the signal handlers didn't see the deletes
+    return archived
+
+
+def purge_deleted_authors():
+    """Rewrite the chunks holding statuses of deleted profiles without them, returns the number dropped"""
+    using = router.db_for_write(models.FeedArchiveChunk)
+    dropped = 0
+    for chunk_id in models.FeedArchiveChunk.objects.using(using).order_by('id').values_list('id', flat=True).iterator():
+        with transaction.atomic(using=using):
+            chunk = models.FeedArchiveChunk.objects.using(using).select_for_update().get(id=chunk_id)
+            items = decode(chunk)
+            kept = live_items(items)
+            if len(kept) == len(items):
+                continue
+            dropped += len(items) - len(kept)
+            if not kept:
+                chunk.delete()
+                continue
+            chunk.first_created_on, chunk.first_id = kept[0].created_on, kept[0].id
+            chunk.last_created_on, chunk.last_id = kept[-1].created_on, kept[-1].id
+            chunk.item_count = len(kept)
+            chunk.payload = encode((item.id, item.user_profile_id, item.created_on, item.status_text) for item in kept)
+            chunk.save()
+    return dropped
+
+
+def get_item(pk):
+    """Return an archived item by id, or None"""
+    # ids grow with created_on, so normally a single chunk spans the id, but backdated items can break that
+    chunks = models.FeedArchiveChunk.objects.filter(last_id__gte=pk, first_id__lte=pk).order_by('last_id')
+    for chunk in chunks:
+        for item in live_items([item for item in decode(chunk) if item.id == pk]):
+            return item
+    return None
+
+
+def page(position, descending, limit):
+    """
+    Up to `limit` archived items strictly after `position`, a (created_on, id) pair
+    or None for the start, walking the history newest first when `descending`.
+    """
+    chunks = models.FeedArchiveChunk.objects.all()
+    if descending:
+        if position is not None: # chunks that start before the position
+            created_on, pk = position
+            chunks = chunks.filter(Q(first_created_on__lt=created_on) | Q(first_created_on=created_on, first_id__lt=pk))
+        chunks = chunks.order_by('-last_created_on', '-last_id')
+    else:
+        if position is not None: # chunks that end after the position
+            created_on, pk = position
+            chunks = chunks.filter(Q(last_created_on__gt=created_on) | Q(last_created_on=created_on, last_id__gt=pk))
+        chunks = chunks.order_by('first_created_on', 'first_id')
+
+    results = []
+    for chunk in chunks.iterator():
+        items = decode(chunk)
+        if descending:
+            items.reverse()
+        if position is not None:
+            items = [item for item in items if ((item.created_on, item.id) < position) == descending and (item.created_on, item.id) != position]
+        results.extend(live_items(items))
+        if len(results) >= limit:
+            break
+    return results[:limit]
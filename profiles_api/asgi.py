@@ -0,0 +1,374 @@
+"""
+ASGI serving path for Django 2.2, which has no native async views.
+The event loop only does the network I/O: each request is handed to Django's
+regular handler on a bounded thread pool, so a worker process can hold many
+slow connections open while only ASGI_*_THREADS of them touch the database.
+The hot read endpoints get a pool of their own, so writes (eg password
+hashing on signup) can't starve them. The feed's change stream is served from
+the event loop itself for token-authenticated clients, so idle subscribers hold
+no thread at all (see AsgiHandler.change_stream).
+"""
+import asyncio
+import io
+import math
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import close_old_connections
+from django.http import QueryDict
+from rest_framework.exceptions import APIException, Throttled
+
+from profiles_api import changes
+from profiles_api import metrics
+from profiles_api import throttling
+from profiles_api.authentication import CachedTokenAuthentication
+from profiles_api.renderers import EventStreamRenderer, FastJSONRenderer
+from profiles_api.views import UserProfileFeedViewSet
+
+READ_PATHS = re.compile(r'^/api/(hello-view/|feed/(\d+/)?|profile/\d+/)$') # feed list/retrieve, profile retrieve and HelloApiView
+CHANGES_PATH = '/api/feed/changes/'
+CHANGES_VIEW = 'UserProfileFeedViewSet.change_stream' # its name in the metrics, as MetricsMiddleware records it
+STREAM_BUFFER = 16 # chunks of a streaming response produced ahead of the client
+
+
+class Slots:
+    """A cap on the requests in progress"""
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.in_flight = 0
+
+    def acquire(self):
+        """Claim a slot, False means the lane is saturated and the request should be shed"""
+        if self.in_flight >= self.slots:
+            return False
+        self.in_flight += 1 # only touched from the event loop thread, so no lock is needed
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+class Lane(Slots):
+    """A bounded thread pool plus a cap on the requests waiting for it"""
+
+    def __init__(self, name, threads, max_waiting):
+        super().__init__(threads + max_waiting)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-' + name)
+
+
+class AsgiHandler:
+    """ASGI 3 application that runs Django's WSGI handler off the event loop"""
+
+    def __init__(self):
+        self.wsgi = WSGIHandler()
+        self.read_lane = Lane('read', settings.ASGI_READ_THREADS, settings.ASGI_MAX_WAITING)
+        self.write_lane = Lane('write', settings.ASGI_WRITE_THREADS, settings.ASGI_MAX_WAITING)
+        self.streams = Slots(settings.ASGI_MAX_STREAMS) # change streams held open on the event loop
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type: %s' % scope['type'])
+
+        if scope['path'] == CHANGES_PATH and scope['method'] == 'GET' and self.token(scope):
+            return await self.change_stream(scope, receive, send)
+
+        lane = self.lane_for(scope)
+        if not lane.acquire():
+            return await self.shed(send)
+        try:
+            body = await self.read_body(receive)
+            await self.respond(lane, self.environ(scope, body), send)
+        finally:
+            lane.release()
+
+    def lane_for(self, scope):
+        """Pick the pool a request runs on"""
+        if scope['method'] in ('GET', 'HEAD') and READ_PATHS.match(scope['path']):
+            return self.read_lane
+        return self.write_lane
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for lane in (self.read_lane, self.write_lane):
+                    lane.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def shed(self, send):
+        """Answer 503 straight from the event loop when a lane is full"""
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [(b'content-type', b'application/json'), (b'retry-after', b'1')],
+        })
+        await send({'type': 'http.response.body', 'body': b'{"detail":"Server busy, try again shortly."}'})
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    def environ(self, scope, body):
+        """Translate an ASGI HTTP scope into a WSGI environ"""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'), # WSGI carries paths as latin-1 "bytes as str"
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            if name in environ and name.startswith('HTTP_'): # repeated headers are joined, as a WSGI server would
+                value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+            environ[name] = value
+        return environ
+
+    async def respond(self, lane, environ, send):
+        """
+        Run the request on the lane's pool and send what it produces. The response is
+        iterated and closed by the same job on the same thread as the request, since
+        streaming responses (the NDJSON exports, the event stream) read from a cursor
+        of that thread's DB connection. Chunks come back through a queue, at most
+        STREAM_BUFFER of them ahead of the client.
+        """
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        room = threading.Semaphore(STREAM_BUFFER)
+        abandoned = threading.Event()
+
+        def emit(message): # on the pool thread, False once the client is gone
+            if message is not None:
+                room.acquire()
+                if abandoned.is_set():
+                    return False
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+            return True
+
+        job = loop.run_in_executor(lane.executor, self.call_django, environ, emit)
+        try:
+            while True:
+                message = await messages.get()
+                if message is None:
+                    break
+                await send(message)
+                room.release()
+        except BaseException: # the client left or the task was cancelled, the job stops at its next chunk
+            abandoned.set()
+            room.release()
+            raise
+        await job
+
+    def call_django(self, environ, emit):
+        """Run one request through Django and emit its ASGI messages, then None, on a pool thread"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        head = environ['REQUEST_METHOD'] == 'HEAD' # same headers as a GET, no body
+        try:
+            response = self.wsgi(environ, start_response)
+            start = {'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']}
+            if not getattr(response, 'streaming', False):
+                try:
+                    body = b'' if head else b''.join(response)
+                finally:
+                    response.close() # fires request_finished, which returns the thread's DB connection
+                emit(start)
+                emit({'type': 'http.response.body', 'body': body})
+                return
+
+            try:
+                if emit(start):
+                    for chunk in () if head else response:
+                        if chunk and not emit({'type': 'http.response.body', 'body': chunk, 'more_body': True}):
+                            break
+                    else:
+                        emit({'type': 'http.response.body', 'body': b''})
+            finally:
+                response.close()
+        finally:
+            emit(None)
+
+    @staticmethod
+    def token(scope):
+        """The key of a `Token` Authorization header, or None"""
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'authorization':
+                parts = value.decode('latin-1').split()
+                return parts[1] if len(parts) == 2 and parts[0].lower() == 'token' else None
+        return None
+
+    @staticmethod
+    def admit(request, key):
+        """
+        What a request to the view goes through before it runs: AdmissionMiddleware's
+        rate per IP, the token lookup and the viewset's throttles. On a pool thread.
+        """
+        try:
+            wait = throttling.admission_wait(request)
+            if wait:
+                raise Throttled(wait, 'Too many requests.')
+            request.user = CachedTokenAuthentication().authenticate_credentials(key)[0]
+            for throttle in UserProfileFeedViewSet().get_throttles():
+                if not throttle.allow_request(request, None):
+                    raise Throttled(throttle.wait())
+        finally:
+            close_old_connections() # there's no request_finished to hand the connection back
+
+    async def change_stream(self, scope, receive, send):
+        """
+        GET /api/feed/changes/ on the event loop, with the same parameters, checks and
+        responses as UserProfileFeedViewSet.change_stream. Only the checks and cursors
+        too old for the in-memory buffer take a trip to the read pool. Open streams hold
+        no thread, they're capped by ASGI_MAX_STREAMS rather than a lane's slots, and
+        are recorded in the metrics like the view (the time until the response starts).
+        Session-authenticated requests go through Django instead.
+        """
+        if not self.streams.acquire():
+            return await self.shed(send)
+        started = time.perf_counter()
+
+        async def recording_send(message):
+            if message['type'] == 'http.response.start' and settings.METRICS_ENABLED:
+                values = {'request_duration_seconds': time.perf_counter() - started}
+                metrics.registry.record(CHANGES_VIEW, 'GET', message['status'], values)
+            await send(message)
+
+        try:
+            await self.serve_change_stream(scope, receive, recording_send)
+        finally:
+            self.streams.release()
+
+    async def serve_change_stream(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+        sse = 'text/event-stream' in headers.get('accept', '')
+        if not self.read_lane.acquire():
+            return await self.shed(send)
+        try:
+            await loop.run_in_executor(self.read_lane.executor, self.admit, WSGIRequest(self.environ(scope, b'')), self.token(scope))
+            stream = await loop.run_in_executor(self.read_lane.executor, changes.broadcaster)
+            params = QueryDict(scope.get('query_string', b'').decode('latin-1'))
+            cursor, timeout = changes.parse_params(params, headers.get('last-event-id'))
+            events = []
+            current = cursor is None
+            if current:
+                cursor = stream.published
+            elif sse:
+                events = await loop.run_in_executor(self.read_lane.executor, stream.changes_after, cursor)
+        except APIException as exc: # authentication, throttling and parameter errors, as DRF would answer them
+            data = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+            extra = []
+            if exc.status_code == 401:
+                extra.append((b'www-authenticate', b'Token'))
+            if getattr(exc, 'wait', None):
+                extra.append((b'retry-after', str(math.ceil(exc.wait)).encode()))
+            return await self.send_json(send, exc.status_code, data, extra)
+        finally:
+            self.read_lane.release()
+
+        if current and not sse:
+            return await self.send_json(send, 200, changes.response_data(cursor, events))
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            if sse:
+                await self.send_events(stream, cursor, events, send, disconnected)
+            else:
+                await self.long_poll(stream, cursor, timeout, send, disconnected)
+        finally:
+            disconnected.cancel()
+
+    async def long_poll(self, stream, cursor, timeout, send, disconnected):
+        try:
+            events = await self.next_events(stream, cursor, timeout, disconnected)
+        except changes.CursorExpired as exc:
+            return await self.send_json(send, exc.status_code, {'detail': exc.detail})
+        if events is not None: # None when the client left
+            await self.send_json(send, 200, changes.response_data(cursor, events))
+
+    async def send_events(self, stream, cursor, events, send, disconnected):
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')],
+        })
+        await send({'type': 'http.response.body', 'body': changes.RETRY + changes.render_events(events), 'more_body': True})
+        if events:
+            cursor = events[-1]['cursor']
+        while True:
+            try:
+                events = await self.next_events(stream, cursor, settings.FEED_CHANGES_MAX_WAIT, disconnected)
+            except changes.CursorExpired as exc: # fell so far behind that the changes are gone
+                body = EventStreamRenderer().render({'detail': exc.detail})
+                return await send({'type': 'http.response.body', 'body': body})
+            if events is None:
+                return
+            await send({'type': 'http.response.body', 'body': changes.render_events(events) if events else changes.HEARTBEAT, 'more_body': True})
+            if events:
+                cursor = events[-1]['cursor']
+
+    async def next_events(self, stream, cursor, timeout, disconnected):
+        """The events after the cursor once there are some ([] after the timeout), None if the client left"""
+        waiting = asyncio.ensure_future(stream.wait_async(cursor, timeout))
+        await asyncio.wait([waiting, disconnected], return_when=asyncio.FIRST_COMPLETED)
+        if not waiting.done():
+            waiting.cancel()
+            return None
+        events = waiting.result()
+        if events is None: # older than the buffer, read them from the database
+            loop = asyncio.get_running_loop()
+            events = await loop.run_in_executor(self.read_lane.executor, self.history, stream, cursor)
+        return events
+
+    @staticmethod
+    def history(stream, cursor):
+        try:
+            return stream.history(cursor)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def send_json(send, status, data, headers=()):
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json'), *headers]})
+        await send({'type': 'http.response.body', 'body': FastJSONRenderer().render(data)})
@@ -0,0 +1,67 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def token_cache():
+    """Return the cache that holds token -> user lookups"""
+    return caches[settings.TOKEN_CACHE_ALIAS]
+
+
+def token_cache_key(key):
+    """
+    Cache key for a token.
+    The raw token is a credential, so only a digest of it ends up in the cache.
+    """
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def invalidate_token(key):
+    """Drop a single token from the cache"""
+    token_cache().delete(token_cache_key(key))
+
+
+def invalidate_user_tokens(*user_ids):
+    """
+    Drop every cached token that belongs to the users. Inside a transaction they're
+    dropped again once it commits, until then other requests can still cache the old rows.
+    """
+    keys = [token_cache_key(key) for key in Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True)]
+    if not keys:
+        return
+    cache = token_cache()
+    cache.delete_many(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for TokenAuthentication that caches the token -> user lookup.
+    The cache backend (TTL and eviction) comes from settings.CACHES, entries are
+    invalidated by the signal handlers in profiles_api.signals and by updates of
+    UserProfile.AUTH_FIELDS through the ORM (UserProfileQuerySet.update). Only writes
+    that bypass the ORM altogether wait for the TTL.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = token_cache()
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+
+        if cached is None:
+            user, token = super().authenticate_credentials(key) # raises AuthenticationFailed, so failures are never cached
+            cache.set(cache_key, (user, token))
+            return (user, token)
+
+        user, token = cached
+        if not user.is_active: # the cache is invalidated on deactivation, this only guards against a stale shared cache
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (user, token)
@@ -0,0 +1,70 @@
+import pickle
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+
+class RedisCache(BaseCache):
+    """
+    Minimal cache backend for any client with the redis-py interface.
+    Only get/set(ex=...)/delete/exists/flushdb are used, so a local stand-in
+    with the same methods can replace a real Redis server, eg in tests:
+
+        'BACKEND': 'profiles_api.cache_backends.RedisCache',
+        'LOCATION': 'redis://localhost:6379/0',
+        'OPTIONS': {'CLIENT_CLASS': 'redis.Redis'},
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        client_class = import_string(options.get('CLIENT_CLASS', 'redis.Redis'))
+        self._client = client_class.from_url(server)
+
+    def _ttl(self, timeout):
+        """Convert a Django timeout into whole seconds for SET EX, None means no expiry"""
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return None
+        return max(int(round(timeout - time.time())), 1)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._client.set(key, pickle.dumps(value, self.pickle_protocol), ex=self._ttl(timeout), nx=True))
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        value = self._client.get(key)
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None and timeout <= 0:
+            self._client.delete(key)
+            return
+        self._client.set(key, pickle.dumps(value, self.pickle_protocol), ex=self._ttl(timeout))
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._client.delete(key)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        if keys:
+            self._client.delete(*keys)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return bool(self._client.exists(key))
+
+    def clear(self):
+        self._client.flushdb()
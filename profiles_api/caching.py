@@ -0,0 +1,119 @@
+"""
+Rendered response cache with conditional GET for read-only viewset actions.
+Every cached model has a version, the time of its last change, which signal
+handlers bump on writes. Response cache keys and ETags include the versions,
+so a write invalidates every cached response built from that model at once,
+and unchanged resources answer 304 without running the serializer.
+"""
+import hashlib
+import math
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+
+
+def response_cache():
+    """Return the cache that holds rendered responses and model versions"""
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(model):
+    return 'api-version:%s' % model._meta.label_lower
+
+
+def get_version(model):
+    """Return the time the model last changed, starting a new version if none is known"""
+    cache = response_cache()
+    version = cache.get(_version_key(model))
+    if version is None:
+        cache.add(_version_key(model), time.time(), None)
+        version = cache.get(_version_key(model), time.time())
+    return version
+
+
+def bump_version(model):
+    """
+    Invalidate every cached response built from the model. Inside a transaction the
+    version moves again once it commits: until then other connections still read the
+    old rows, and may cache them under the version set here.
+    """
+    _set_version(model)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(_set_version, model))
+
+
+def _set_version(model):
+    response_cache().set(_version_key(model), time.time(), None)
+
+
+class CachedResponseMixin:
+    """
+    Cache the rendered output of list() and retrieve() and answer conditional GETs.
+    Responses are keyed on the full URL, the negotiated media type, the versions of
+    `cache_models` and, with `cache_vary_on_user`, the authenticated user.
+    """
+    cache_models = () # models whose changes invalidate the cached responses
+    cache_vary_on_user = False
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Serve the handler's response from the cache or a 304 when possible"""
+        if request.accepted_renderer.format == 'api': # the browsable API renders per-user forms, leave it alone
+            return handler(request, *args, **kwargs)
+
+        versions = [get_version(model) for model in self.cache_models]
+        parts = [request.build_absolute_uri(), request.accepted_media_type] + ['%r' % version for version in versions]
+        if self.cache_vary_on_user:
+            parts.append(str(request.user.pk))
+        key = 'api-response:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+        etag = 'W/"%s"' % key[len('api-response:'):]
+        last_modified = math.ceil(max(versions)) if versions else None # HTTP dates have whole seconds
+        if last_modified is not None and time.time() < last_modified:
+            last_modified = None # another write could still land in this second without moving the date
+
+        # Only a representation this URL actually produced can be "not modified": its cache entry, or the
+        # handler's 200. A validator for anything else, eg If-None-Match: * for a missing object, gets the 404.
+        cache = response_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            if self._not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+            else:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.add_post_render_callback(
+                    lambda rendered: cache.set(
+                        key, (rendered.content, rendered['Content-Type']), settings.RESPONSE_CACHE_TIMEOUT,
+                    )
+                )
+                if self._not_modified(request, etag, last_modified):
+                    self.finalize_response(request, response, *args, **kwargs).render() # fills the cache
+                    response = HttpResponseNotModified()
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def _not_modified(self, request, etag, last_modified):
+        """Evaluate If-None-Match, or If-Modified-Since when there's no If-None-Match"""
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and last_modified is not None and last_modified <= if_modified_since
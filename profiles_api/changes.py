@@ -0,0 +1,341 @@
+"""
+Change stream of the feed: GET /api/feed/changes/?since=<cursor> long-polls for the
+feed items created, updated or deleted after the cursor, or streams them as
+Server-Sent Events to clients that accept text/event-stream.
+
+The signal handlers log every change as a FeedChange row, in the transaction of the
+write, and the log keeps FEED_CHANGES_RETENTION_HOURS of them (see trim_if_due()).
+Archiving (profiles_api.archive) isn't a change: the items moved into the archive stay
+readable through the feed API as they were, so the stream doesn't report them.
+
+One Broadcaster per process polls that log (a query per FEED_CHANGES_POLL_SECONDS,
+or right after a write in this process commits), keeps the recent changes in memory
+and wakes the waiting subscribers, so an idle subscriber costs no queries at all.
+Cursors are FeedChange ids, which every worker shares, so a client can reconnect to
+any of them. A change that commits after later ids went out is logged again under a
+new id (Broadcaster.relog_late()), so delivery is at least once: a client that read
+the old row from history() can see it twice. Under WSGI each waiting request
+holds a server thread; the ASGI entry point (profiles_api.asgi) serves the stream
+from its event loop instead.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.exceptions import APIException, ValidationError
+
+from profiles_api import models
+from profiles_api.renderers import EventStreamRenderer
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000 # changes per response at most
+MAX_MISSING = 10000 # missing ids a broadcaster keeps looking for, see Broadcaster.poll()
+
+
+class CursorExpired(APIException):
+    status_code = 410
+    default_detail = 'The changes after this cursor are no longer kept, reload the feed.'
+    default_code = 'cursor_expired'
+
+
+def record(op, item_ids):
+    """Log changes to feed items in the current transaction, this process's subscribers hear of them on commit"""
+    models.FeedChange.objects.bulk_create([models.FeedChange(item_id=pk, op=op) for pk in item_ids])
+    transaction.on_commit(committed)
+
+
+def committed():
+    """A write of this process committed: poll now, and trim the log if it's time"""
+    wake()
+    try:
+        trim_if_due()
+    except Exception: # the write itself went through, and the next trim catches up
+        logger.exception('Trimming the feed changes failed')
+
+
+def parse_params(params, last_event_id=None):
+    """Return (cursor or None, seconds to wait) of a request, raising ValidationError"""
+    errors = {}
+    cursor = params.get('since') or last_event_id # EventSource resends the last id when it reconnects
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+            if cursor < 0:
+                raise ValueError
+        except ValueError:
+            errors['since'] = ['A cursor from an earlier response is required.']
+    try:
+        timeout = min(max(float(params.get('timeout', settings.FEED_CHANGES_MAX_WAIT)), 0), settings.FEED_CHANGES_MAX_WAIT)
+    except ValueError:
+        errors['timeout'] = ['A number of seconds is required.']
+    if errors:
+        raise ValidationError(errors)
+    return cursor, timeout
+
+
+def response_data(cursor, events):
+    """Body of a long-poll response, `cursor` is what the client sends as `since` next"""
+    return {'cursor': str(events[-1]['cursor'] if events else cursor), 'changes': events}
+
+
+HEARTBEAT = b': keep-alive\n\n' # an SSE comment, also how the server notices a subscriber left
+RETRY = b'retry: 2000\n\n' # milliseconds an EventSource waits before reconnecting
+
+
+def render_events(events):
+    """Server-Sent Events of change events, named after the op and with the cursor as id"""
+    renderer = EventStreamRenderer()
+    return b''.join(renderer.render_event(event, event=event['op'], event_id=event['cursor']) for event in events)
+
+
+def event_stream(stream, cursor, events):
+    """Body of a streaming WSGI response, starting with `events` and then whatever happens after them"""
+    yield RETRY + render_events(events)
+    if events:
+        cursor = events[-1]['cursor']
+    while True:
+        events = stream.wait(cursor, settings.FEED_CHANGES_MAX_WAIT)
+        if not events:
+            yield HEARTBEAT
+            continue
+        yield render_events(events)
+        cursor = events[-1]['cursor']
+
+
+class Broadcaster:
+    """The recent feed changes of this process and the subscribers waiting for them"""
+
+    def __init__(self, buffer_size, poll_seconds):
+        self.events = deque(maxlen=buffer_size)
+        self.poll_seconds = poll_seconds
+        self.published = None # cursor of the last change published, set by the first poll()
+        self._floor = None # the buffer holds every change after this cursor
+        self._gap = None # (first missing id, monotonic time it was noticed)
+        self._missing = {} # id skipped over -> monotonic time it was skipped, see relog_late()
+        self._condition = threading.Condition()
+        self._waiters = set() # (event loop, future) of async subscribers
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.poll()
+        self._thread = threading.Thread(target=self._run, name='feed-changes', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def poll(self):
+        """Publish the changes committed since the last poll, returns how many"""
+        if self.published is None: # subscribers only see what happens from now on, or ask history()
+            last = models.FeedChange.objects.aggregate(last=Max('id'))['last'] or 0
+            recent = set(models.FeedChange.objects.filter(id__gt=last - PAGE_SIZE).values_list('id', flat=True))
+            self._skip(id for id in range(max(last - PAGE_SIZE, 0) + 1, last) if id not in recent) # may still commit
+            with self._condition:
+                self.published = self._floor = last
+            return 0
+
+        self.relog_late()
+        rows = models.FeedChange.objects.filter(id__gt=self.published).order_by('id').values_list('id', 'item_id', 'op')
+        ready = []
+        expected = self.published + 1
+        for pk, item_id, op in rows[:PAGE_SIZE]:
+            # Ids are handed out before commit, so a missing one may belong to a transaction that
+            # hasn't committed yet. The changes after it wait up to FEED_CHANGES_GAP_SECONDS for
+            # it, keeping them in id order, then go out without it. relog_late() catches it if
+            # it commits after all.
+            if pk != expected:
+                if self._gap is None or self._gap[0] != expected:
+                    self._gap = (expected, time.monotonic())
+                if time.monotonic() - self._gap[1] < settings.FEED_CHANGES_GAP_SECONDS:
+                    break
+                self._skip(range(expected, pk))
+            self._gap = None
+            ready.append((pk, item_id, op))
+            expected = pk + 1
+        if not ready:
+            return 0
+
+        events = self.build_events(ready)
+        with self._condition:
+            for event in events:
+                if len(self.events) == self.events.maxlen: # the oldest event drops out
+                    self._floor = self.events[0]['cursor']
+                self.events.append(event)
+            self.published = events[-1]['cursor']
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        return len(events)
+
+    def relog_late(self):
+        """
+        Log the skipped changes that have committed since again, under new ids, so
+        they go out after all, to subscribers and to cursors past their old ids alike.
+        The process whose DELETE takes the old row writes the new one. Ids skipped more
+        than FEED_CHANGES_LATE_SECONDS ago are taken as rolled back and forgotten.
+        """
+        if not self._missing:
+            return
+        missing = sorted(self._missing)
+        late = []
+        for start in range(0, len(missing), 500): # SQLite allows 999 query parameters
+            late.extend(models.FeedChange.objects.filter(id__in=missing[start:start + 500]).values_list('id', 'item_id', 'op'))
+        for pk, item_id, op in late:
+            with transaction.atomic():
+                if models.FeedChange.objects.filter(id=pk).delete()[0]: # a single DELETE, nothing cascades
+                    models.FeedChange.objects.create(item_id=item_id, op=op)
+            del self._missing[pk]
+        expired = time.monotonic() - settings.FEED_CHANGES_LATE_SECONDS
+        self._missing = {pk: skipped for pk, skipped in self._missing.items() if skipped > expired}
+
+    def _skip(self, ids):
+        now = time.monotonic()
+        for pk in ids:
+            if len(self._missing) >= MAX_MISSING:
+                logger.warning('Too many missing feed change ids, late commits after %d may be missed', pk)
+                return
+            self._missing[pk] = now
+
+    @staticmethod
+    def build_events(rows):
+        """Events of (id, item id, op) change rows, with the current state of the items still there"""
+        from profiles_api import serializers # serializers imports the signals, which import this module
+
+        values_serializer = serializers.ValuesSerializer.for_serializer(serializers.ProfileFeedItemSerializer)
+        ids = {item_id for pk, item_id, op in rows if op != models.FeedChange.DELETED}
+        items = {}
+        if ids:
+            queryset = values_serializer.values(models.ProfileFeedItem.objects.filter(id__in=ids))
+            items = {item['id']: item for item in values_serializer.to_representation(queryset)}
+        return [{'cursor': pk, 'op': op, 'id': item_id, 'item': items.get(item_id)} for pk, item_id, op in rows]
+
+    def buffered(self, cursor):
+        """The published events after the cursor, None if they're not all in memory any more"""
+        with self._condition:
+            if cursor >= self.published:
+                return []
+            if cursor < self._floor:
+                return None
+            events = []
+            for event in reversed(self.events): # newest first, so only the new events are looked at
+                if event['cursor'] <= cursor:
+                    break
+                events.append(event)
+        events.reverse()
+        return events[:PAGE_SIZE]
+
+    def history(self, cursor):
+        """The events after the cursor from the database, for cursors older than the buffer"""
+        oldest = models.FeedChange.objects.order_by('id').values_list('id', flat=True).first()
+        if oldest is None or cursor < oldest - 1:
+            raise CursorExpired()
+        rows = models.FeedChange.objects.filter(id__gt=cursor, id__lte=self.published).order_by('id')
+        return self.build_events(list(rows.values_list('id', 'item_id', 'op')[:PAGE_SIZE]))
+
+    def changes_after(self, cursor):
+        events = self.buffered(cursor)
+        return self.history(cursor) if events is None else events
+
+    def wait(self, cursor, timeout):
+        """Block until there are changes after the cursor or the timeout passes, and return them"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.published <= cursor:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+        return self.changes_after(cursor)
+
+    async def wait_async(self, cursor, timeout):
+        """
+        wait() for event loops: returns the buffered events after the cursor, [] on
+        timeout, or None when they have to come from history() (off the loop).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._condition:
+                if self.published > cursor:
+                    break
+                future = loop.create_future()
+                self._waiters.add((loop, future))
+            try:
+                await asyncio.wait_for(future, max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                with self._condition:
+                    self._waiters.discard((loop, future))
+                return []
+        return self.buffered(cursor)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            try:
+                while self.poll() == PAGE_SIZE: # catch up after a burst
+                    pass
+            except Exception:
+                logger.exception('Polling the feed changes failed')
+            finally:
+                close_old_connections() # polls are far apart, don't keep a connection for them
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def broadcaster():
+    """This process's broadcaster, started on first use"""
+    global _broadcaster
+    if _broadcaster is None:
+        with _broadcaster_lock:
+            if _broadcaster is None:
+                instance = Broadcaster(settings.FEED_CHANGES_BUFFER, settings.FEED_CHANGES_POLL_SECONDS)
+                instance.start()
+                _broadcaster = instance
+    return _broadcaster
+
+
+def wake():
+    """Poll now, a write of this process just committed"""
+    if _broadcaster is not None:
+        _broadcaster.wake()
+
+
+def trim(before):
+    """Forget the changes logged before a datetime, cursors from then on get a 410"""
+    return models.FeedChange.objects.filter(changed_on__lt=before).delete()[0] # a single DELETE, nothing cascades
+
+
+_next_trim = 0.0 # monotonic time
+_trim_lock = threading.Lock()
+
+
+def trim_if_due():
+    """
+    trim() the changes older than FEED_CHANGES_RETENTION_HOURS, at most once every
+    FEED_CHANGES_TRIM_SECONDS per process. Returns the number dropped, None if it wasn't time.
+    """
+    global _next_trim
+    now = time.monotonic()
+    with _trim_lock:
+        if now < _next_trim:
+            return None
+        _next_trim = now + settings.FEED_CHANGES_TRIM_SECONDS
+    return trim(timezone.now() - timedelta(hours=settings.FEED_CHANGES_RETENTION_HOURS))
@@ -0,0 +1,128 @@
+"""
+Response compression, negotiated from Accept-Encoding: zstd when the zstandard
+package is installed and the client takes it, gzip otherwise. Buffered bodies
+under COMPRESSION_MIN_SIZE bytes go out as they are, the few bytes saved aren't
+worth the CPU. Streaming responses (exports, the change stream) are compressed as
+they're produced, with a flush after every chunk so each one reaches the client
+right away rather than when the compressor's buffer happens to fill up.
+"""
+import functools
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import zstandard
+except ImportError: # optional dependency, only gzip is offered without it
+    zstandard = None
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # with a gzip header
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdEncoder:
+    name = 'zstd'
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+ENCODERS = ([ZstdEncoder] if zstandard is not None else []) + [GzipEncoder] # preferred first
+
+strong_etag_re = re.compile(r'^"[^"]*"$')
+
+
+@functools.lru_cache(maxsize=256) # clients send the same few headers over and over
+def negotiate(accept_encoding):
+    """The encoder class for an Accept-Encoding header, or None for identity"""
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip()] = quality
+
+    best, best_quality = None, 0.0
+    for encoder in ENCODERS:
+        quality = accepted.get(encoder.name, accepted.get('*', 0.0))
+        if quality > best_quality: # ties go to the preferred encoding
+            best, best_quality = encoder, quality
+    return best
+
+
+def compress_stream(encoder, chunks):
+    for chunk in chunks:
+        data = encoder.compress(chunk) + encoder.flush()
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+class CompressionMiddleware:
+    """
+    Compress responses the client accepts compressed, see the module docstring.
+    Like Django's GZipMiddleware, it weakens strong ETags and leaves responses
+    that already have a Content-Encoding alone.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',)) # whether or not this client gets it compressed
+        encoder_class = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoder_class is None:
+            return response
+
+        encoder = encoder_class()
+        if response.streaming:
+            response.streaming_content = compress_stream(encoder, response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed = encoder.compress(response.content) + encoder.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and strong_etag_re.match(etag): # the compressed body differs byte for byte
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoder.name
+        return response
@@ -0,0 +1,125 @@
+"""
+Per-profile aggregates of the feed kept on UserProfile: feed_item_count and
+last_posted_at, so showing them doesn't take a COUNT or MAX over ProfileFeedItem.
+The signal handlers adjust them in the transaction of each write, with F()
+expressions evaluated by the database, so concurrent posts can't lose an update.
+Archived statuses are still the profile's, archiving leaves the aggregates alone.
+Migration 0011 fills them in for the existing profiles, `manage.py reconcile_feed_counters`
+recomputes them whenever they may have drifted (eg rows written around the signals).
+"""
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, DateTimeField, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from profiles_api import archive
+from profiles_api import caching
+from profiles_api import models
+
+_deleting = threading.local() # ids of the profiles being deleted by this thread
+
+
+def items_created(items):
+    """Count new feed items, one UPDATE per author"""
+    authors = defaultdict(lambda: [0, None])
+    for item in items:
+        totals = authors[item.user_profile_id]
+        totals[0] += 1
+        totals[1] = item.created_on if totals[1] is None else max(totals[1], item.created_on)
+
+    for author, (count, latest) in authors.items():
+        latest = Value(latest, output_field=DateTimeField())
+        models.UserProfile.objects.filter(pk=author).update(
+            feed_item_count=F('feed_item_count') + count,
+            last_posted_at=Greatest(Coalesce('last_posted_at', latest), latest), # an older backdated item doesn't move it back
+        )
+    if authors:
+        caching.bump_version(models.UserProfile) # queryset updates send no signals
+    return len(authors)
+
+
+def item_deleted(item):
+    """Uncount a deleted feed item, the last post time is looked up again only if it was the latest"""
+    author = item.user_profile_id
+    if author in getattr(_deleting, 'profiles', ()): # the profile goes too, don't update it once per status
+        return
+
+    profiles = models.UserProfile.objects.filter(pk=author)
+    profiles.filter(feed_item_count__gt=0).update(feed_item_count=F('feed_item_count') - 1)
+    latest = models.ProfileFeedItem.objects.filter(user_profile_id=OuterRef('pk')).order_by('-created_on').values('created_on')[:1]
+    if profiles.filter(last_posted_at=item.created_on).update(last_posted_at=Subquery(latest)):
+        # only archived statuses left, if any, which is rare enough to search the archive for
+        if profiles.filter(last_posted_at__isnull=True, feed_item_count__gt=0).exists():
+            profiles.update(last_posted_at=archived_totals([author]).get(author, (0, None))[1])
+    caching.bump_version(models.UserProfile)
+
+
+def profile_deleting(profile_id):
+    if not hasattr(_deleting, 'profiles'):
+        _deleting.profiles = set()
+    _deleting.profiles.add(profile_id)
+
+
+def profile_deleted(profile_id):
+    getattr(_deleting, 'profiles', set()).discard(profile_id)
+
+
+def live_totals(authors=None):
+    """{author id: (item count, latest created_on)} of the feed table"""
+    items = models.ProfileFeedItem.objects.order_by().values('user_profile_id')
+    if authors is not None:
+        items = items.filter(user_profile_id__in=authors)
+    return {row['user_profile_id']: (row['count'], row['latest']) for row in items.annotate(count=Count('id'), latest=Max('created_on'))}
+
+
+def archived_totals(authors=None):
+    """{author id: (item count, latest created_on)} of the archive, decoding every chunk"""
+    totals = {}
+    for chunk in models.FeedArchiveChunk.objects.order_by('id').iterator():
+        for item in archive.decode(chunk):
+            if authors is None or item.user_profile_id in authors:
+                totals[item.user_profile_id] = combine(totals.get(item.user_profile_id), (1, item.created_on))
+    return totals
+
+
+def combine(first, second):
+    """Add up two (count, latest) pairs, either may be None"""
+    if first is None or second is None:
+        return first or second or (0, None)
+    return first[0] + second[0], max(first[1], second[1])
+
+
+def reconcile(dry_run=False):
+    """
+    Correct the profiles whose aggregates differ from the actual ones, returns
+    [(profile id, (stored count, stored last post), (actual count, actual last post))].
+    A drifted profile is recounted with its row locked, so the posts committed
+    meanwhile are neither missed nor counted twice. The archive is read once, don't
+    run it alongside `archive_feed`, which moves statuses from the table to the archive.
+    """
+    archived = archived_totals()
+    live = live_totals()
+    drifted = []
+    stored = models.UserProfile.objects.order_by('id').values_list('id', 'feed_item_count', 'last_posted_at')
+    for profile_id, count, last_posted_at in stored.iterator():
+        if combine(live.get(profile_id), archived.get(profile_id)) != (count, last_posted_at):
+            drifted.append(profile_id)
+
+    fixed = []
+    for profile_id in drifted:
+        with transaction.atomic():
+            profile = models.UserProfile.objects.select_for_update().filter(pk=profile_id).values_list(
+                'feed_item_count', 'last_posted_at').first()
+            if profile is None: # deleted meanwhile
+                continue
+            actual = combine(live_totals([profile_id]).get(profile_id), archived.get(profile_id))
+            if actual == profile:
+                continue
+            fixed.append((profile_id, profile, actual))
+            if not dry_run:
+                models.UserProfile.objects.filter(pk=profile_id).update(feed_item_count=actual[0], last_posted_at=actual[1])
+    if fixed and not dry_run:
+        caching.bump_version(models.UserProfile)
+    return fixed
@@ -0,0 +1,24 @@
+from django.db import connections
+from rest_framework import filters
+
+from profiles_api import search
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter backed by the trigram index in profiles_api.search.
+    Uses the same `?search=` parameter and falls back to the icontains lookups
+    on `search_fields` when the index is missing or a term is too short for trigrams.
+    """
+    min_term_length = 3
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        connection = connections[queryset.db]
+        if not search.search_index_available(connection) or any(len(term) < self.min_term_length for term in terms):
+            return super().filter_queryset(request, queryset, view)
+
+        return search.search(queryset, terms)
@@ -0,0 +1,34 @@
+"""
+Password hashers whose work factor comes from settings.
+They keep the algorithm names of Django's hashers, so existing hashes keep
+verifying and check_password() rehashes them when the configured cost changes.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with settings.PASSWORD_PBKDF2_ITERATIONS iterations (None keeps Django's default)"""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """
+    Argon2 with the cost set by settings.PASSWORD_ARGON2_COST, a dict with any of
+    time_cost, memory_cost (KiB) and parallelism. Needs the argon2-cffi package.
+    """
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_COST.get('time_cost', hashers.Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_COST.get('memory_cost', hashers.Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_COST.get('parallelism', hashers.Argon2PasswordHasher.parallelism)
@@ -0,0 +1,119 @@
+"""
+Password hashing off the calling thread.
+PBKDF2 is deliberately slow and holds the GIL, so large batches are spread
+over a pool of worker processes. Logins verify on a separate, bounded pool.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from django.conf import settings
+
+
+def _init_worker():
+    """Make Django settings usable in a freshly spawned worker process"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+    import django
+    django.setup(set_prefix=False)
+
+
+def _make_password(raw_password):
+    from django.contrib.auth.hashers import make_password
+    return make_password(raw_password)
+
+
+def _verify_password(raw_password, encoded):
+    """
+    Return (valid, new_encoded), new_encoded is a fresh hash when the stored one
+    uses another hasher or cost. Without a stored hash the default hasher still
+    runs once, so unknown users take as long as wrong passwords.
+    """
+    from django.contrib.auth.hashers import check_password, make_password
+    if encoded is None:
+        make_password(raw_password)
+        return False, None
+
+    rehashed = []
+    valid = check_password(raw_password, encoded, setter=lambda raw: rehashed.append(make_password(raw)))
+    return valid, rehashed[0] if rehashed else None
+
+
+def hashing_pool(processes=None):
+    """Create a process pool for password hashing, or None when only one process is wanted"""
+    if processes is None:
+        processes = settings.PASSWORD_HASHING_PROCESSES or os.cpu_count()
+    if processes <= 1:
+        return None
+    context = multiprocessing.get_context(settings.PASSWORD_HASHING_START_METHOD)
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker)
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def shared_hashing_pool():
+    """
+    The process-wide hashing pool for requests (created on first use), or None when only
+    one process is wanted. hashing_pool() starts its workers on every call, which only a
+    one-off job like a management command can afford.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = hashing_pool()
+        return _shared_pool
+
+
+def hash_passwords(raw_passwords, pool=None, chunksize=16):
+    """
+    Hash passwords in order, yielding results as they become available.
+    Without a pool the passwords are hashed in the current process.
+    """
+    if pool is None:
+        return map(_make_password, raw_passwords)
+    return pool.map(_make_password, raw_passwords, chunksize=chunksize)
+
+
+class LoginPoolBusy(Exception):
+    """Raised when LOGIN_MAX_PENDING verifications are already waiting"""
+
+
+_login_pool = None
+_login_pool_lock = threading.Lock()
+_login_slots = None
+
+
+def login_pool():
+    """Return the process-wide login pool (created on first use), or None to verify in the calling thread"""
+    global _login_pool, _login_slots
+    processes = settings.LOGIN_HASHING_PROCESSES
+    if processes is None:
+        processes = max((os.cpu_count() or 2) // 2, 1)
+    if processes == 0:
+        return None
+
+    with _login_pool_lock:
+        if _login_pool is None:
+            context = multiprocessing.get_context(settings.PASSWORD_HASHING_START_METHOD)
+            _login_pool = ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker)
+            _login_slots = threading.BoundedSemaphore(settings.LOGIN_MAX_PENDING)
+        return _login_pool
+
+
+def verify_password(raw_password, encoded):
+    """
+    Check a login password on the login pool, see _verify_password for the result.
+    Raises LoginPoolBusy instead of queueing when the pool is backed up.
+    """
+    pool = login_pool()
+    if pool is None:
+        return _verify_password(raw_password, encoded)
+
+    if not _login_slots.acquire(blocking=False):
+        raise LoginPoolBusy()
+    try:
+        return pool.submit(_verify_password, raw_password, encoded).result()
+    finally:
+        _login_slots.release()
@@ -0,0 +1,43 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from profiles_api import archive
+from profiles_api import changes
+from profiles_api import models
+
+
+class Command(BaseCommand):
+    help = 'Move feed items older than the retention period into the compressed archive and trim the change log, run it eg daily'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None, help='defaults to settings.FEED_RETENTION_DAYS')
+        parser.add_argument('--chunk-size', type=int, default=archive.CHUNK_ITEMS, help='items per archive chunk')
+        parser.add_argument('--dry-run', action='store_true', help='only count the items that would be archived')
+        parser.add_argument('--purge-deleted', action='store_true', help='also drop archived items of deleted profiles')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days is None:
+            days = settings.FEED_RETENTION_DAYS
+        if days < 0 or options['chunk_size'] < 1:
+            raise CommandError("--older-than-days can't be negative and --chunk-size must be at least 1")
+
+        cutoff = timezone.now() - datetime.timedelta(days=days)
+        if options['dry_run']:
+            count = models.ProfileFeedItem.objects.filter(created_on__lt=cutoff).count()
+            self.stdout.write('%d feed items are older than %s' % (count, cutoff.isoformat()))
+            return
+
+        started = time.monotonic()
+        archived = archive.archive_before(cutoff, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Archived %d feed items older than %s in %.1fs' % (archived, cutoff.isoformat(), time.monotonic() - started)
+        ))
+        trimmed = changes.trim(timezone.now() - datetime.timedelta(hours=settings.FEED_CHANGES_RETENTION_HOURS))
+        self.stdout.write('Dropped %d change stream entries older than %d hours' % (trimmed, settings.FEED_CHANGES_RETENTION_HOURS))
+        if options['purge_deleted']:
+            self.stdout.write('Dropped %d archived items of deleted profiles' % archive.purge_deleted_authors())
@@ -0,0 +1,49 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from profiles_api import models
+
+
+class Command(BaseCommand):
+    help = 'Create user profiles from a CSV file with email, name and password columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='path to a CSV file with a header row')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT')
+        parser.add_argument('--processes', type=int, default=None, help='password hashing processes, defaults to one per CPU')
+        parser.add_argument('--skip-existing', action='store_true', help='ignore rows whose email already exists')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_file'], newline='') as csv_file:
+                users = list(csv.DictReader(csv_file))
+        except OSError as e:
+            raise CommandError(e)
+
+        missing = {'email', 'name'} - set(users[0] if users else {})
+        if missing:
+            raise CommandError('Missing columns: %s' % ', '.join(sorted(missing)))
+
+        started = time.monotonic()
+
+        def progress(done, total):
+            elapsed = time.monotonic() - started
+            self.stdout.write('%d/%d users (%.0f users/s)' % (done, total, done / elapsed if elapsed else 0))
+
+        try:
+            created = models.UserProfile.objects.bulk_create_users(
+                users,
+                batch_size=options['batch_size'],
+                processes=options['processes'],
+                skip_existing=options['skip_existing'],
+                progress=progress,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        except IntegrityError as e:
+            raise CommandError('%s (rerun with --skip-existing to ignore existing emails)' % e)
+
+        self.stdout.write(self.style.SUCCESS('Created %d users in %.1fs' % (len(created), time.monotonic() - started)))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from profiles_api import models
+from profiles_api import timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized user timelines from the feed items, eg to backfill them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='only rebuild these users, defaults to everyone')
+
+    def handle(self, *args, **options):
+        owners = models.UserProfile.objects.order_by('id').values_list('id', flat=True)
+        if options['user_ids']:
+            owners = owners.filter(id__in=options['user_ids'])
+
+        users = entries = 0
+        for owner_id in owners.iterator():
+            entries += timeline.rebuild(owner_id)
+            users += 1
+            if users % 1000 == 0:
+                self.stdout.write('%d timelines rebuilt' % users)
+
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d timelines with %d entries' % (users, entries)))
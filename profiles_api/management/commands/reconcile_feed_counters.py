@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from profiles_api import counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every profile's feed_item_count and last_posted_at from the feed and the archive "
+        "and correct the ones that drifted, eg to backfill them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the profiles that drifted')
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile(dry_run=options['dry_run'])
+        for profile_id, (count, last_posted_at), (actual_count, actual_last_posted_at) in fixed:
+            self.stdout.write('Profile %d: %d statuses, last %s; actually %d, last %s' % (
+                profile_id, count, last_posted_at, actual_count, actual_last_posted_at,
+            ))
+
+        verb = 'Would correct' if options['dry_run'] else 'Corrected'
+        self.stdout.write(self.style.SUCCESS('%s %d profiles' % (verb, len(fixed))))
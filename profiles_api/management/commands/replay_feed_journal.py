@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from profiles_api import writebehind
+
+
+class Command(BaseCommand):
+    help = 'Insert the feed posts left in the write-behind journals of stopped or crashed processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dead-letters', action='store_true', help='also retry the posts that failed to insert too often')
+
+    def handle(self, *args, **options):
+        replayed = writebehind.replay(settings.FEED_WRITE_BEHIND_JOURNAL_DIR, settings.FEED_WRITE_BEHIND_BATCH_SIZE)
+        self.stdout.write(self.style.SUCCESS('Replayed %d journaled feed posts' % replayed))
+        if options['dead_letters']:
+            inserted, failed = writebehind.replay_dead_letters(settings.FEED_WRITE_BEHIND_JOURNAL_DIR)
+            self.stdout.write('Inserted %d dead-lettered feed posts, %d still fail' % (inserted, failed))
@@ -0,0 +1,83 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from profiles_api import models
+from profiles_api import signals
+
+EMAIL_DOMAIN = 'seed.example.com'
+FIRST_NAMES = (
+    'Ada', 'Alan', 'Barbara', 'Claude', 'Donald', 'Edsger', 'Frances', 'Grace', 'Guido', 'Hedy',
+    'John', 'Katherine', 'Ken', 'Linus', 'Margaret', 'Niklaus', 'Radia', 'Tim', 'Vint', 'Whitfield',
+)
+LAST_NAMES = (
+    'Allen', 'Backus', 'Berners-Lee', 'Cerf', 'Diffie', 'Dijkstra', 'Hamilton', 'Hopper', 'Johnson', 'Knuth',
+    'Lamarr', 'Liskov', 'Lovelace', 'Perlman', 'Ritchie', 'Shannon', 'Thompson', 'Torvalds', 'Turing', 'Wirth',
+)
+WORDS = (
+    'api', 'benchmark', 'cache', 'coffee', 'commit', 'deploy', 'django', 'feed', 'friday', 'index',
+    'latency', 'lunch', 'merge', 'monday', 'profile', 'python', 'query', 'release', 'review', 'weekend',
+)
+
+
+def seed_users(count, seed):
+    """The users of a seed, as dicts for bulk_create_users. The same seed always gives the same users."""
+    rng = random.Random(seed)
+    return [
+        {
+            'email': 'user%d@%s' % (index, EMAIL_DOMAIN),
+            'name': '%s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)),
+        }
+        for index in range(count)
+    ]
+
+
+def seed_items(count, user_count, seed):
+    """(author index, status text) of the feed items of a seed"""
+    rng = random.Random(seed + 1) # independent of the user stream, so --items doesn't change the users
+    for _ in range(count):
+        yield rng.randrange(user_count), ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic dataset of users and feed items, eg for the benchmark suite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--password', default='benchpass123', help='password of every seeded user')
+        parser.add_argument('--batch-size', type=int, default=5000, help='feed items per INSERT batch')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        if models.UserProfile.objects.filter(email__endswith='@' + EMAIL_DOMAIN).exists():
+            raise CommandError('The database already holds seeded users, seed an empty database')
+
+        started = time.monotonic()
+        users = models.UserProfile.objects.bulk_create_users(seed_users(options['users'], options['seed']), processes=1)
+        # one hash shared by every user, hashing each password separately would take minutes for big seeds
+        models.UserProfile.objects.filter(id__in=[user.id for user in users]).update(password=make_password(options['password']))
+        self.stdout.write('%d users (%.1fs)' % (len(users), time.monotonic() - started))
+
+        items = seed_items(options['items'], len(users), options['seed'])
+        created = 0
+        while created < options['items']:
+            batch = [
+                models.ProfileFeedItem(user_profile=users[author], status_text=text)
+                for author, text in (next(items) for _ in range(min(options['batch_size'], options['items'] - created)))
+            ]
+            last_id = models.ProfileFeedItem.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            models.ProfileFeedItem.objects.bulk_create(batch)
+            # SQLite doesn't return ids from bulk inserts, fetch the new rows so the timelines get them
+            batch = list(models.ProfileFeedItem.objects.filter(id__gt=last_id).order_by('id'))
+            signals.post_bulk_save.send(sender=models.ProfileFeedItem, objs=batch, created=True)
+            created += len(batch)
+            self.stdout.write('%d/%d feed items' % (created, options['items']))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded %d users and %d feed items in %.1fs' % (len(users), created, time.monotonic() - started)
+        ))
@@ -0,0 +1,257 @@
+"""
+In-process request metrics, exported in the Prometheus text format at /api/_metrics.
+MetricsMiddleware times every request and breaks it down per view into DB queries,
+serializer and renderer time, and response size. The numbers live in this worker
+process only, so each process has to be scraped (or run a single worker per port).
+"""
+import bisect
+import cProfile
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from profiles_project.db import pool_stats
+from profiles_api import writebehind
+
+SECONDS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNTS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+HISTOGRAMS = ( # (name, help, buckets)
+    ('request_duration_seconds', 'Time from the first middleware to the response', SECONDS),
+    ('db_queries', 'Database queries per request', COUNTS),
+    ('db_duration_seconds', 'Time spent in database queries per request', SECONDS),
+    ('serializer_duration_seconds', 'Time spent serializing per request, excluding queries', SECONDS),
+    ('renderer_duration_seconds', 'Time spent rendering the response', SECONDS),
+    ('response_size_bytes', 'Size of the response body, streaming responses excluded', BYTES),
+)
+PREFIX = 'profiles_api_'
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1 # the first bucket with value <= bound
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms by (metric, view, method), plus request counts by status"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+
+    def record(self, view, method, status, values):
+        with self._lock:
+            self.requests[view, method, status] = self.requests.get((view, method, status), 0) + 1
+            for name, _, buckets in HISTOGRAMS:
+                if name in values:
+                    key = (name, view, method)
+                    if key not in self.histograms:
+                        self.histograms[key] = Histogram(buckets)
+                    self.histograms[key].observe(values[name])
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.requests.clear()
+
+    def export(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            requests = dict(self.requests)
+
+        lines = [
+            '# HELP %srequests_total Requests handled by this process' % PREFIX,
+            '# TYPE %srequests_total counter' % PREFIX,
+        ]
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append('%srequests_total{%s} %d' % (PREFIX, _labels(view=view, method=method, status=status), count))
+
+        for name, help_text, _ in HISTOGRAMS:
+            lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+            lines.append('# TYPE %s%s histogram' % (PREFIX, name))
+            for (metric, view, method), (buckets, counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append('%s%s_bucket{%s} %d' % (PREFIX, name, _labels(view=view, method=method, le=le), cumulative))
+                labels = _labels(view=view, method=method)
+                lines.append('%s%s_sum{%s} %s' % (PREFIX, name, labels, repr(total)))
+                lines.append('%s%s_count{%s} %d' % (PREFIX, name, labels, count))
+
+        queue = writebehind.stats()
+        if queue:
+            lines.append('# HELP %sfeed_queue_depth Feed posts accepted and not yet inserted' % PREFIX)
+            lines.append('# TYPE %sfeed_queue_depth gauge' % PREFIX)
+            lines.append('%sfeed_queue_depth %d' % (PREFIX, queue['depth']))
+            lines.append('# TYPE %sfeed_queue_oldest_seconds gauge' % PREFIX)
+            lines.append('%sfeed_queue_oldest_seconds %s' % (PREFIX, repr(queue['oldest_seconds'])))
+            for counter in ('queued', 'flushed', 'batches', 'failures', 'dead_lettered'):
+                lines.append('# TYPE %sfeed_queue_%s_total counter' % (PREFIX, counter))
+                lines.append('%sfeed_queue_%s_total %d' % (PREFIX, counter, queue[counter]))
+
+        for gauge in ('size', 'in_use', 'idle', 'waiting'):
+            lines.append('# TYPE %sdb_pool_%s gauge' % (PREFIX, gauge))
+            for stats in pool_stats():
+                labels = _labels(alias=stats['alias'], database=stats['database'])
+                lines.append('%sdb_pool_%s{%s} %d' % (PREFIX, gauge, labels, stats[gauge]))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')) for name, value in labels.items())
+
+
+registry = Registry()
+_current = threading.local() # the measurements of the request running on this thread
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's `name` measurement,
+    minus the time its DB queries took. Does nothing outside a measured request.
+    """
+    values = getattr(_current, 'values', None)
+    if values is None:
+        yield
+        return
+    db_before = values['db_duration_seconds']
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started - (values['db_duration_seconds'] - db_before)
+        values[name] = values.get(name, 0) + elapsed
+
+
+class TimedSerializerMixin:
+    """Serializer mixin that reports the time spent producing `.data` to the metrics"""
+
+    @property
+    def data(self):
+        with timed('serializer_duration_seconds'):
+            return super().data
+
+
+def view_name(view_func, method):
+    """eg UserProfileFeedViewSet.list for viewsets, HelloApiView.get for APIViews"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None) or {}
+    return '%s.%s' % (cls.__name__, actions.get(method.lower(), method.lower()))
+
+
+class MetricsMiddleware:
+    """
+    Record per-view request metrics, see HISTOGRAMS.
+    With METRICS_PROFILE_SAMPLE_RATE above 0, that share of requests runs under
+    cProfile and the profiles of those slower than METRICS_PROFILE_THRESHOLD
+    seconds are written to METRICS_PROFILE_DIR, for `python -m pstats` or snakeviz.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        values = _current.values = {'db_queries': 0, 'db_duration_seconds': 0.0}
+        request._metrics_view = 'unmatched'
+        profiler = None
+        if settings.METRICS_PROFILE_SAMPLE_RATE and random.random() < settings.METRICS_PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+
+        # what connection.execute_wrapper() does, without a context manager per connection and request
+        wrapped = connections.all()
+        for connection in wrapped:
+            connection.execute_wrappers.append(self.time_query)
+        started = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        finally:
+            _current.values = None
+            for connection in wrapped:
+                connection.execute_wrappers.remove(self.time_query)
+
+        values['request_duration_seconds'] = time.perf_counter() - started
+        if not response.streaming:
+            values['response_size_bytes'] = len(response.content)
+        registry.record(request._metrics_view, request.method, response.status_code, values)
+
+        if profiler and values['request_duration_seconds'] >= settings.METRICS_PROFILE_THRESHOLD:
+            self.dump_profile(profiler, request._metrics_view)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        """DRF responses render after the view returns, time it with a post-render callback"""
+        values = getattr(_current, 'values', None)
+        if values is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                values['renderer_duration_seconds'] = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def time_query(execute, sql, params, many, context):
+        values = _current.values
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if values is not None:
+                values['db_queries'] += 1
+                values['db_duration_seconds'] += time.perf_counter() - started
+
+    @staticmethod
+    def dump_profile(profiler, view):
+        os.makedirs(settings.METRICS_PROFILE_DIR, exist_ok=True)
+        filename = '%s-%d-%d.prof' % (view, time.time() * 1000, threading.get_ident())
+        profiler.dump_stats(os.path.join(settings.METRICS_PROFILE_DIR, filename))
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, protected by METRICS_TOKEN. Without one it only exists with DEBUG on."""
+    token = settings.METRICS_TOKEN
+    if not token and not settings.DEBUG:
+        raise Http404
+    if token and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
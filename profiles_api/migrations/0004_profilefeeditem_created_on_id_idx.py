@@ -0,0 +1,17 @@
+# Generated by Django 2.2 on 2026-10-17 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0003_auto_20200513_0232'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['created_on', 'id'], name='feed_created_on_id_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from profiles_api.search import create_search_index, drop_search_index
+
+
+def forwards(apps, schema_editor):
+    create_search_index(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0004_profilefeeditem_created_on_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2 on 2026-10-17 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0006_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedArchiveChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('first_created_on', models.DateTimeField()),
+                ('first_id', models.IntegerField()),
+                ('last_created_on', models.DateTimeField()),
+                ('last_id', models.IntegerField()),
+                ('item_count', models.PositiveIntegerField()),
+                ('payload', models.BinaryField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feedarchivechunk',
+            index=models.Index(fields=['first_created_on', 'first_id'], name='archive_first_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedarchivechunk',
+            index=models.Index(fields=['last_created_on', 'last_id'], name='archive_last_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedarchivechunk',
+            index=models.Index(fields=['last_id'], name='archive_last_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2 on 2026-10-17 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0007_feedarchivechunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilefeeditem',
+            name='provisional_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
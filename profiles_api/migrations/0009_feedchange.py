@@ -0,0 +1,22 @@
+# Generated by Django 2.2 on 2026-10-17 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0008_profilefeeditem_provisional_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.IntegerField()),
+                ('op', models.CharField(choices=[('created', 'created'), ('updated', 'updated'), ('deleted', 'deleted')], max_length=7)),
+                ('changed_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2 on 2026-10-17 19:53
+
+from django.db import migrations, models
+
+from profiles_api.search import create_search_index, drop_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0009_feedchange'),
+    ]
+
+    operations = [
+        # SQLite adds the columns by rebuilding the table, which loses the search index triggers
+        migrations.RunPython(drop_index, create_index),
+        migrations.AddField(
+            model_name='userprofile',
+            name='feed_item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_posted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,38 @@
+import json
+import zlib
+
+from django.db import migrations
+from django.db.models import Count, Max
+from django.utils.dateparse import parse_datetime
+
+
+def backfill_counters(apps, schema_editor):
+    """Fill feed_item_count and last_posted_at from the feed table and the archive, like reconcile_feed_counters"""
+    UserProfile = apps.get_model('profiles_api', 'UserProfile')
+    ProfileFeedItem = apps.get_model('profiles_api', 'ProfileFeedItem')
+    FeedArchiveChunk = apps.get_model('profiles_api', 'FeedArchiveChunk')
+    using = schema_editor.connection.alias
+
+    totals = {}
+    live = ProfileFeedItem.objects.using(using).order_by().values('user_profile_id').annotate(count=Count('id'), latest=Max('created_on'))
+    for row in live:
+        totals[row['user_profile_id']] = (row['count'], row['latest'])
+    for payload in FeedArchiveChunk.objects.using(using).order_by('id').values_list('payload', flat=True).iterator():
+        for pk, author, created_on, text in json.loads(zlib.decompress(bytes(payload))): # the chunk format of profiles_api.archive
+            created_on = parse_datetime(created_on)
+            count, latest = totals.get(author, (0, None))
+            totals[author] = (count + 1, created_on if latest is None else max(latest, created_on))
+
+    for author, (count, latest) in totals.items():
+        UserProfile.objects.using(using).filter(pk=author).update(feed_item_count=count, last_posted_at=latest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0010_userprofile_feed_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -4,10 +4,31 @@ from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.models import BaseUserManager
 from django.conf import settings # used to retrieve settings from settings.py file
 
+from profiles_api import authentication
+from profiles_api import hashing
+
+
+class UserProfileQuerySet(models.QuerySet):
+    """Queryset of user profiles, its updates keep the token cache honest"""
+
+    def update(self, **kwargs):
+        """Bulk updates of what authentication checks drop the cached tokens of the users they hit"""
+        if not set(UserProfile.AUTH_FIELDS) & set(kwargs): # eg the F() counter updates, the common case
+            return super().update(**kwargs)
+
+        user_ids = list(self.values_list('pk', flat=True))
+        rows = super().update(**kwargs)
+        if user_ids:
+            authentication.invalidate_user_tokens(*user_ids)
+        return rows
+
 
 class UserProfileManager(BaseUserManager):
     """Manager for user profiles"""
 
+    def get_queryset(self):
+        return UserProfileQuerySet(self.model, using=self._db)
+
     def create_user(self, email, name, password=None):
         """Create a new user profile"""
         if not email: # if an empty string or null
@@ -22,6 +43,54 @@ class UserProfileManager(BaseUserManager):
 
         return user
 
+    def bulk_create_users(self, users, batch_size=1000, processes=None, skip_existing=False, progress=None, pool=None):
+        """
+        Create many user profiles from dicts with 'email', 'name' and optionally 'password'.
+        Passwords are hashed across a process pool while earlier batches are inserted with
+        bulk_create. processes=1 hashes in this process. A long-lived `pool` can be passed
+        instead, otherwise one is started for the call. progress(done, total) is called
+        after every batch. Returns the created profiles with their ids set.
+        """
+        from profiles_api import signals # imported here because signals imports this module
+
+        users = [dict(user) for user in users]
+        for user in users:
+            if not user.get('email'):
+                raise ValueError("User must have an email address")
+            user['email'] = self.normalize_email(user['email'])
+
+        if skip_existing:
+            existing = set(self.filter(email__in=[user['email'] for user in users]).values_list('email', flat=True))
+            users = [user for user in users if user['email'] not in existing]
+
+        created = []
+        own_pool = pool is None and len(users) > 1
+        if own_pool:
+            pool = hashing.hashing_pool(processes)
+        try:
+            passwords = hashing.hash_passwords([user.get('password') for user in users], pool=pool) # a None password hashes to an unusable one, like set_password()
+            for start in range(0, len(users), batch_size):
+                batch = [
+                    self.model(email=user['email'], name=user['name'], password=next(passwords))
+                    for user in users[start:start + batch_size]
+                ]
+                self.bulk_create(batch)
+
+                if batch[0].pk is None: # backends like SQLite don't return ids from bulk inserts, email is unique though
+                    ids = dict(self.filter(email__in=[user.email for user in batch]).values_list('email', 'id'))
+                    for user in batch:
+                        user.pk = ids[user.email]
+
+                signals.post_bulk_save.send(sender=self.model, objs=batch, created=True)
+                created.extend(batch)
+                if progress is not None:
+                    progress(len(created), len(users))
+        finally:
+            if own_pool and pool is not None:
+                pool.shutdown()
+
+        return created
+
     def create_superuser(self, email, name, password):
         """Create and save a new superuser with given details"""
         user = self.create_user(email, name, password) # when you call a class method, 'self' gets automatically passed in
@@ -39,11 +108,36 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    feed_item_count = models.PositiveIntegerField(default=0, editable=False) # statuses posted, archived ones included (profiles_api/counters.py)
+    last_posted_at = models.DateTimeField(null=True, blank=True, editable=False) # created_on of the latest of them
 
     objects = UserProfileManager()
 
     USERNAME_FIELD = 'email' # overwrites the default USERNAME_FIELD to be email, not user name
     REQUIRED_FIELDS = ['name'] # USERNAME_FIELD is required by default, name is an additional required field
+    COUNTER_FIELDS = ('feed_item_count', 'last_posted_at')
+    AUTH_FIELDS = ('password', 'is_active', 'is_staff', 'is_superuser') # changes to these invalidate the cached tokens
+
+    def save(self, *args, **kwargs):
+        """
+        The counters are only ever changed with F() updates, a save() must not write back a stale copy.
+        Django saves only the loaded fields of a partly loaded instance, the counters are left out of those
+        too; a full save() leaves them out of its UPDATE in _do_update().
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            if deferred:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in self.COUNTER_FIELDS and field.attname not in deferred
+                ]
+        super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        """The UPDATE of a full save(), without the counters. When it matches no row Django inserts one as usual."""
+        if update_fields is None:
+            values = [value for value in values if value[0].name not in self.COUNTER_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
 
     def get_full_name(self): # class method
         """Retrieve full name of user"""
@@ -65,7 +159,77 @@ class ProfileFeedItem(models.Model):
     )
     status_text = models.CharField(max_length=255) # contains the text of the feed update
     created_on = models.DateTimeField(auto_now_add=True) # every time the feed item is created, the time stamp is auto added
+    provisional_id = models.UUIDField(null=True, blank=True, unique=True, editable=False) # id given out by the write-behind queue (profiles_api/writebehind.py)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_on', 'id'], name='feed_created_on_id_idx'), # backs the keyset pagination of the feed
+        ]
 
     def __str__(self): # string representation of our model to tell Python what to do when we convert a model instance into a string. 
         """Return the model as a string"""
         return self.status_text
+
+
+class TimelineEntry(models.Model):
+    """One feed item on one user's materialized timeline, see profiles_api.timeline"""
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        db_index=False # covered by the (owner, created_on, item) index
+    )
+    item = models.ForeignKey(
+        ProfileFeedItem,
+        on_delete=models.CASCADE, # deleting a status drops it from every timeline it was fanned out to
+        related_name='timeline_entries'
+    )
+    created_on = models.DateTimeField() # copy of item.created_on so a timeline page is one index range scan
+
+    class Meta:
+        unique_together = (('owner', 'item'),)
+        indexes = [
+            models.Index(fields=['owner', 'created_on', 'item'], name='timeline_owner_created_idx'),
+        ]
+
+
+class FeedArchiveChunk(models.Model):
+    """
+    A run of archived feed items, zlib compressed, see profiles_api.archive.
+    Chunks hold consecutive items in (created_on, id) order and never span two
+    months, so they don't overlap and each month of history is a contiguous range.
+    """
+    month = models.DateField() # first day of the month the items were posted in
+    first_created_on = models.DateTimeField()
+    first_id = models.IntegerField()
+    last_created_on = models.DateTimeField()
+    last_id = models.IntegerField()
+    item_count = models.PositiveIntegerField()
+    payload = models.BinaryField() # JSON list of [id, user_profile_id, created_on, status_text]
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['first_created_on', 'first_id'], name='archive_first_idx'), # paging forwards in time
+            models.Index(fields=['last_created_on', 'last_id'], name='archive_last_idx'), # paging backwards in time
+            models.Index(fields=['last_id'], name='archive_last_id_idx'), # finding an item by id
+        ]
+
+    def __str__(self):
+        return 'Feed archive %s (%d items)' % (self.month.strftime('%Y-%m'), self.item_count)
+
+
+class FeedChange(models.Model):
+    """
+    A feed item that was created, updated or deleted, written by the signal handlers
+    in the same transaction as the change. The ids order the changes, see profiles_api.changes.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
+    item_id = models.IntegerField() # not a foreign key, the item may be gone
+    op = models.CharField(max_length=7, choices=[(op, op) for op in (CREATED, UPDATED, DELETED)])
+    changed_on = models.DateTimeField(auto_now_add=True, db_index=True) # old changes are trimmed, see changes.trim_if_due()
+
+    def __str__(self):
+        return 'Feed item %d %s' % (self.item_id, self.op)
@@ -0,0 +1,146 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+from profiles_api import archive
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination on a composite (timestamp, id) key.
+    DRF's CursorPagination only keeps the first ordering field in the cursor
+    and breaks ties with an OFFSET. Here both fields go into the opaque
+    cursor, so every page is a single indexed range scan, however deep it is.
+    """
+    ordering = ('-created_on', '-id') # newest first, the id breaks ties between equal timestamps
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse, current_position = self.cursor.reverse, self.cursor.position
+
+        results = self.get_rows(queryset, reverse, current_position) # one extra row tells us whether there's a following page
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None
+
+        self.display_page_controls = self.has_next or self.has_previous # used by the browsable API template
+        return self.page
+
+    def get_rows(self, queryset, reverse, position):
+        """Return up to page_size + 1 rows after the encoded position, in walking order"""
+        ordering = self.ordering
+        if reverse: # walking backwards (previous page) flips the direction of both fields
+            ordering = tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+        queryset = queryset.order_by(*ordering)
+
+        if position is not None:
+            queryset = queryset.filter(self._position_filter(ordering, position))
+
+        return list(queryset[:self.page_size + 1])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._encode_position(self.page[-1]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._encode_position(self.page[0]) if self.page else self.cursor.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _fields(self):
+        """Return the names of the (timestamp, id) key fields"""
+        return tuple(field.lstrip('-') for field in self.ordering)
+
+    def _key(self, row):
+        """Return the (timestamp, id) key of a model instance or values() dict"""
+        return tuple(row[field] if isinstance(row, dict) else getattr(row, field) for field in self._fields())
+
+    def _encode_position(self, row):
+        """Build the cursor position of a model instance or values() dict"""
+        timestamp, pk = self._key(row)
+        return '%s|%d' % (timestamp.isoformat(), pk)
+
+    def _decode_position(self, position):
+        """Parse a cursor position back into a (timestamp, id) pair"""
+        try:
+            timestamp, pk = position.rsplit('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return timestamp, pk
+
+    def _position_filter(self, ordering, position):
+        """Rows strictly after the position in the given ordering"""
+        timestamp, pk = self._decode_position(position)
+        time_field, id_field = self._fields()
+        time_lookup = '__lt' if ordering[0].startswith('-') else '__gt'
+        id_lookup = '__lt' if ordering[1].startswith('-') else '__gt'
+
+        return (
+            Q(**{time_field + time_lookup: timestamp}) |
+            Q(**{time_field: timestamp, id_field + id_lookup: pk})
+        )
+
+
+class TimelineCursorPagination(KeysetCursorPagination):
+    """Keyset pagination over TimelineEntry rows, keyed on (created_on, item)"""
+    ordering = ('-created_on', '-item_id')
+
+
+class ArchiveKeysetPagination(KeysetCursorPagination):
+    """
+    Feed pagination that carries on into the archive once the feed table runs out,
+    see profiles_api.archive. Archived items are all older than the ones in the
+    table, so newest-first pages read the table and then the archive, and previous
+    pages the other way round. Filters on the queryset don't apply to the archive.
+    """
+
+    def get_rows(self, queryset, reverse, position):
+        limit = self.page_size + 1
+        key = self._decode_position(position) if position is not None else None
+        if reverse: # walking back up in time: the archive first, then the table
+            rows = self.archive_rows(queryset, archive.page(key, False, limit))
+            if len(rows) < limit:
+                after = self._encode_position(rows[-1]) if rows else position
+                rows += super().get_rows(queryset, reverse, after)[:limit - len(rows)]
+            return rows
+
+        rows = super().get_rows(queryset, reverse, position)
+        if len(rows) < limit:
+            after = self._key(rows[-1]) if rows else key
+            rows += self.archive_rows(queryset, archive.page(after, True, limit - len(rows)))
+        return rows
+
+    @staticmethod
+    def archive_rows(queryset, items):
+        """Archived items in the shape of the queryset's rows, values() dicts or instances"""
+        if queryset._fields is None:
+            return items
+        return [{field: item.serializable_value(field) for field in queryset._fields} for item in items]
@@ -0,0 +1,37 @@
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from profiles_api.renderers import MessagePackRenderer, msgpack, orjson
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser that decodes UTF-8 bodies with orjson when it's installed. Whatever
+    orjson rejects (eg integers beyond 64 bits, or invalid JSON) goes through the
+    json module, so the results and error messages are JSONParser's.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body) # rejects NaN and Infinity like strict JSONParser
+        except ValueError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
+class MessagePackParser(BaseParser):
+    """Request bodies in MessagePack, the counterpart of MessagePackRenderer"""
+    media_type = MessagePackRenderer.media_type
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as exc: # includes truncated bodies and trailing bytes
+            raise ParseError('MessagePack parse error - %s' % exc)
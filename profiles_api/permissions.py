@@ -26,4 +26,4 @@ class UpdateOwnStatus(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.user_profile.id == request.user.id
+        return obj.user_profile_id == request.user.id # compare the FK column directly, obj.user_profile.id would load the related profile row
@@ -0,0 +1,100 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError: # optional dependency, the renderer falls back to the standard json module
+    orjson = None
+
+try:
+    import msgpack
+except ImportError: # optional dependency, settings only enable MessagePackRenderer when it's installed
+    msgpack = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it's installed.
+    The output is byte-identical to JSONRenderer's compact output: anything orjson
+    doesn't encode natively goes through DRF's encoder, and pretty printing, ASCII
+    output or payloads orjson rejects are left to JSONRenderer. Floats are the one
+    exception, orjson may format them differently (eg 1e16 instead of 1e+16).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact or
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except TypeError: # eg non-string dict keys or integers beyond 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # same strict javascript subset escaping as JSONRenderer
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class NDJSONRenderer(FastJSONRenderer):
+    """
+    Newline delimited JSON, one document per line.
+    Exports stream their rows themselves, this renders everything else
+    (eg error responses) for clients that asked for NDJSON.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        if not isinstance(data, list):
+            data = [data]
+        return b''.join(self.render_line(item) for item in data)
+
+    def render_line(self, item):
+        """Render one document followed by a newline"""
+        return super().render(item) + b'\n'
+
+
+class EventStreamRenderer(FastJSONRenderer):
+    """
+    Server-Sent Events, the change stream writes its events itself with
+    render_event(). This renders everything else (eg error responses) as one
+    `error` event for clients that asked for text/event-stream.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return self.render_event(data, event='error')
+
+    def render_event(self, data, event=None, event_id=None):
+        """One event, compact JSON never spans lines so it fits a single data field"""
+        lines = []
+        if event_id is not None:
+            lines.append(b'id: %d' % event_id)
+        if event is not None:
+            lines.append(b'event: ' + event.encode())
+        lines.append(b'data: ' + super().render(data))
+        return b'\n'.join(lines) + b'\n\n'
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack, a binary JSON: the same documents as the JSON renderers, a fair
+    bit smaller and faster to decode. Dates, decimals, UUIDs and the like become
+    the same strings (or numbers) the JSON renderers would output.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, default=encoders.JSONEncoder().default, use_bin_type=True)
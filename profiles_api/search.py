@@ -0,0 +1,88 @@
+"""
+Trigram full-text index for profile search.
+On SQLite the index is an FTS5 table over UserProfile.name and email that
+triggers keep in sync with the profiles table. Other backends have no index
+and search falls back to DRF's icontains lookups.
+"""
+PROFILE_TABLE = 'profiles_api_userprofile'
+INDEX_TABLE = 'profiles_api_userprofile_fts'
+INDEXED_COLUMNS = ('name', 'email')
+
+_available = {} # connection alias -> whether the index exists
+
+
+def supports_search_index(connection):
+    """The trigram tokenizer needs SQLite 3.34 or newer"""
+    if connection.vendor != 'sqlite':
+        return False
+    from sqlite3 import sqlite_version_info
+    return sqlite_version_info >= (3, 34, 0)
+
+
+def create_search_index(schema_editor):
+    """Create the index table, its sync triggers, and index existing rows"""
+    if not supports_search_index(schema_editor.connection):
+        return
+
+    columns = ', '.join(INDEXED_COLUMNS)
+    new_values = ', '.join('new.' + column for column in INDEXED_COLUMNS)
+    old_values = ', '.join('old.' + column for column in INDEXED_COLUMNS)
+    statements = [
+        "CREATE VIRTUAL TABLE {index} USING fts5({columns}, content='{table}', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER {index}_ai AFTER INSERT ON {table} BEGIN "
+        "INSERT INTO {index}(rowid, {columns}) VALUES (new.id, {new}); END",
+        "CREATE TRIGGER {index}_ad AFTER DELETE ON {table} BEGIN "
+        "INSERT INTO {index}({index}, rowid, {columns}) VALUES ('delete', old.id, {old}); END",
+        # only name/email changes touch the index, password or last_login updates don't
+        "CREATE TRIGGER {index}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+        "INSERT INTO {index}({index}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+        "INSERT INTO {index}(rowid, {columns}) VALUES (new.id, {new}); END",
+        "INSERT INTO {index}({index}) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        schema_editor.execute(statement.format(
+            index=INDEX_TABLE, table=PROFILE_TABLE, columns=columns, new=new_values, old=old_values,
+        ))
+
+
+def drop_search_index(schema_editor):
+    """Remove the index table and its triggers"""
+    if not supports_search_index(schema_editor.connection):
+        return
+
+    for suffix in ('_ai', '_ad', '_au'):
+        schema_editor.execute('DROP TRIGGER IF EXISTS %s%s' % (INDEX_TABLE, suffix))
+    schema_editor.execute('DROP TABLE IF EXISTS %s' % INDEX_TABLE)
+
+
+def search_index_available(connection):
+    """Check once per connection alias whether the index table exists"""
+    if connection.alias not in _available:
+        _available[connection.alias] = (
+            supports_search_index(connection) and
+            INDEX_TABLE in connection.introspection.table_names()
+        )
+    return _available[connection.alias]
+
+
+def match_expression(terms):
+    """
+    Build an FTS5 query that requires every term.
+    Each term is quoted as a phrase, so the trigram tokenizer matches it as a
+    substring of either column, like the icontains lookups it replaces.
+    """
+    return ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def search(queryset, terms):
+    """Filter a UserProfile queryset to rows matching all terms, best matches first"""
+    return queryset.extra(
+        select={'search_rank': '%s.rank' % INDEX_TABLE},
+        tables=[INDEX_TABLE],
+        where=[
+            '%s.rowid = %s.id' % (INDEX_TABLE, PROFILE_TABLE),
+            '%s MATCH %%s' % INDEX_TABLE,
+        ],
+        params=[match_expression(terms)],
+        order_by=['search_rank'], # bm25 rank, lower is a better match
+    )
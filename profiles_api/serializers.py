@@ -1,5 +1,76 @@
-from rest_framework import serializers
+from django.db import connections, router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, serializers
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from profiles_api import hashing
+from profiles_api.metrics import TimedSerializerMixin, timed
 from profiles_api import models # lets us access UserProfile model we created
+from profiles_api import signals
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path for a ModelSerializer's list output.
+    Rows come straight from queryset.values() and are turned into dicts by field
+    accessors compiled once per serializer class, instead of building model instances
+    and walking the fields for each of them. The output matches the serializer's.
+    """
+    identity_fields = (
+        serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+        serializers.PrimaryKeyRelatedField, # values() already returns the related pk
+    )
+
+    _compiled = {}
+
+    def __init__(self, accessors):
+        self.accessors = accessors # (output name, values() key, converter or None) in output order
+        self.columns = tuple(source for name, source, convert in accessors)
+        self.converters = tuple((name, convert) for name, source, convert in accessors if convert is not None)
+        self.renamed = any(name != source for name, source, convert in accessors)
+
+    @classmethod
+    def for_serializer(cls, serializer_class):
+        """Return the compiled fast path of a serializer class, or None if its fields aren't all plain columns"""
+        if serializer_class not in cls._compiled:
+            cls._compiled[serializer_class] = cls.compile(serializer_class)
+        return cls._compiled[serializer_class]
+
+    @classmethod
+    def compile(cls, serializer_class):
+        accessors = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if '.' in field.source or field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+                return None
+            if type(field) is serializers.PrimaryKeyRelatedField and field.pk_field is not None:
+                return None
+            convert = None if isinstance(field, cls.identity_fields) else field.to_representation
+            accessors.append((name, field.source, convert))
+        return cls(tuple(accessors))
+
+    def values(self, queryset):
+        """Restrict a queryset to the columns the output needs, plus any extra() selects it may be ordered by"""
+        return queryset.values(*self.columns, *queryset.query.extra_select)
+
+    def to_representation(self, rows):
+        """Turn values() rows into the serializer's output, None is passed through like DRF does"""
+        accessors = self.accessors
+        converters = self.converters
+        width = len(accessors)
+        data = []
+        with timed('serializer_duration_seconds'): # rows may be a lazy queryset, its queries are left out
+            for row in rows:
+                if self.renamed or len(row) != width:
+                    item = {name: row[source] for name, source, convert in accessors}
+                else:
+                    item = row.copy() # values() dicts already hold the columns in output order, the paginator still needs the raw row
+                for name, convert in converters:
+                    value = item[name]
+                    if value is not None:
+                        item[name] = convert(value)
+                data.append(item)
+        return data
 
 
 class HelloSerializer(serializers.Serializer):
@@ -7,12 +78,68 @@ class HelloSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=10) # similar to Django forms, take care of validation rules
 
 
-class UserProfileSerializer(serializers.ModelSerializer): # ModelSerializer has extra functionality
+class LoginSerializer(AuthTokenSerializer):
+    """
+    AuthTokenSerializer that verifies the password on the login hashing pool
+    instead of calling authenticate() in the request thread. The user's token is
+    fetched with the user, so logging in again costs a single query. A hash made
+    with an outdated hasher or cost is replaced by the one the pool computed.
+    """
+
+    def validate(self, attrs):
+        username, password = attrs.get('username'), attrs.get('password')
+        user = (
+            models.UserProfile.objects.select_related('auth_token')
+            .filter(**{models.UserProfile.USERNAME_FIELD: username}).first()
+        )
+
+        try:
+            valid, rehashed = hashing.verify_password(password, user.password if user else None)
+        except hashing.LoginPoolBusy:
+            raise exceptions.Throttled(wait=1) # sheds the login instead of queueing it behind the backlog
+
+        if not valid or not user.is_active:
+            raise serializers.ValidationError(_('Unable to log in with provided credentials.'), code='authorization')
+
+        if rehashed:
+            # a queryset update, so only the hash is written (UserProfileQuerySet drops the cached tokens,
+            # which hold the old one). Matching on the old hash keeps a concurrent password change.
+            models.UserProfile.objects.filter(pk=user.pk, password=user.password).update(password=rehashed)
+
+        attrs['user'] = user
+        return attrs
+
+
+class UserProfileListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """Creates many user profiles at once through UserProfileManager.bulk_create_users"""
+
+    def validate(self, attrs):
+        """Reject payloads that contain the same email twice"""
+        seen = set()
+        duplicates = set()
+        for user in attrs:
+            email = models.UserProfile.objects.normalize_email(user['email'])
+            if email in seen:
+                duplicates.add(email)
+            seen.add(email)
+
+        if duplicates:
+            raise serializers.ValidationError('Duplicate emails: %s' % ', '.join(sorted(duplicates)))
+
+        return attrs
+
+    def create(self, validated_data):
+        return models.UserProfile.objects.bulk_create_users(validated_data, pool=hashing.shared_hashing_pool())
+
+
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer): # ModelSerializer has extra functionality
     """Serializes a user profile object"""
 
     class Meta: # for ModelSerializer, you need to create a meta class to point to a specific model in the project
         model = models.UserProfile # sets serializer to point to our model
-        fields = ('id', 'email', 'name', 'password') # tuple of fields we want to make accessible in our model
+        list_serializer_class = UserProfileListSerializer # used for many=True, hashes passwords in a process pool and inserts in batches
+        fields = ('id', 'email', 'name', 'password', 'feed_item_count', 'last_posted_at') # tuple of fields we want to make accessible in our model
+        read_only_fields = ('feed_item_count', 'last_posted_at') # maintained by profiles_api.counters
         extra_kwargs = {
             'password': { # keys of the dict are the fields that you want to add custom configuration to
                 'write_only': True, # when we create a password field for our model, set it to write_only=True
@@ -48,11 +175,56 @@ class UserProfileSerializer(serializers.ModelSerializer): # ModelSerializer has
 
         return super().update(instance, validated_data)
 
-class ProfileFeedItemSerializer(serializers.ModelSerializer):
+class ProfileFeedItemListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """
+    Serializes many profile feed items at once.
+    Used automatically when ProfileFeedItemSerializer is created with many=True,
+    creates and updates go through bulk_create/bulk_update instead of one query per item.
+    """
+    batch_size = 500 # rows per UPDATE, Django lowers it further if the backend needs to
+
+    def create(self, validated_data):
+        """Insert all items with one INSERT per batch"""
+        model = self.child.Meta.model
+        items = [model(**attrs) for attrs in validated_data]
+        using = router.db_for_write(model)
+
+        with transaction.atomic(using=using):
+            model.objects.using(using).bulk_create(items) # Django picks the largest batch the backend accepts
+
+            if items and not connections[using].features.can_return_ids_from_bulk_insert:
+                # SQLite can't hand back the new ids, but it holds the write lock from the first
+                # INSERT until the transaction commits, so the newest rows in the table are ours
+                ids = model.objects.using(using).order_by('-id').values_list('id', flat=True)[:len(items)]
+                for item, pk in zip(items, reversed(ids)):
+                    item.id = pk
+
+            signals.post_bulk_save.send(sender=model, objs=items, created=True) # bulk_create doesn't send post_save
+
+        return items
+
+    def update(self, instances, validated_data):
+        """Update all items with one UPDATE per batch, instances line up with validated_data"""
+        fields = set()
+        for instance, attrs in zip(instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(instance, attr, value)
+            fields.update(attrs)
+
+        if fields:
+            model = self.child.Meta.model
+            model.objects.bulk_update(instances, sorted(fields), batch_size=self.batch_size)
+            signals.post_bulk_save.send(sender=model, objs=instances, created=False)
+
+        return instances
+
+
+class ProfileFeedItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializes profile feed items"""
 
     class Meta:
         model = models.ProfileFeedItem
+        list_serializer_class = ProfileFeedItemListSerializer # used for many=True, ie the bulk endpoints
         fields = ('id', 'user_profile', 'status_text', 'created_on') # by default Django adds key 'id' to all models we create
         extra_kwargs = {
             'user_profile': {
@@ -0,0 +1,102 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from rest_framework.authtoken.models import Token
+
+from profiles_api import authentication
+from profiles_api import caching
+from profiles_api import changes
+from profiles_api import counters
+from profiles_api import models
+from profiles_api import timeline
+
+
+# Sent by bulk_create/bulk_update based writes, which skip the per-object post_save signal.
+# sender is the model class, objs the saved instances, created whether they were inserted.
+post_bulk_save = Signal(providing_args=['objs', 'created'])
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """Forget a token as soon as it's deleted (logout, user deletion)"""
+    authentication.invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=models.UserProfile)
+def invalidate_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """A saved profile may have been deactivated, had its password or its permissions changed"""
+    if created:
+        return
+    if update_fields is not None and not set(models.UserProfile.AUTH_FIELDS) & set(update_fields):
+        return
+
+    authentication.invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+def fan_out_created_item(sender, instance, created, **kwargs):
+    """Put a new status on its recipients' timelines"""
+    if created:
+        timeline.fan_out([instance])
+
+
+@receiver(post_bulk_save, sender=models.ProfileFeedItem)
+def fan_out_created_items(sender, objs, created, **kwargs):
+    """Put a batch of new statuses on their recipients' timelines"""
+    if created:
+        timeline.fan_out(objs)
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+def log_saved_item(sender, instance, created, **kwargs):
+    """Feed the change stream, in the transaction of the write"""
+    changes.record(models.FeedChange.CREATED if created else models.FeedChange.UPDATED, [instance.id])
+
+
+@receiver(post_bulk_save, sender=models.ProfileFeedItem)
+def log_saved_items(sender, objs, created, **kwargs):
+    changes.record(models.FeedChange.CREATED if created else models.FeedChange.UPDATED, [obj.id for obj in objs])
+
+
+@receiver(post_delete, sender=models.ProfileFeedItem)
+def log_deleted_item(sender, instance, **kwargs):
+    changes.record(models.FeedChange.DELETED, [instance.id])
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+def count_created_item(sender, instance, created, **kwargs):
+    """Keep the author's feed_item_count and last_posted_at up to date"""
+    if created:
+        counters.items_created([instance])
+
+
+@receiver(post_bulk_save, sender=models.ProfileFeedItem)
+def count_created_items(sender, objs, created, **kwargs):
+    if created:
+        counters.items_created(objs)
+
+
+@receiver(post_delete, sender=models.ProfileFeedItem)
+def uncount_deleted_item(sender, instance, **kwargs):
+    counters.item_deleted(instance)
+
+
+@receiver(pre_delete, sender=models.UserProfile)
+def mark_deleting_profile(sender, instance, **kwargs):
+    """The statuses of a deleted profile go first, their counters needn't follow"""
+    counters.profile_deleting(instance.pk)
+
+
+@receiver(post_delete, sender=models.UserProfile)
+def unmark_deleted_profile(sender, instance, **kwargs):
+    counters.profile_deleted(instance.pk)
+
+
+@receiver(post_save, sender=models.UserProfile)
+@receiver(post_delete, sender=models.UserProfile)
+@receiver(post_bulk_save, sender=models.UserProfile)
+@receiver(post_save, sender=models.ProfileFeedItem)
+@receiver(post_delete, sender=models.ProfileFeedItem)
+@receiver(post_bulk_save, sender=models.ProfileFeedItem)
+def invalidate_cached_responses(sender, **kwargs):
+    """Any write makes the cached responses built from that model stale"""
+    caching.bump_version(sender)
@@ -1,3 +1,2297 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import gzip
+import importlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from benchmarks import compare
+from profiles_project import db
+from profiles_project import preload
+from profiles_project import routers
+from profiles_project.db import database_from_env
+from profiles_project.db.pool import ConnectionPool, PoolTimeout
+from profiles_api import archive
+from profiles_api import authentication
+from profiles_api import caching
+from profiles_api import changes
+from profiles_api import compression
+from profiles_api import counters
+from profiles_api import hashing
+from profiles_api import metrics
+from profiles_api import models
+from profiles_api import serializers
+from profiles_api import throttling
+from profiles_api import writebehind
+from profiles_api import views
+from profiles_api.asgi import AsgiHandler
+from profiles_api.parsers import FastJSONParser
+from profiles_api.renderers import FastJSONRenderer, msgpack
+
+
+FEED_URL = '/api/feed/'
+PROFILE_URL = '/api/profile/'
+
+
+class ApiTestCase(TestCase):
+    """TestCase that starts every test with empty caches, they outlive the per-test transaction"""
+
+    def setUp(self):
+        super().setUp()
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        throttling.reset()
+
+
+def create_user(email='test@example.com', name='Test', password='testpass123'):
+    """Create a user profile for the tests"""
+    return models.UserProfile.objects.create_user(email=email, name=name, password=password)
+
+
+def token_client(user):
+    """Return an API client authenticated with the user's token"""
+    client = APIClient()
+    token, _ = Token.objects.get_or_create(user=user)
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    return client
+
+
+class FeedPaginationTests(ApiTestCase):
+    """Test the keyset pagination of the feed endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        models.ProfileFeedItem.objects.bulk_create([
+            models.ProfileFeedItem(user_profile=self.user, status_text='status %d' % i)
+            for i in range(25)
+        ])
+
+    def test_walk_forwards_and_backwards(self):
+        """Following next then previous links visits every item exactly once"""
+        seen = []
+        url = FEED_URL + '?page_size=10'
+        pages = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            pages.append([item['id'] for item in res.data['results']])
+            seen.extend(pages[-1])
+            url = res.data['next']
+
+        expected = list(
+            models.ProfileFeedItem.objects.order_by('-created_on', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([item['id'] for item in res.data['results']], pages[1])
+
+    def test_items_sharing_a_timestamp_are_not_skipped(self):
+        """Ties on created_on are broken by id"""
+        models.ProfileFeedItem.objects.update(created_on=models.ProfileFeedItem.objects.first().created_on)
+        res = self.client.get(FEED_URL + '?page_size=7')
+        ids = [item['id'] for item in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            ids.extend(item['id'] for item in res.data['results'])
+
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_invalid_cursor(self):
+        """A tampered cursor returns 404"""
+        res = self.client.get(FEED_URL + '?cursor=cD1nYXJiYWdl')
+        self.assertEqual(res.status_code, 404)
+
+
+class QueryCountTests(ApiTestCase):
+    """Guard against query counts that grow with the number of rows"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        self.client.get(FEED_URL) # warm the token cache so every measured request sees the same auth cost
+
+    def add_items(self, count):
+        """Create feed items for a fresh user each"""
+        start = models.UserProfile.objects.count()
+        for i in range(start, start + count):
+            author = create_user(email='author%d@example.com' % i, name='Author %d' % i, password=None)
+            models.ProfileFeedItem.objects.create(user_profile=author, status_text='status %d' % i)
+
+    def count_queries(self, method, url, data=None):
+        """Return the queries run while serving a request"""
+        with CaptureQueriesContext(connection) as context:
+            res = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(res.status_code, 300)
+        return context.captured_queries
+
+    def test_feed_list_is_constant(self):
+        """Listing the feed doesn't fetch authors one by one"""
+        self.add_items(1)
+        small = len(self.count_queries('get', FEED_URL))
+        self.add_items(20)
+        self.assertEqual(len(self.count_queries('get', FEED_URL)), small)
+
+    def test_profile_list_is_constant(self):
+        """Listing profiles runs the same queries whatever the table size"""
+        self.add_items(1)
+        small = len(self.count_queries('get', PROFILE_URL))
+        self.add_items(20)
+        self.assertEqual(len(self.count_queries('get', PROFILE_URL)), small)
+
+    def test_feed_update_does_not_load_author(self):
+        """UpdateOwnStatus compares user_profile_id instead of loading the profile"""
+        item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='before')
+        queries = self.count_queries('patch', '%s%d/' % (FEED_URL, item.id), {'status_text': 'after'})
+
+        profile_table = connection.ops.quote_name(models.UserProfile._meta.db_table)
+        self.assertFalse([
+            query for query in queries
+            if ('FROM %s' % profile_table) in query['sql']
+        ])
+        item.refresh_from_db()
+        self.assertEqual(item.status_text, 'after')
+
+    def test_feed_delete_is_constant(self):
+        """Deleting a status doesn't depend on how much else is in the feed"""
+        first = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='one')
+        small = len(self.count_queries('delete', '%s%d/' % (FEED_URL, first.id)))
+        self.add_items(20)
+        second = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='two')
+        self.assertEqual(len(self.count_queries('delete', '%s%d/' % (FEED_URL, second.id))), small)
+
+
+class FakeRedis:
+    """Local stand-in for a redis-py client"""
+
+    def __init__(self):
+        self.data = {}
+
+    @classmethod
+    def from_url(cls, url):
+        return cls()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def flushdb(self):
+        self.data.clear()
+
+
+class CachedTokenAuthenticationTests(ApiTestCase):
+    """Test the cached token authentication"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        self.token = Token.objects.get(user=self.user)
+
+    def token_queries(self):
+        """Return the token lookups run by a feed request"""
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(FEED_URL)
+        self.assertEqual(res.status_code, 200)
+        return [query for query in context.captured_queries if 'authtoken_token' in query['sql']]
+
+    def test_second_request_is_served_from_cache(self):
+        """Only the first request looks the token up in the database"""
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(len(self.token_queries()), 0)
+
+    def test_deleted_token_is_rejected(self):
+        """Deleting the token invalidates the cached entry"""
+        self.token_queries()
+        self.token.delete()
+        self.assertEqual(self.client.get(FEED_URL).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        """Deactivating the user invalidates the cached entry"""
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(FEED_URL).status_code, 401)
+
+    def test_password_change_invalidates(self):
+        """Changing the password drops the cached entry"""
+        self.token_queries()
+        self.user.set_password('newpass123')
+        self.user.save(update_fields=['password'])
+        self.assertEqual(len(self.token_queries()), 1)
+
+    def test_queryset_updates_invalidate(self):
+        """Bulk updates skip the signals, the queryset drops the tokens itself"""
+        self.token_queries()
+        models.UserProfile.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(len(self.token_queries()), 1)
+
+        models.UserProfile.objects.filter(pk=self.user.pk).update(feed_item_count=F('feed_item_count') + 1)
+        self.assertEqual(len(self.token_queries()), 0) # the counters don't matter to authentication
+
+        models.UserProfile.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(FEED_URL).status_code, 401)
+
+    def test_unrelated_save_keeps_cache(self):
+        """Saving fields that can't affect authentication keeps the entry"""
+        self.token_queries()
+        self.user.name = 'Renamed'
+        self.user.save(update_fields=['name'])
+        self.assertEqual(len(self.token_queries()), 0)
+
+    @override_settings(
+        CACHES={**settings.CACHES, 'auth-tokens': {
+            'BACKEND': 'profiles_api.cache_backends.RedisCache',
+            'LOCATION': 'redis://localhost:6379/0',
+            'OPTIONS': {'CLIENT_CLASS': 'profiles_api.tests.FakeRedis'},
+        }},
+    )
+    def test_redis_compatible_backend(self):
+        """The token cache works against any redis-py compatible client"""
+        self.assertEqual(len(self.token_queries()), 1)
+        self.assertEqual(len(self.token_queries()), 0)
+        authentication.invalidate_user_tokens(self.user.pk)
+        self.assertEqual(len(self.token_queries()), 1)
+
+
+class ProfileSearchTests(ApiTestCase):
+    """Test profile search through the trigram index"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = create_user(email='alice@example.com', name='Alice Smith', password=None)
+        self.bob = create_user(email='bob@sample.org', name='Bob Jones', password=None)
+        self.client = APIClient()
+
+    def search(self, term):
+        """Return the emails matched by a search"""
+        res = self.client.get(PROFILE_URL, {'search': term})
+        self.assertEqual(res.status_code, 200)
+        return sorted(profile['email'] for profile in res.data)
+
+    def test_search_uses_index(self):
+        """Searches run against the index table"""
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.search('smith'), ['alice@example.com'])
+        self.assertIn('MATCH', context.captured_queries[-1]['sql'])
+
+    def test_search_matches_substrings_of_either_field(self):
+        """Terms match anywhere in the name or email, case insensitively"""
+        self.assertEqual(self.search('ONE'), ['bob@sample.org'])
+        self.assertEqual(self.search('sample'), ['bob@sample.org'])
+        self.assertEqual(self.search('ali exa'), ['alice@example.com'])
+        self.assertEqual(self.search('ali sample'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        """Triggers keep the index in sync with the profiles table"""
+        self.alice.name = 'Alice Walker'
+        self.alice.save()
+        self.assertEqual(self.search('smith'), [])
+        self.assertEqual(self.search('walker'), ['alice@example.com'])
+
+        self.alice.delete()
+        self.assertEqual(self.search('walker'), [])
+
+    def test_short_terms_fall_back_to_icontains(self):
+        """Terms shorter than a trigram still work"""
+        self.assertEqual(self.search('bo'), ['bob@sample.org'])
+
+    def test_quotes_are_escaped(self):
+        """FTS syntax in the search term is treated as text"""
+        self.assertEqual(self.search('"smith'), [])
+        self.assertEqual(self.search('smith*'), [])
+
+
+class FeedBulkTests(ApiTestCase):
+    """Test the bulk create/update/delete endpoints of the feed"""
+
+    bulk_url = FEED_URL + 'bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.other = create_user(email='other@example.com', password=None)
+        self.client = token_client(self.user)
+
+    def test_bulk_create(self):
+        """Items are created in one go and returned with their ids"""
+        res = self.client.post(self.bulk_url, [{'status_text': 'one'}, {'status_text': 'two'}], format='json')
+
+        self.assertEqual(res.status_code, 201)
+        items = models.ProfileFeedItem.objects.order_by('id')
+        self.assertEqual([item.status_text for item in items], ['one', 'two'])
+        self.assertEqual([item['id'] for item in res.data], [item.id for item in items])
+        self.assertTrue(all(item.user_profile_id == self.user.id for item in items))
+
+    def test_bulk_create_reports_per_item_errors(self):
+        """One invalid item rejects the whole batch and is reported at its position"""
+        res = self.client.post(self.bulk_url, [{'status_text': 'ok'}, {'status_text': ''}], format='json')
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('status_text', res.data[1])
+        self.assertFalse(models.ProfileFeedItem.objects.exists())
+
+    def test_bulk_create_uses_constant_queries(self):
+        """Creating more items doesn't run more queries"""
+        self.client.get(FEED_URL)
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.bulk_url, [{'status_text': 'a'}], format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(self.bulk_url, [{'status_text': str(i)} for i in range(50)], format='json')
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_bulk_update(self):
+        """Own items are updated in a single request"""
+        first = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='first')
+        second = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='second')
+
+        res = self.client.patch(self.bulk_url, [
+            {'id': first.id, 'status_text': 'first!'},
+            {'id': second.id, 'status_text': 'second!'},
+        ], format='json')
+
+        self.assertEqual(res.status_code, 200)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status_text, second.status_text), ('first!', 'second!'))
+
+    def test_bulk_update_enforces_ownership(self):
+        """Someone else's item rejects the whole batch"""
+        own = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='own')
+        theirs = models.ProfileFeedItem.objects.create(user_profile=self.other, status_text='theirs')
+
+        res = self.client.patch(self.bulk_url, [
+            {'id': own.id, 'status_text': 'changed'},
+            {'id': theirs.id, 'status_text': 'changed'},
+            {'id': 0, 'status_text': 'changed'},
+        ], format='json')
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('id', res.data[1])
+        self.assertIn('id', res.data[2])
+        own.refresh_from_db()
+        self.assertEqual(own.status_text, 'own')
+
+    def test_bulk_delete(self):
+        """Own items are deleted by id, anything else rejects the batch"""
+        own = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='own')
+        theirs = models.ProfileFeedItem.objects.create(user_profile=self.other, status_text='theirs')
+
+        res = self.client.delete(self.bulk_url, {'ids': [own.id, theirs.id]}, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data['ids'][0], {})
+        self.assertEqual(models.ProfileFeedItem.objects.count(), 2)
+
+        res = self.client.delete(self.bulk_url, {'ids': [own.id]}, format='json')
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(list(models.ProfileFeedItem.objects.all()), [theirs])
+
+    def test_bulk_requires_authentication(self):
+        """Anonymous users can't use the bulk endpoints"""
+        res = APIClient().post(self.bulk_url, [{'status_text': 'one'}], format='json')
+        self.assertEqual(res.status_code, 401)
+
+
+class BulkUserProvisioningTests(ApiTestCase):
+    """Test bulk creation of user profiles"""
+
+    users = [
+        {'email': 'one@EXAMPLE.com', 'name': 'One', 'password': 'password-one'},
+        {'email': 'two@example.com', 'name': 'Two', 'password': 'password-two'},
+        {'email': 'three@example.com', 'name': 'Three'},
+    ]
+
+    def test_bulk_create_users(self):
+        """Users get ids, normalized emails and hashed passwords"""
+        progress = []
+        created = models.UserProfile.objects.bulk_create_users(
+            self.users, batch_size=2, processes=1, progress=lambda done, total: progress.append((done, total)),
+        )
+
+        self.assertEqual([user.email for user in created], ['one@example.com', 'two@example.com', 'three@example.com'])
+        self.assertTrue(all(user.pk for user in created))
+        self.assertEqual(progress, [(2, 3), (3, 3)])
+
+        one = models.UserProfile.objects.get(email='one@example.com')
+        self.assertTrue(one.check_password('password-one'))
+        self.assertFalse(models.UserProfile.objects.get(email='three@example.com').has_usable_password())
+
+    def test_hashing_in_worker_processes(self):
+        """Hashes made in the process pool verify like any other"""
+        created = models.UserProfile.objects.bulk_create_users(self.users[:2], processes=2)
+        self.assertTrue(created[1].check_password('password-two'))
+
+    def test_skip_existing(self):
+        """Existing emails are left alone when asked to"""
+        create_user(email='one@example.com', password=None)
+        created = models.UserProfile.objects.bulk_create_users(self.users, processes=1, skip_existing=True)
+        self.assertEqual(len(created), 2)
+
+    def test_missing_email(self):
+        """Every user needs an email, like create_user"""
+        with self.assertRaises(ValueError):
+            models.UserProfile.objects.bulk_create_users([{'email': '', 'name': 'Nobody'}], processes=1)
+
+    @override_settings(PASSWORD_HASHING_PROCESSES=1)
+    def test_bulk_endpoint_is_staff_only(self):
+        """Only staff can provision users through the API"""
+        payload = [{'email': 'new@example.com', 'name': 'New', 'password': 'newpass123'}]
+        user = create_user(password=None)
+        res = token_client(user).post(PROFILE_URL + 'bulk/', payload, format='json')
+        self.assertEqual(res.status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        res = token_client(user).post(PROFILE_URL + 'bulk/', payload, format='json')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data[0]['email'], 'new@example.com')
+        self.assertIsNotNone(res.data[0]['id'])
+
+    @override_settings(PASSWORD_HASHING_PROCESSES=1)
+    def test_bulk_endpoint_rejects_duplicates(self):
+        """The same email twice in one payload is a validation error"""
+        staff = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'adminpass123')
+        payload = [{'email': 'dup@example.com', 'name': 'Dup', 'password': 'duppass123'}] * 2
+        res = token_client(staff).post(PROFILE_URL + 'bulk/', payload, format='json')
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(models.UserProfile.objects.filter(email='dup@example.com').exists())
+
+    def test_bulk_endpoint_reuses_its_pool(self):
+        """Requests hash on one long-lived pool instead of starting worker processes each time"""
+        staff = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'adminpass123')
+        client = token_client(staff)
+        executor = ThreadPoolExecutor(2) # stands in for the process pool
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(hashing, '_shared_pool', None), \
+                mock.patch.object(hashing, 'hashing_pool', return_value=executor) as hashing_pool:
+            for batch in range(2):
+                payload = [{'email': 'user%d-%d@example.com' % (batch, i), 'name': 'User', 'password': 'userpass123'} for i in range(2)]
+                self.assertEqual(client.post(PROFILE_URL + 'bulk/', payload, format='json').status_code, 201)
+        hashing_pool.assert_called_once_with()
+        self.assertTrue(models.UserProfile.objects.get(email='user1-1@example.com').check_password('userpass123'))
+
+    def test_command(self):
+        """The management command reads users from a CSV file"""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write('email,name,password\na@example.com,A,pass-a\nb@example.com,B,pass-b\n')
+        self.addCleanup(os.remove, csv_file.name)
+
+        out = io.StringIO()
+        call_command('bulk_create_users', csv_file.name, '--processes', '1', stdout=out)
+        self.assertIn('Created 2 users', out.getvalue())
+        self.assertTrue(models.UserProfile.objects.get(email='b@example.com').check_password('pass-b'))
+
+
+class TimelineTests(ApiTestCase):
+    """Test the materialized per-user timelines"""
+
+    timeline_url = FEED_URL + 'timeline/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+
+    def timeline(self):
+        """Return the status texts on the user's timeline"""
+        res = self.client.get(self.timeline_url)
+        self.assertEqual(res.status_code, 200)
+        return [item['status_text'] for item in res.data['results']]
+
+    def test_posts_are_fanned_out(self):
+        """Single and bulk posts show up on the timeline, newest first"""
+        self.client.post(FEED_URL, {'status_text': 'single'}, format='json')
+        self.client.post(FEED_URL + 'bulk/', [{'status_text': 'bulk 1'}, {'status_text': 'bulk 2'}], format='json')
+        self.assertEqual(self.timeline(), ['bulk 2', 'bulk 1', 'single'])
+
+    def test_other_users_posts_are_not_on_the_timeline(self):
+        """Without a follow graph a timeline only holds its owner's statuses"""
+        other = create_user(email='other@example.com', password=None)
+        models.ProfileFeedItem.objects.create(user_profile=other, status_text='theirs')
+        self.assertEqual(self.timeline(), [])
+
+    def test_deletes_are_applied(self):
+        """Deleting a status removes it from the timeline"""
+        item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='gone soon')
+        self.client.delete('%s%d/' % (FEED_URL, item.id))
+        self.assertEqual(self.timeline(), [])
+
+    @override_settings(TIMELINE_MAX_LENGTH=3)
+    def test_timeline_is_capped(self):
+        """Only the newest TIMELINE_MAX_LENGTH entries are kept"""
+        for i in range(5):
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=str(i))
+        self.assertEqual(self.timeline(), ['4', '3', '2'])
+        self.assertEqual(models.TimelineEntry.objects.count(), 3)
+
+    def test_timeline_page_is_constant(self):
+        """Reading a timeline page doesn't depend on how long the timeline is"""
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='first')
+        self.timeline()
+        with CaptureQueriesContext(connection) as small:
+            self.timeline()
+        for i in range(20):
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=str(i))
+        with CaptureQueriesContext(connection) as large:
+            self.timeline()
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_rebuild_command(self):
+        """The rebuild command backfills timelines from the feed items"""
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='old')
+        models.TimelineEntry.objects.all().delete()
+
+        call_command('rebuild_timelines', stdout=io.StringIO())
+        self.assertEqual(self.timeline(), ['old'])
+
+
+class ResponseCacheTests(ApiTestCase):
+    """Test the cached responses and conditional GETs of the read endpoints"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        self.item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='hello')
+
+    def get(self, url, **headers):
+        """Return the response and the number of queries it took"""
+        with CaptureQueriesContext(connection) as context:
+            res = self.client.get(url, HTTP_ACCEPT='application/json', **headers)
+        return res, len(context.captured_queries)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        """A second identical read doesn't touch the database"""
+        first, _ = self.get(FEED_URL)
+        second, queries = self.get(FEED_URL)
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_etag_gives_304(self):
+        """If-None-Match with the current ETag returns 304"""
+        res, _ = self.get(PROFILE_URL + '%d/' % self.user.id)
+        res, _ = self.get(PROFILE_URL + '%d/' % self.user.id, HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+
+    def test_no_304_for_a_missing_object(self):
+        """A validator only matches what the URL actually returned, a missing object is still a 404"""
+        missing = FEED_URL + '%d/' % (self.item.id + 100)
+        res, _ = self.get(missing, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(res.status_code, 404)
+        with mock.patch('profiles_api.caching.time') as clock:
+            clock.time.return_value = time.time() + 2
+            res, _ = self.get(missing, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(res.status_code, 404)
+
+        cache.clear() # a cold cache, the handler's 200 backs the 304 and fills the cache
+        res, _ = self.get(FEED_URL + '%d/' % self.item.id, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(res.status_code, 304)
+        res, queries = self.get(FEED_URL + '%d/' % self.item.id)
+        self.assertEqual((res.status_code, queries), (200, 0))
+
+    def test_if_modified_since_gives_304(self):
+        """If-Modified-Since at or after Last-Modified returns 304"""
+        with mock.patch('profiles_api.caching.time') as clock:
+            clock.time.return_value = time.time() + 2
+            res, _ = self.get(FEED_URL)
+            res, _ = self.get(FEED_URL, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, 304)
+
+    def test_last_modified_waits_for_the_second_to_end(self):
+        """A write later in the same second can't be hidden behind an If-Modified-Since 304"""
+        with mock.patch('profiles_api.caching.time') as clock:
+            clock.time.return_value = 1000.1
+            caching.bump_version(models.ProfileFeedItem)
+            clock.time.return_value = 1000.2
+            res, _ = self.get(FEED_URL)
+            self.assertNotIn('Last-Modified', res) # 1001 could still be the date of a later write
+
+            clock.time.return_value = 1001.5
+            res, _ = self.get(FEED_URL)
+            self.assertEqual(res['Last-Modified'], 'Thu, 01 Jan 1970 00:16:41 GMT')
+            clock.time.return_value = 1001.6
+            caching.bump_version(models.ProfileFeedItem)
+            clock.time.return_value = 1003
+            res, _ = self.get(FEED_URL, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, 200)
+
+    def test_writes_invalidate(self):
+        """Creating, updating and deleting a status all change the cached feed"""
+        first, _ = self.get(FEED_URL)
+
+        self.client.post(FEED_URL, {'status_text': 'new'}, format='json')
+        created, _ = self.get(FEED_URL, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(created.status_code, 200)
+        self.assertEqual(len(created.data['results']), 2)
+
+        self.client.patch(FEED_URL + 'bulk/', [{'id': self.item.id, 'status_text': 'edited'}], format='json')
+        updated, _ = self.get(FEED_URL + '%d/' % self.item.id)
+        self.assertEqual(updated.data['status_text'], 'edited')
+
+        self.client.delete(FEED_URL + '%d/' % self.item.id)
+        deleted, _ = self.get(FEED_URL)
+        self.assertEqual(len(deleted.data['results']), 1)
+
+    def test_cache_is_keyed_on_query_parameters(self):
+        """Different query strings get different responses"""
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='second')
+        everything, _ = self.get(FEED_URL)
+        first_only, _ = self.get(FEED_URL + '?page_size=1')
+
+        self.assertEqual(len(everything.data['results']), 2)
+        self.assertEqual(len(first_only.data['results']), 1)
+        self.assertNotEqual(everything['ETag'], first_only['ETag'])
+
+    def test_permissions_still_apply(self):
+        """Cached responses aren't served to unauthenticated clients"""
+        self.get(FEED_URL)
+        res = APIClient().get(FEED_URL, HTTP_ACCEPT='application/json')
+        self.assertEqual(res.status_code, 401)
+
+
+class FastSerializationTests(ApiTestCase):
+    """The values() list path and the orjson renderer must match DRF byte for byte"""
+
+    texts = ['plain', 'ünïcödé ✓', 'line\nbreak "quoted" \\ back', 'separator \u2028 \u2029', '\x00\x1f control']
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user(name='Zoë \u2028 "Q"')
+        self.client = token_client(self.user)
+        for text in self.texts:
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=text)
+
+    def compare(self, viewset, url):
+        """Fetch a URL with and without the values() path and compare the bytes"""
+        fast = self.client.get(url, HTTP_ACCEPT='application/json').content
+        caches[settings.RESPONSE_CACHE_ALIAS].clear()
+        with mock.patch.object(viewset, 'values_list', False), \
+                mock.patch.object(FastJSONRenderer, 'render', JSONRenderer.render):
+            regular = self.client.get(url, HTTP_ACCEPT='application/json').content
+        self.assertEqual(fast, regular)
+        return fast
+
+    def test_feed_list(self):
+        """Feed pages are identical"""
+        self.compare(views.UserProfileFeedViewSet, FEED_URL)
+        self.compare(views.UserProfileFeedViewSet, FEED_URL + '?page_size=2')
+
+    def test_profile_list_and_search(self):
+        """Profile lists are identical, including ranked searches"""
+        create_user(email='other@example.com', name='Other', password=None)
+        self.compare(views.UserProfileViewSet, PROFILE_URL)
+        self.assertIn(b'other@example.com', self.compare(views.UserProfileViewSet, PROFILE_URL + '?search=other'))
+
+    def test_renderer(self):
+        """FastJSONRenderer matches JSONRenderer for the types DRF's encoder knows"""
+        data = {
+            'text': self.texts,
+            'when': timezone.now(),
+            'day': datetime.date(2020, 5, 13),
+            'amount': decimal.Decimal('1.5'),
+            'id': uuid.uuid4(),
+            'lazy': gettext_lazy('Invalid token.'),
+            'nested': [{'none': None, 'flag': True, 'number': 10 ** 20}],
+            1: 'integer key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+
+
+class ExportTests(ApiTestCase):
+    """Test the streaming NDJSON exports"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        self.items = [
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='status %d' % i)
+            for i in range(5)
+        ]
+
+    def export(self, url, **params):
+        """Return the parsed lines of an export"""
+        res = self.client.get(url + 'export/', params)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(res.streaming_content).splitlines()]
+
+    def test_feed_export_matches_serializer(self):
+        """Every item is exported oldest first, in the serializer's format"""
+        with mock.patch.object(views.UserProfileFeedViewSet, 'export_chunk_size', 2):
+            lines = self.export(FEED_URL)
+        expected = json.loads(JSONRenderer().render(
+            serializers.ProfileFeedItemSerializer(self.items, many=True).data
+        ))
+        self.assertEqual(lines, expected)
+
+    def test_created_on_range(self):
+        """created_after/created_before select a time window"""
+        models.ProfileFeedItem.objects.filter(id=self.items[0].id).update(
+            created_on=timezone.now() - datetime.timedelta(days=2)
+        )
+        since = (timezone.now() - datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.export(FEED_URL, created_after=since)), 4)
+        self.assertEqual(len(self.export(FEED_URL, created_before=since)), 1)
+
+    def test_after_id(self):
+        """after_id resumes an export"""
+        lines = self.export(FEED_URL, after_id=self.items[2].id)
+        self.assertEqual([line['id'] for line in lines], [item.id for item in self.items[3:]])
+
+    def test_after_id_follows_the_export_order(self):
+        """The feed exports in (created_on, id) order, a backdated item doesn't get skipped or repeated"""
+        models.ProfileFeedItem.objects.filter(id=self.items[4].id).update(created_on=timezone.now() - datetime.timedelta(days=1))
+        order = [line['id'] for line in self.export(FEED_URL)]
+        self.assertEqual(order, [self.items[4].id] + [item.id for item in self.items[:4]])
+
+        resumed = [line['id'] for line in self.export(FEED_URL, after_id=order[1])]
+        self.assertEqual(resumed, order[2:])
+
+        last = models.ProfileFeedItem.objects.get(id=order[1])
+        last.delete() # gone by the time the client resumes
+        self.assertEqual(self.client.get(FEED_URL + 'export/', {'after_id': order[1]}).status_code, 400)
+        resumed = self.export(FEED_URL, after_id=order[1], after_created_on=last.created_on.isoformat())
+        self.assertEqual([line['id'] for line in resumed], order[2:])
+
+    def test_invalid_parameters(self):
+        """Bad filter values are rejected before streaming starts"""
+        res = self.client.get(FEED_URL + 'export/', {'created_after': 'yesterday'})
+        self.assertEqual(res.status_code, 400)
+        res = self.client.get(PROFILE_URL + 'export/', {'created_after': '2020-01-01T00:00:00Z'})
+        self.assertEqual(res.status_code, 400)
+
+    def test_profile_export(self):
+        """Profiles export without passwords"""
+        lines = self.export(PROFILE_URL)
+        self.assertEqual(lines, [{
+            'id': self.user.id, 'email': self.user.email, 'name': self.user.name,
+            'feed_item_count': 5, 'last_posted_at': self.items[-1].created_on.isoformat().replace('+00:00', 'Z'),
+        }])
+
+    def test_feed_export_requires_authentication(self):
+        """The feed's permissions apply to its export"""
+        res = APIClient().get(FEED_URL + 'export/')
+        self.assertEqual(res.status_code, 401)
+
+
+class AsgiTests(TransactionTestCase):
+    """Test the ASGI entry point, requests run on pool threads with their own DB connections"""
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.app = AsgiHandler()
+
+    def call(self, method, path, body=b'', headers=(), app=None):
+        """Run one request through the ASGI app and return (status, headers, body)"""
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+            'headers': [(b'host', b'testserver')] + list(headers),
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+        }
+        asyncio.run((app or self.app)(scope, receive, send))
+        headers = dict(sent[0]['headers'])
+        return sent[0]['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+    def auth(self):
+        return (b'authorization', ('Token ' + self.token.key).encode())
+
+    def test_hello_view(self):
+        status, _, body = self.call('GET', '/api/hello-view/')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['message'], 'Hello!')
+
+    def test_feed_round_trip(self):
+        """A POST and the following reads go through Django like they do under WSGI"""
+        status, _, body = self.call(
+            'POST', FEED_URL, json.dumps({'status_text': 'over asgi'}).encode(),
+            [self.auth(), (b'content-type', b'application/json')],
+        )
+        self.assertEqual(status, 201)
+        item_id = json.loads(body)['id']
+
+        status, _, body = self.call('GET', FEED_URL, headers=[self.auth()])
+        self.assertEqual(status, 200)
+        self.assertEqual([item['id'] for item in json.loads(body)['results']], [item_id])
+
+        status, _, body = self.call('GET', '%s%d/' % (FEED_URL, item_id), headers=[self.auth()])
+        self.assertEqual(json.loads(body)['status_text'], 'over asgi')
+
+    def test_streaming_export(self):
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='streamed')
+        status, headers, body = self.call('GET', FEED_URL + 'export/', headers=[self.auth()])
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/x-ndjson')
+        self.assertEqual(json.loads(body.splitlines()[0])['status_text'], 'streamed')
+
+    def test_streaming_response_stays_on_one_thread(self):
+        """A streaming response is iterated and closed on the thread that owns its DB cursor"""
+        models.ProfileFeedItem.objects.bulk_create(
+            models.ProfileFeedItem(user_profile=self.user, status_text='streamed %d' % i) for i in range(50))
+        threads = []
+
+        def record(**kwargs):
+            threads.append(threading.get_ident())
+
+        request_started.connect(record)
+        request_finished.connect(record)
+        self.addCleanup(request_started.disconnect, record)
+        self.addCleanup(request_finished.disconnect, record)
+        for _ in range(5):
+            status, _, body = self.call('GET', FEED_URL + 'export/', headers=[self.auth()])
+            self.assertEqual((status, len(body.splitlines())), (200, 50))
+        self.assertEqual(len(threads), 10)
+        self.assertEqual(threads[0::2], threads[1::2]) # each request finished on the thread it started on
+
+    def test_head(self):
+        status, headers, body = self.call('HEAD', '/api/hello-view/')
+        self.assertEqual((status, body), (200, b''))
+
+    def test_repeated_headers(self):
+        scope = {'method': 'GET', 'path': '/', 'headers': [(b'cookie', b'a=1'), (b'cookie', b'b=2'), (b'accept', b'a/b'), (b'accept', b'c/d')]}
+        environ = self.app.environ(scope, b'')
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2') # cookies are joined with semicolons
+        self.assertEqual(environ['HTTP_ACCEPT'], 'a/b,c/d')
+
+    def test_lanes(self):
+        """Hot reads and the rest run on separate pools"""
+        def lane(method, path):
+            return self.app.lane_for({'method': method, 'path': path})
+
+        for path in ('/api/hello-view/', FEED_URL, FEED_URL + '1/', PROFILE_URL + '1/'):
+            self.assertIs(lane('GET', path), self.app.read_lane)
+        self.assertIs(lane('POST', FEED_URL), self.app.write_lane)
+        self.assertIs(lane('GET', PROFILE_URL), self.app.write_lane)
+
+    def test_saturated_lane_sheds_load(self):
+        """Requests beyond the pool and its waiting room get a 503 without reaching Django"""
+        with override_settings(ASGI_READ_THREADS=1, ASGI_MAX_WAITING=0):
+            app = AsgiHandler()
+        app.read_lane.in_flight = 1
+        status, headers, _ = self.call('GET', '/api/hello-view/', app=app)
+        self.assertEqual(status, 503)
+        self.assertEqual(headers[b'retry-after'], b'1')
+
+
+@override_settings(LOGIN_HASHING_PROCESSES=0)
+class LoginTests(ApiTestCase):
+    """Test the login pipeline"""
+    url = '/api/login/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+
+    def login(self, password='testpass123'):
+        return APIClient().post(self.url, {'username': self.user.email, 'password': password})
+
+    def test_reuses_token(self):
+        """A returning user gets the same token from a single query"""
+        token = self.login().data['token']
+        with CaptureQueriesContext(connection) as context:
+            res = self.login()
+        self.assertEqual(res.data['token'], token)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_invalid_credentials(self):
+        self.assertEqual(self.login('wrong').status_code, 400)
+        res = APIClient().post(self.url, {'username': 'nobody@example.com', 'password': 'testpass123'})
+        self.assertEqual(res.status_code, 400)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login().status_code, 400)
+
+    def test_rehash_on_login(self):
+        """Hashes from another hasher or with another cost are upgraded on login"""
+        models.UserProfile.objects.filter(pk=self.user.pk).update(
+            password=make_password('testpass123', hasher='pbkdf2_sha1')
+        )
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$150000$'))
+
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+    def test_rehash_refreshes_cached_tokens(self):
+        """The cached user would keep the old hash, and a save() of it would write the old hash back"""
+        token = self.login().data['token']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        client.get(FEED_URL)
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.login()
+        self.assertIsNone(authentication.token_cache().get(authentication.token_cache_key(token)))
+
+    def test_busy_pool(self):
+        """Logins are shed with a 429 while the pool is backed up"""
+        with mock.patch.object(hashing, 'verify_password', side_effect=hashing.LoginPoolBusy):
+            res = self.login()
+        self.assertEqual(res.status_code, 429)
+        self.assertIn('Retry-After', res)
+
+    @override_settings(LOGIN_HASHING_PROCESSES=1, LOGIN_MAX_PENDING=4)
+    def test_process_pool(self):
+        """Verification on the worker process gives the same answers"""
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login('wrong').status_code, 400)
+
+
+class FakeConnection:
+    """Stands in for a DB-API connection in the pool tests"""
+
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Test the connection pool behind the pooled PostgreSQL backend"""
+
+    def make_pool(self, **kwargs):
+        return ConnectionPool(FakeConnection, check=lambda connection: connection.healthy, **kwargs)
+
+    def test_reuses_connections(self):
+        pool = self.make_pool()
+        first = pool.acquire()
+        pool.release(first)
+        self.assertIs(pool.acquire(), first)
+        self.assertEqual(pool.stats()['opened'], 1)
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    def test_bounded(self):
+        """Checkouts beyond max_size wait, then time out"""
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        held = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        threading.Timer(0.01, pool.release, [held]).start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(), held)
+
+    def test_health_check(self):
+        """Idle connections failing the check are replaced"""
+        pool = self.make_pool(check_after=0)
+        broken = pool.acquire()
+        pool.release(broken)
+        broken.healthy = False
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, broken)
+        self.assertTrue(broken.closed)
+        self.assertEqual(pool.stats()['failed_checks'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_reset_failure_discards(self):
+        pool = ConnectionPool(FakeConnection, reset=lambda connection: False)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_opens_min_size_up_front(self):
+        pool = self.make_pool(min_size=2)
+        self.assertEqual((pool.stats()['opened'], pool.stats()['idle']), (2, 2))
+        pool.acquire()
+        self.assertEqual(pool.stats()['opened'], 2)
+
+        opened = []
+
+        def connect():
+            if opened:
+                raise OSError('connection refused')
+            opened.append(FakeConnection())
+            return opened[-1]
+
+        with self.assertRaises(OSError):
+            ConnectionPool(connect, min_size=2)
+        self.assertTrue(opened[0].closed) # not left behind by the pool that failed
+
+    def test_idle_recycling_keeps_min_size(self):
+        pool = self.make_pool(min_size=1, max_idle=0)
+        connections = [pool.acquire() for _ in range(3)]
+        for connection in connections:
+            pool.release(connection)
+        pool.acquire()
+        self.assertEqual(pool.stats()['size'], 1)
+        self.assertEqual(sum(connection.closed for connection in connections), 2)
+
+    def test_max_lifetime(self):
+        pool = self.make_pool(max_lifetime=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertTrue(connection.closed)
+
+
+class DatabaseConfigTests(SimpleTestCase):
+    """Test building settings.DATABASES from the environment"""
+
+    def test_sqlite_fallback(self):
+        config = database_from_env({}, '/tmp/db.sqlite3')
+        self.assertEqual(config, {'ENGINE': 'profiles_project.db.sqlite3', 'NAME': '/tmp/db.sqlite3'})
+
+    def test_postgres_pooled(self):
+        config = database_from_env(
+            {'DATABASE_URL': 'postgres://app:s%40cret@db:5433/profiles?sslmode=require', 'DB_POOL_MAX_SIZE': '5'},
+            '/tmp/db.sqlite3',
+        )
+        self.assertEqual(config['ENGINE'], 'profiles_project.db.postgresql_pool')
+        self.assertEqual((config['USER'], config['PASSWORD'], config['HOST'], config['PORT'], config['NAME']),
+                         ('app', 's@cret', 'db', '5433', 'profiles'))
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['OPTIONS']['sslmode'], 'require')
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 5)
+        self.assertEqual(config['OPTIONS']['pool']['min_size'], 2)
+
+    def test_postgres_persistent(self):
+        config = database_from_env({'DATABASE_URL': 'postgresql://db/profiles', 'DB_POOL': '0'}, '/tmp/db.sqlite3')
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(config['CONN_MAX_AGE'], 60)
+        self.assertNotIn('pool', config['OPTIONS'])
+
+
+class DatabasePoolViewTests(ApiTestCase):
+    """Test the pool stats endpoint"""
+
+    def test_admin_only(self):
+        user = create_user()
+        self.assertEqual(token_client(user).get('/api/db-pool/').status_code, 403)
+        admin = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'adminpass123')
+        res = token_client(admin).get('/api/db-pool/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {'pools': []}) # the tests run on SQLite, which isn't pooled
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0', 'replica_1'])
+class ReplicaRoutingTests(ApiTestCase):
+    """Test the read-replica router and the read-your-writes pinning"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.router = routers.ReplicaRouter()
+
+    def test_primary_outside_requests(self):
+        """Without the middleware's go-ahead, eg in management commands, reads stay on the primary"""
+        self.assertEqual(self.router.db_for_read(models.UserProfile), 'default')
+
+    def test_round_robin(self):
+        with routers.use_replicas():
+            chosen = [self.router.db_for_read(models.UserProfile) for _ in range(4)]
+        self.assertEqual(sorted(chosen), ['replica_0', 'replica_0', 'replica_1', 'replica_1'])
+        self.assertEqual(self.router.db_for_write(models.UserProfile), 'default')
+
+    @override_settings(DATABASE_REPLICA_STRATEGY='least_loaded')
+    def test_least_loaded(self):
+        stats = [{'alias': 'replica_0', 'in_use': 3}, {'alias': 'replica_1', 'in_use': 1}]
+        with routers.use_replicas(), mock.patch.object(routers, 'pool_stats', return_value=stats):
+            self.assertEqual({self.router.db_for_read(models.UserProfile) for _ in range(3)}, {'replica_1'})
+
+    def test_reads_after_a_write_use_the_primary(self):
+        with routers.use_replicas():
+            self.router.db_for_write(models.ProfileFeedItem)
+            self.assertEqual(self.router.db_for_read(models.ProfileFeedItem), 'default')
+
+    def test_no_migrations_on_replicas(self):
+        self.assertTrue(self.router.allow_migrate('default', 'profiles_api'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'profiles_api'))
+
+    def test_pin_cache_must_be_shared(self):
+        """Pins in a per-process cache only hold on the worker that took the write"""
+        self.assertEqual([error.id for error in routers.check_pin_cache(None)], ['profiles.E001'])
+        shared = dict(settings.CACHES, default={'BACKEND': 'profiles_api.cache_backends.RedisCache'})
+        with override_settings(CACHES=shared):
+            self.assertEqual(routers.check_pin_cache(None), [])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(routers.check_pin_cache(None), [])
+
+    def test_pinned_after_write(self):
+        """A client that wrote reads from the primary for REPLICA_PIN_SECONDS, others keep using replicas"""
+        client = token_client(self.user)
+        other = token_client(create_user('other@example.com', 'Other'))
+        url = FEED_URL # the write below invalidates the cached feed, so every read here reaches the database
+
+        with mock.patch.object(routers, 'choose_replica', return_value='default') as choose:
+            client.get(url)
+            self.assertTrue(choose.called)
+
+            client.post(FEED_URL, {'status_text': 'hello'})
+            choose.reset_mock()
+            self.assertEqual(client.get(url).status_code, 200)
+            self.assertFalse(choose.called)
+
+            other.get(url)
+            self.assertTrue(choose.called)
+
+            cache.clear() # the pin expired
+            choose.reset_mock()
+            client.get(url)
+            self.assertTrue(choose.called)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaDatabaseTests(ApiTestCase):
+    """Test the routing against a second SQLite database, a copy of the primary that lags behind it"""
+    databases = {'default', 'replica_0'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.databases['replica_0'] = {
+            'ENGINE': 'profiles_project.db.sqlite3', 'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        connections.ensure_defaults('replica_0')
+        connections.prepare_test_settings('replica_0')
+        call_command('migrate', database='replica_0', verbosity=0) # before DATABASE_REPLICAS names it, so the router allows it
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica_0'].close()
+        del connections['replica_0']
+        del connections.databases['replica_0']
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+
+    def replicate(self):
+        """Bring the replica up to date with the primary, as of now"""
+        tables = (models.UserProfile, Token, models.ProfileFeedItem)
+        for model in reversed(tables):
+            model.objects.using('replica_0').all()._raw_delete('replica_0')
+        for model in tables:
+            model.objects.using('replica_0').bulk_create(model.objects.using('default').all())
+
+    def test_reads_go_to_the_replica_until_a_client_writes(self):
+        writer = create_user()
+        reader = create_user('reader@example.com', 'Reader')
+        writer_client, reader_client = token_client(writer), token_client(reader)
+        self.replicate()
+
+        item = writer_client.post(FEED_URL, {'status_text': 'not replicated yet'}).data
+        url = '%s%d/' % (FEED_URL, item['id'])
+        self.assertEqual(reader_client.get(url).status_code, 404) # read from the replica, which lags behind
+        res = writer_client.get(url) # pinned to the primary, reads its own write
+        self.assertEqual((res.status_code, res.data['status_text']), (200, 'not replicated yet'))
+
+        self.replicate()
+        self.assertEqual(reader_client.get(url).status_code, 200)
+
+
+class MetricsTests(ApiTestCase):
+    """Test the request metrics middleware and the Prometheus endpoint"""
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='measured')
+
+    def histogram(self, name, view, method='GET'):
+        return metrics.registry.histograms[name, view, method]
+
+    def test_breakdown_per_view(self):
+        res = self.client.get(FEED_URL)
+        view = 'UserProfileFeedViewSet.list'
+        self.assertEqual(self.histogram('request_duration_seconds', view).count, 1)
+        self.assertGreater(self.histogram('db_queries', view).sum, 0)
+        self.assertGreater(self.histogram('db_duration_seconds', view).sum, 0)
+        self.assertEqual(self.histogram('serializer_duration_seconds', view).count, 1)
+        self.assertEqual(self.histogram('renderer_duration_seconds', view).count, 1)
+        self.assertEqual(self.histogram('response_size_bytes', view).sum, len(res.content))
+        self.assertEqual(metrics.registry.requests[view, 'GET', 200], 1)
+
+    def test_view_names(self):
+        self.client.post(FEED_URL, {'status_text': 'new'})
+        self.client.get('/api/hello-view/')
+        self.client.get('/api/nowhere/')
+        self.assertIn(('UserProfileFeedViewSet.create', 'POST', 201), metrics.registry.requests)
+        self.assertIn(('HelloApiView.get', 'GET', 200), metrics.registry.requests)
+        self.assertIn(('unmatched', 'GET', 404), metrics.registry.requests)
+        self.assertEqual(self.histogram('serializer_duration_seconds', 'UserProfileFeedViewSet.create', 'POST').count, 1)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_prometheus_export(self):
+        self.client.get(FEED_URL)
+        res = APIClient().get('/api/_metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = res.content.decode()
+        self.assertIn('# TYPE profiles_api_request_duration_seconds histogram', text)
+        self.assertIn(
+            'profiles_api_request_duration_seconds_bucket{view="UserProfileFeedViewSet.list",method="GET",le="+Inf"} 1',
+            text,
+        )
+        self.assertIn('profiles_api_requests_total{view="UserProfileFeedViewSet.list",method="GET",status="200"} 1', text)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        res = APIClient().get('/api/_metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(res.status_code, 200)
+
+    def test_hidden_without_token(self):
+        with override_settings(METRICS_TOKEN=None, DEBUG=False):
+            self.assertEqual(APIClient().get('/api/_metrics').status_code, 404)
+        with override_settings(METRICS_TOKEN=None, DEBUG=True):
+            self.assertEqual(APIClient().get('/api/_metrics').status_code, 200)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.client.get(FEED_URL)
+        self.assertEqual(metrics.registry.requests, {})
+
+    def test_slow_request_profiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_PROFILE_SAMPLE_RATE=1, METRICS_PROFILE_THRESHOLD=0, METRICS_PROFILE_DIR=directory):
+                self.client.get(FEED_URL)
+            dumps = os.listdir(directory)
+            self.assertEqual(len(dumps), 1)
+            self.assertTrue(dumps[0].startswith('UserProfileFeedViewSet.list-'))
+
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.sum, 14.5)
+
+
+class SeedDataTests(ApiTestCase):
+    """Test the seed_data management command"""
+
+    def seed(self, **options):
+        call_command('seed_data', users=20, items=100, batch_size=30, stdout=io.StringIO(), **options)
+
+    def snapshot(self):
+        return (
+            list(models.UserProfile.objects.order_by('id').values_list('email', 'name')),
+            list(models.ProfileFeedItem.objects.order_by('id').values_list('user_profile__email', 'status_text')),
+        )
+
+    def test_deterministic(self):
+        """The same seed gives the same dataset, another seed a different one"""
+        self.seed()
+        first = self.snapshot()
+        self.assertEqual((len(first[0]), len(first[1])), (20, 100))
+
+        models.UserProfile.objects.all().delete()
+        self.seed()
+        self.assertEqual(self.snapshot(), first)
+
+        models.UserProfile.objects.all().delete()
+        self.seed(seed=7)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_usable_accounts(self):
+        """Seeded users can log in, and their items are on their timelines"""
+        self.seed(password='seedpass123')
+        user = models.UserProfile.objects.order_by('id').first()
+        self.assertTrue(user.check_password('seedpass123'))
+        self.assertEqual(
+            models.TimelineEntry.objects.filter(owner=user).count(),
+            models.ProfileFeedItem.objects.filter(user_profile=user).count(),
+        )
+
+    def test_refuses_to_seed_twice(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class ArchiveTests(ApiTestCase):
+    """Test the feed archive and its fallback in the feed API"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        # 25 items, one a day over the last 25 days, plus 5 posted now. 16 of them are 10 days old or more
+        self.items = [self.client.post(FEED_URL, {'status_text': 'status %d' % i}, format='json').data['id'] for i in range(30)]
+        now = timezone.now()
+        for days, pk in enumerate(reversed(self.items[:25]), 1):
+            models.ProfileFeedItem.objects.filter(id=pk).update(created_on=now - datetime.timedelta(days=days))
+
+    def archive(self, days=10, chunk_size=4, **options):
+        out = io.StringIO()
+        call_command('archive_feed', older_than_days=days, chunk_size=chunk_size, stdout=out, **options)
+        return out.getvalue()
+
+    def walk(self, url):
+        ids = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            ids += [item['id'] for item in res.data['results']]
+            url = res.data['next']
+        return ids, res
+
+    def test_archive_command(self):
+        self.assertIn('16 feed items are older', self.archive(dry_run=True))
+        self.assertEqual(models.FeedArchiveChunk.objects.count(), 0)
+
+        self.assertIn('Archived 16 feed items', self.archive())
+        self.assertEqual(models.ProfileFeedItem.objects.count(), 14)
+        self.assertFalse(models.TimelineEntry.objects.filter(item_id__in=self.items[:16]).exists())
+        chunks = models.FeedArchiveChunk.objects.order_by('first_created_on')
+        self.assertEqual(sum(chunk.item_count for chunk in chunks), 16)
+        for chunk in chunks:
+            self.assertLessEqual(chunk.item_count, 4)
+            months = {item.created_on.replace(day=1).date() for item in archive.decode(chunk)}
+            self.assertEqual(months, {chunk.month}) # never spans two months
+        self.assertIn('Archived 0 feed items', self.archive()) # nothing left to do
+
+    def test_list_continues_into_the_archive(self):
+        self.archive()
+        ids, res = self.walk(FEED_URL + '?page_size=7')
+        self.assertEqual(ids, list(reversed(self.items)))
+
+        # and back up through the previous links, across the archive boundary
+        previous = [item['id'] for item in res.data['results']]
+        url = res.data['previous']
+        while url:
+            res = self.client.get(url)
+            previous = [item['id'] for item in res.data['results']] + previous
+            url = res.data['previous']
+        self.assertEqual(previous, ids)
+
+    def test_instance_rows(self):
+        """Formats without the values() fast path get archived items as instances"""
+        self.archive()
+        res = self.client.get(FEED_URL + '?page_size=100&format=api')
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, 'status 0')
+
+    def test_retrieve_archived(self):
+        self.archive()
+        pk = self.items[3]
+        res = self.client.get('%s%d/' % (FEED_URL, pk))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((res.data['id'], res.data['status_text'], res.data['user_profile']), (pk, 'status 3', self.user.id))
+        self.assertEqual(self.client.patch('%s%d/' % (FEED_URL, pk), {'status_text': 'x'}).status_code, 404) # read-only
+        self.assertEqual(self.client.delete('%s%d/' % (FEED_URL, pk)).status_code, 404)
+        self.assertEqual(self.client.get('%s%d/' % (FEED_URL, 10 ** 6)).status_code, 404)
+
+    def test_deleted_authors(self):
+        other = create_user(email='other@example.com')
+        item = models.ProfileFeedItem.objects.create(user_profile=other, status_text='gone soon')
+        models.ProfileFeedItem.objects.filter(id=item.id).update(created_on=timezone.now() - datetime.timedelta(days=40))
+        self.archive()
+        other.delete()
+
+        self.assertIsNone(archive.get_item(item.id))
+        ids, _ = self.walk(FEED_URL + '?page_size=100')
+        self.assertNotIn(item.id, ids)
+        self.assertIn('Dropped 1 archived items', self.archive(purge_deleted=True))
+        self.assertEqual(sum(models.FeedArchiveChunk.objects.values_list('item_count', flat=True)), 16)
+
+    def test_compression(self):
+        self.archive(days=0, chunk_size=1000)
+        for chunk in models.FeedArchiveChunk.objects.all():
+            raw = json.dumps([[i.id, i.user_profile_id, i.created_on.isoformat(), i.status_text] for i in archive.decode(chunk)])
+            self.assertLess(len(chunk.payload), len(raw))
+
+
+def throttle_rates(**rates):
+    """override_settings() for the given DRF throttle rates"""
+    return override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates))
+
+
+class ThrottleTests(ApiTestCase):
+    """Test the token bucket throttles and the admission middleware"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+
+    def test_bucket(self):
+        buckets = throttling.LocalBuckets(max_entries=2)
+        with mock.patch('time.monotonic', return_value=100.0) as clock:
+            self.assertEqual([buckets.take('a', 3, 1.0) for _ in range(4)], [0, 0, 0, 1.0]) # burst of 3, then wait
+            clock.return_value = 100.5
+            self.assertEqual(buckets.take('a', 3, 1.0), 0.5)
+            clock.return_value = 101.5
+            self.assertEqual(buckets.take('a', 3, 1.0), 0)
+            clock.return_value = 1000.0
+            self.assertEqual([buckets.take('a', 3, 1.0) for _ in range(4)], [0, 0, 0, 1.0]) # refills up to capacity only
+
+            buckets.take('b', 3, 1.0)
+            buckets.take('c', 3, 1.0) # evicts a, the least recently used
+            self.assertEqual(buckets.take('a', 3, 1.0), 0)
+
+    def test_cache_bucket(self):
+        buckets = throttling.CacheBuckets('default')
+        with mock.patch('time.time', return_value=100.0):
+            self.assertEqual([buckets.take('a', 2, 0.5) for _ in range(3)], [0, 0, 2.0])
+            self.assertEqual(buckets.take('b', 2, 0.5), 0)
+        with override_settings(THROTTLE_CACHE_ALIAS='default'):
+            self.assertIsInstance(throttling.buckets(), throttling.CacheBuckets)
+
+    def test_reads_and_writes(self):
+        with throttle_rates(user_read='2/min', user_write='2/min', anon_read='1/min'):
+            self.assertEqual([self.client.post(FEED_URL, {'status_text': 'x'}).status_code for _ in range(3)], [201, 201, 429])
+            res = self.client.get(FEED_URL)
+            self.assertEqual(res.status_code, 200) # a separate budget
+            self.assertEqual(self.client.get(FEED_URL).status_code, 200)
+            res = self.client.get(FEED_URL)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res['Retry-After'], '30')
+
+            # anonymous clients count per IP
+            anonymous = APIClient()
+            self.assertEqual(anonymous.get('/api/profile/').status_code, 200)
+            self.assertEqual(anonymous.get('/api/profile/').status_code, 429)
+            self.assertEqual(anonymous.get('/api/profile/', REMOTE_ADDR='10.0.0.2').status_code, 200)
+            self.assertEqual(anonymous.get('/api/hello-view/', REMOTE_ADDR='10.0.0.2').status_code, 429)
+
+            with override_settings(THROTTLE_ENABLED=False):
+                self.assertEqual(self.client.get(FEED_URL).status_code, 200)
+
+    @override_settings(LOGIN_HASHING_PROCESSES=0)
+    def test_login(self):
+        with throttle_rates(login='2/min'):
+            login = lambda: APIClient().post('/api/login/', {'username': 'test@example.com', 'password': 'wrong'}).status_code
+            self.assertEqual([login() for _ in range(3)], [400, 400, 429])
+
+    @override_settings(LOGIN_HASHING_PROCESSES=0)
+    def test_login_ignores_forwarded_for(self):
+        """A new X-Forwarded-For per attempt doesn't make a new client"""
+        with throttle_rates(login='2/min'):
+            statuses = [
+                APIClient().post(
+                    '/api/login/', {'username': 'test@example.com', 'password': 'wrong'}, HTTP_X_FORWARDED_FOR='10.9.0.%d' % i,
+                ).status_code
+                for i in range(4)
+            ]
+        self.assertEqual(statuses, [400, 400, 429, 429])
+
+    def test_admission_rate(self):
+        """Requests over the per-IP rate are turned away before any query"""
+        with override_settings(ADMISSION_RATE='2/s'):
+            self.client.get(FEED_URL)
+            self.client.get(FEED_URL)
+            with self.assertNumQueries(0):
+                res = self.client.get(FEED_URL)
+            self.assertEqual(res.status_code, 429)
+            self.assertEqual(res.json(), {'detail': 'Too many requests.'})
+            self.assertEqual(res['Retry-After'], '1')
+            with override_settings(METRICS_TOKEN='scrape-secret'):
+                res = APIClient().get('/api/_metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+            self.assertEqual(res.status_code, 200) # exempt
+
+    def test_admission_in_flight(self):
+        with override_settings(ADMISSION_MAX_IN_FLIGHT=0):
+            res = self.client.get(FEED_URL)
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(res['Retry-After'], '1')
+        middleware = throttling.AdmissionMiddleware(lambda request: self.assertEqual(middleware.in_flight, 1))
+        middleware(RequestFactory().get(FEED_URL))
+        self.assertEqual(middleware.in_flight, 0)
+
+    def test_change_streams_are_not_in_flight(self):
+        stream = changes.Broadcaster(buffer_size=10, poll_seconds=60) # without the polling thread
+        stream.poll()
+        with override_settings(ADMISSION_MAX_IN_FLIGHT=0), mock.patch.object(changes, '_broadcaster', stream):
+            self.assertEqual(self.client.get(FEED_URL + 'changes/').status_code, 200)
+
+    def test_admission_client_ip(self):
+        """Behind a proxy the rate applies per client address, from the header the proxy sets"""
+        with override_settings(ADMISSION_RATE='1/min', CLIENT_IP_HEADER='HTTP_X_REAL_IP'):
+            self.assertEqual(self.client.get(FEED_URL, HTTP_X_REAL_IP='10.0.0.1').status_code, 200)
+            self.assertEqual(self.client.get(FEED_URL, HTTP_X_REAL_IP='10.0.0.2').status_code, 200)
+            self.assertEqual(self.client.get(FEED_URL, HTTP_X_REAL_IP='10.0.0.1').status_code, 429)
+        with override_settings(ADMISSION_RATE='1/min'):
+            # without CLIENT_IP_HEADER, X-Forwarded-For is the client's to forge
+            self.assertEqual(self.client.get(FEED_URL, REMOTE_ADDR='10.0.1.1', HTTP_X_FORWARDED_FOR='1.2.3.4').status_code, 200)
+            self.assertEqual(self.client.get(FEED_URL, REMOTE_ADDR='10.0.1.1', HTTP_X_FORWARDED_FOR='5.6.7.8').status_code, 429)
+
+
+@override_settings(FEED_WRITE_BEHIND=True)
+class WriteBehindTests(ApiTestCase):
+    """Test the write-behind mode of feed posts"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+        self.writer = writebehind.Writer(writebehind.Journal(self.journal_dir, fsync=False), 3, 60, 5) # flushed by the tests
+        patcher = mock.patch.object(writebehind, '_writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, text='queued'):
+        return self.client.post(FEED_URL, {'status_text': text}, format='json')
+
+    def test_post_is_queued(self):
+        res = self.post()
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual((res.data['user_profile'], res.data['status_text']), (self.user.id, 'queued'))
+        self.assertFalse(models.ProfileFeedItem.objects.exists())
+        self.assertEqual(self.client.get(res['Location']).status_code, 202)
+
+        self.assertEqual(self.writer.flush(), 1)
+        item = models.ProfileFeedItem.objects.get()
+        self.assertEqual(str(item.provisional_id), res.data['provisional_id'])
+        self.assertTrue(models.TimelineEntry.objects.filter(item=item).exists())
+        queued = self.client.get(res['Location'])
+        self.assertEqual((queued.status_code, queued.data['id']), (200, item.id))
+        self.assertEqual(self.client.get('%squeued/%s/' % (FEED_URL, uuid.uuid4())).status_code, 404)
+
+        self.assertEqual(self.post('').status_code, 400) # validated before it's queued
+        self.writer.stop()
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_batches(self):
+        for i in range(5):
+            self.post('status %d' % i)
+        with CaptureQueriesContext(connection) as full:
+            self.assertEqual(self.writer.flush(), 3)
+        with CaptureQueriesContext(connection) as rest:
+            self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(len(full), len(rest)) # one INSERT per batch, not per item
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(list(models.ProfileFeedItem.objects.order_by('id').values_list('status_text', flat=True)), ['status %d' % i for i in range(5)])
+        self.assertEqual(self.writer.stats()['batches'], 2)
+
+    def test_queue_full(self):
+        self.assertEqual([self.post().status_code for _ in range(6)], [202] * 5 + [429])
+        self.assertIn('profiles_api_feed_queue_depth 5', metrics.registry.export())
+
+    def test_failed_flush_is_retried(self):
+        self.post()
+        with mock.patch.object(writebehind, 'insert', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.writer.flush()
+        self.assertEqual(self.writer.stats()['failures'], 1)
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(models.ProfileFeedItem.objects.count(), 1)
+
+    def test_poison_item_is_dead_lettered(self):
+        for text in ('before', 'poison', 'after'):
+            self.post(text)
+        real_insert = writebehind.insert
+
+        def insert(records):
+            if any(record['status_text'] == 'poison' for record in records):
+                raise RuntimeError
+            return real_insert(records)
+
+        with mock.patch.object(writebehind, 'insert', side_effect=insert), self.assertLogs('profiles_api.writebehind', 'ERROR'):
+            flushed = []
+            while self.writer.stats()['depth']:
+                try:
+                    flushed.append(self.writer.flush())
+                except RuntimeError:
+                    flushed.append('failed')
+        # the batch fails until its items have one attempt left, which they get alone
+        self.assertEqual(flushed, ['failed'] * (self.writer.max_attempts - 1) + [1, 'failed', 1])
+        self.assertEqual(self.writer.stats()['dead_lettered'], 1)
+        self.assertEqual(self.writer.stats()['depth'], 0)
+        self.assertEqual(sorted(models.ProfileFeedItem.objects.values_list('status_text', flat=True)), ['after', 'before'])
+
+        with override_settings(FEED_WRITE_BEHIND_JOURNAL_DIR=self.journal_dir):
+            out = io.StringIO()
+            call_command('replay_feed_journal', '--dead-letters', stdout=out) # the cause was fixed
+        self.assertIn('Inserted 1 dead-lettered', out.getvalue())
+        self.assertTrue(models.ProfileFeedItem.objects.filter(status_text='poison').exists())
+        self.assertFalse(os.path.exists(os.path.join(self.journal_dir, writebehind.DEAD_LETTERS)))
+
+    def test_group_commit(self):
+        """One fsync covers every record written before it, and doesn't hold the journal's lock"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        journal = writebehind.Journal(directory, fsync=True)
+        first = journal.append({'n': 1})[1]
+        second = journal.append({'n': 2})[1]
+        with mock.patch('os.fsync', side_effect=lambda fd: self.assertFalse(journal._lock.locked())) as fsync:
+            journal.sync(second)
+            journal.sync(first)
+            journal.sync(second)
+        self.assertEqual(fsync.call_count, 1)
+        journal.close()
+
+    def test_replay(self):
+        """A dead process's journal is inserted once, whatever made it to the database before"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        journal = writebehind.Journal(directory, fsync=False)
+        records = [{'ref': str(uuid.uuid4()), 'user_profile_id': self.user.id, 'status_text': 'journaled %d' % i} for i in range(4)]
+        for record in records:
+            journal.append(record)
+        with open(journal._file.name, 'ab') as f:
+            f.write(b'{"ref": "torn') # the process died mid-write
+        writebehind.insert(records[:1]) # flushed just before the crash
+
+        self.assertEqual(writebehind.replay(directory), 0) # still locked by its (live) process
+        journal._lock_file.close() # the process dies
+        with override_settings(FEED_WRITE_BEHIND_JOURNAL_DIR=directory), self.assertLogs('profiles_api.writebehind', 'WARNING'):
+            out = io.StringIO()
+            call_command('replay_feed_journal', stdout=out)
+        self.assertIn('Replayed 4', out.getvalue())
+        self.assertEqual(
+            sorted(models.ProfileFeedItem.objects.values_list('status_text', flat=True)),
+            ['journaled %d' % i for i in range(4)],
+        )
+        self.assertEqual(os.listdir(directory), [])
+
+
+class ResponseCacheCommitTests(TransactionTestCase):
+    """Test the version bumps of the response cache around transactions"""
+
+    def test_version_moves_again_on_commit(self):
+        """Responses cached while the write was uncommitted hold the old rows, the commit invalidates them"""
+        user = create_user()
+        with transaction.atomic():
+            models.ProfileFeedItem.objects.create(user_profile=user, status_text='uncommitted')
+            during = caching.get_version(models.ProfileFeedItem)
+        self.assertNotEqual(caching.get_version(models.ProfileFeedItem), during)
+
+
+class WriteBehindThreadTests(TransactionTestCase):
+    """Test the background flushing of the write-behind queue"""
+
+    def test_flushed_in_the_background(self):
+        user = create_user()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        writer = writebehind.Writer(writebehind.Journal(directory, fsync=False), 100, 0.01, 100)
+        writer.start()
+        try:
+            ref = writer.enqueue(user.id, 'in the background')
+            deadline = time.monotonic() + 5
+            while writer.is_pending(ref) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(models.ProfileFeedItem.objects.filter(provisional_id=ref).exists())
+        finally:
+            writer.stop()
+
+
+class ChangeStreamTests(ApiTestCase):
+    """Test the change log of the feed and the long-poll / SSE endpoint"""
+    url = FEED_URL + 'changes/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        self.stream = changes.Broadcaster(buffer_size=100, poll_seconds=60) # polled by the tests, without a thread
+        self.stream.poll()
+        patcher = mock.patch.object(changes, '_broadcaster', self.stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cursor(self):
+        return self.client.get(self.url).data['cursor']
+
+    def test_change_log(self):
+        item = self.client.post(FEED_URL, {'status_text': 'first'}).data
+        self.client.patch('%s%d/' % (FEED_URL, item['id']), {'status_text': 'edited'})
+        bulk = self.client.post(FEED_URL + 'bulk/', [{'status_text': 'a'}, {'status_text': 'b'}], format='json').data
+        self.client.delete('%s%d/' % (FEED_URL, item['id']))
+        self.assertEqual(list(models.FeedChange.objects.order_by('id').values_list('op', 'item_id')), [
+            ('created', item['id']), ('updated', item['id']),
+            ('created', bulk[0]['id']), ('created', bulk[1]['id']),
+            ('deleted', item['id']),
+        ])
+
+    def test_long_poll(self):
+        start = self.cursor()
+        self.assertEqual(self.client.get(self.url, {'since': start, 'timeout': 0}).data, {'cursor': start, 'changes': []})
+
+        item = self.client.post(FEED_URL, {'status_text': 'new'}).data
+        other = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='gone')
+        other_id = other.id
+        other.delete()
+        self.assertEqual(self.stream.poll(), 3)
+        with self.assertNumQueries(0): # the token is cached and the changes are in memory
+            res = self.client.get(self.url, {'since': start})
+        self.assertEqual([(change['op'], change['id']) for change in res.data['changes']], [
+            ('created', item['id']), ('created', other_id), ('deleted', other_id),
+        ])
+        self.assertEqual(res.data['changes'][0]['item'], item) # same as the feed API's representation
+        self.assertIsNone(res.data['changes'][1]['item']) # deleted since
+        self.assertEqual(self.client.get(self.url, {'since': res.data['cursor'], 'timeout': 0}).data['changes'], [])
+
+        self.assertEqual(self.client.get(self.url, {'since': 'x'}).status_code, 400)
+
+    def test_waiting_subscriber_is_woken(self):
+        start = int(self.cursor())
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(self.stream.wait(start, 5)))
+        waiter.start()
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='wake up')
+        self.stream.poll()
+        waiter.join()
+        self.assertEqual([change['op'] for change in result[0]], ['created'])
+
+    def test_cursors_older_than_the_buffer(self):
+        stream = changes.Broadcaster(buffer_size=2, poll_seconds=60)
+        stream.poll()
+        start = stream.published
+        for i in range(4):
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='item %d' % i)
+        stream.poll()
+        self.assertIsNone(stream.buffered(start))
+        self.assertEqual(len(stream.changes_after(start)), 4) # from the database
+        self.assertEqual(len(stream.buffered(stream.published - 2)), 2)
+
+        changes.trim(timezone.now() + datetime.timedelta(hours=1))
+        with self.assertRaises(changes.CursorExpired):
+            stream.changes_after(start)
+
+    def test_old_changes_are_trimmed(self):
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='old')
+        models.FeedChange.objects.update(changed_on=timezone.now() - datetime.timedelta(hours=25))
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='new')
+        with mock.patch.object(changes, '_next_trim', 0.0):
+            self.assertEqual(changes.trim_if_due(), 1)
+            self.assertIsNone(changes.trim_if_due()) # once per FEED_CHANGES_TRIM_SECONDS
+        self.assertEqual(models.FeedChange.objects.count(), 1)
+
+    def test_archiving_is_not_a_change(self):
+        item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='archived')
+        models.ProfileFeedItem.objects.filter(id=item.id).update(created_on=timezone.now() - datetime.timedelta(days=400))
+        self.assertEqual(archive.archive_before(timezone.now() - datetime.timedelta(days=365)), 1)
+        self.assertEqual(list(models.FeedChange.objects.values_list('op', flat=True)), ['created'])
+
+    def test_gaps_hold_later_changes(self):
+        """A missing id may be a transaction that hasn't committed yet"""
+        start = self.stream.published
+        models.FeedChange.objects.create(id=start + 2, item_id=1, op='deleted')
+        with mock.patch('time.monotonic', return_value=1000.0) as clock:
+            self.assertEqual(self.stream.poll(), 0)
+            clock.return_value += settings.FEED_CHANGES_GAP_SECONDS
+            self.assertEqual(self.stream.poll(), 1) # sent without it, eg rolled back
+        self.assertEqual(self.stream.published, start + 2)
+
+    def test_late_commit_is_still_delivered(self):
+        """A transaction that commits after the gap was given up on gets its change logged again"""
+        start = self.stream.published
+        models.FeedChange.objects.create(id=start + 2, item_id=1, op='deleted')
+        with mock.patch('time.monotonic', return_value=1000.0) as clock:
+            self.stream.poll()
+            clock.return_value += settings.FEED_CHANGES_GAP_SECONDS
+            self.stream.poll()
+            cursor = self.stream.published # a client that saw start + 2
+
+            models.FeedChange.objects.create(id=start + 1, item_id=2, op='deleted') # the slow transaction commits
+            self.assertEqual(self.stream.poll(), 1)
+            events = self.stream.changes_after(cursor)
+            self.assertEqual([(event['op'], event['id']) for event in events], [('deleted', 2)])
+            self.assertGreater(events[0]['cursor'], cursor)
+            self.assertFalse(models.FeedChange.objects.filter(id=start + 1).exists()) # logged once, under the new id
+
+            other = changes.Broadcaster(buffer_size=10, poll_seconds=60) # another process's, it lost the DELETE
+            other._missing[start + 1] = clock.return_value
+            other.published = other._floor = self.stream.published
+            self.assertEqual(other.poll(), 0)
+
+            self.stream._missing[start + 1000] = clock.return_value # an id nobody ever commits
+            clock.return_value += settings.FEED_CHANGES_LATE_SECONDS + 1
+            self.assertEqual(self.stream.poll(), 0)
+            self.assertEqual(self.stream._missing, {}) # taken as rolled back for good
+
+    def test_server_sent_events(self):
+        start = self.cursor()
+        item = self.client.post(FEED_URL, {'status_text': 'streamed'}).data
+        self.stream.poll()
+        res = self.client.get(self.url, {'since': start}, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(res['Content-Type'], 'text/event-stream')
+        first = next(iter(res.streaming_content)).decode()
+        self.assertIn('event: created\n', first)
+        self.assertIn('id: %d\n' % models.FeedChange.objects.get().id, first)
+        self.assertIn('"status_text":"streamed"', first)
+        res.close()
+
+        # EventSource reconnects with the last id it saw
+        res = self.client.get(self.url, HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=str(item['id'] - 10 ** 6))
+        self.assertEqual(res.status_code, 400)
+
+
+class AsgiChangeStreamTests(TransactionTestCase):
+    """Test the change stream served from the ASGI event loop"""
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.app = AsgiHandler()
+        # the flush between tests doesn't reset SQLite's ids, so start after a change or the next id looks like a gap
+        changes.record(models.FeedChange.DELETED, [0])
+        self.stream = changes.Broadcaster(buffer_size=100, poll_seconds=60)
+        self.stream.poll()
+        patcher = mock.patch.object(changes, '_broadcaster', self.stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, query, headers=(), until=None):
+        """Run a change stream request, the client leaves once a body holding `until` was sent"""
+        sent = []
+
+        async def run():
+            leave = asyncio.Event()
+            requested = []
+
+            async def receive():
+                if not requested:
+                    requested.append(True)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await leave.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if until and until in message.get('body', b''):
+                    leave.set()
+
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': FEED_URL + 'changes/', 'query_string': query.encode(),
+                'headers': [(b'host', b'testserver'), (b'authorization', b'Token ' + self.token.key.encode())] + list(headers),
+                'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+            }
+            await asyncio.wait_for(self.app(scope, receive, send), 10)
+
+        asyncio.run(run())
+        return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+    def post_later(self, text):
+        def post():
+            time.sleep(0.1)
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text=text)
+            self.stream.poll()
+        threading.Thread(target=post).start()
+
+    def test_long_poll(self):
+        start = self.stream.published
+        self.post_later('from another thread')
+        status, body = self.call('since=%d&timeout=5' % start)
+        self.assertEqual(status, 200)
+        data = json.loads(body)
+        self.assertEqual([change['item']['status_text'] for change in data['changes']], ['from another thread'])
+        self.assertEqual(data['cursor'], str(data['changes'][0]['cursor']))
+
+    def test_server_sent_events(self):
+        self.post_later('streamed')
+        status, body = self.call('since=%d' % self.stream.published, [(b'accept', b'text/event-stream')], until=b'streamed')
+        self.assertEqual(status, 200)
+        self.assertIn(b'event: created\n', body)
+
+    @override_settings(THROTTLE_ENABLED=True, ADMISSION_RATE='1/min')
+    def test_admission(self):
+        """Streams go through the admission rate and the throttles like any request"""
+        throttling.reset()
+        self.addCleanup(throttling.reset)
+        self.assertEqual(self.call('')[0], 200)
+        self.assertEqual(self.call('')[0], 429)
+
+    def test_open_streams_are_capped(self):
+        self.app.streams.in_flight = self.app.streams.slots
+        self.assertEqual(self.call('')[0], 503)
+
+    def test_metrics(self):
+        metrics.registry.clear()
+        self.addCleanup(metrics.registry.clear)
+        self.call('')
+        self.assertEqual(metrics.registry.requests, {('UserProfileFeedViewSet.change_stream', 'GET', 200): 1})
+
+    def test_errors(self):
+        self.token.key, key = 'invalid', self.token.key
+        self.assertEqual(self.call('')[0], 401)
+        self.token.key = key
+        self.assertEqual(self.call('since=-1')[0], 400)
+        self.assertEqual(json.loads(self.call('')[1]), {'cursor': str(self.stream.published), 'changes': []})
+
+
+@unittest.skipIf(msgpack is None, 'msgpack is not installed')
+class MessagePackTests(ApiTestCase):
+    """Test the MessagePack renderer and parser"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        for i in range(3):
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='status ünï %d' % i)
+
+    def test_same_documents_as_json(self):
+        for url in (FEED_URL, FEED_URL + '?page_size=2', PROFILE_URL, '%s%d/' % (PROFILE_URL, self.user.id)):
+            packed = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(packed['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(packed.content, raw=False), json.loads(self.client.get(url).content))
+
+    def test_request_bodies(self):
+        res = self.client.post(FEED_URL, msgpack.packb({'status_text': 'packed'}), content_type='application/msgpack')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['status_text'], 'packed')
+
+        res = self.client.post(FEED_URL, msgpack.packb({'status_text': 'packed'})[:-2], content_type='application/msgpack')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('MessagePack parse error', res.data['detail'])
+
+        res = APIClient().post(
+            '/api/login/', msgpack.packb({'username': 'test@example.com', 'password': 'testpass123'}),
+            content_type='application/msgpack', HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('token', msgpack.unpackb(res.content, raw=False))
+
+
+class FastJSONParserTests(SimpleTestCase):
+    """FastJSONParser must give JSONParser's results and errors"""
+
+    def parse(self, parser, body):
+        try:
+            return parser.parse(io.BytesIO(body), 'application/json', {'encoding': 'utf-8'})
+        except ParseError as exc:
+            return exc.detail
+
+    def test_same_as_json_parser(self):
+        for body in (
+                b'{"status_text": "\u00fcn\u00efc\u00f6d\u00e9 \u2713", "n": 1.5}', '["ünï"]'.encode(),
+                b'[18446744073709551616]', b'[NaN]', b'{"a": 1,}', b'', b'\xef\xbb\xbf{}'):
+            self.assertEqual(self.parse(FastJSONParser(), body), self.parse(JSONParser(), body), body)
+
+
+class CompressionTests(ApiTestCase):
+    """Test the response compression middleware"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+        models.ProfileFeedItem.objects.bulk_create([
+            models.ProfileFeedItem(user_profile=self.user, status_text='status number %d' % i) for i in range(30)
+        ])
+
+    def test_gzip(self):
+        plain = self.client.get(FEED_URL)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary']) # a shared cache mustn't hand it to gzip clients, nor the reverse
+
+        with mock.patch.object(compression, 'ENCODERS', [compression.GzipEncoder]):
+            compression.negotiate.cache_clear()
+            self.addCleanup(compression.negotiate.cache_clear)
+            res = self.client.get(FEED_URL, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(int(res['Content-Length']), len(res.content))
+        self.assertLess(len(res.content), len(plain.content))
+        self.assertEqual(gzip.decompress(res.content), plain.content)
+
+    def test_small_responses_are_left_alone(self):
+        res = self.client.get('%s%d/' % (PROFILE_URL, self.user.id), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(res.content), settings.COMPRESSION_MIN_SIZE)
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_negotiation(self):
+        gzip_encoder, preferred = compression.GzipEncoder, compression.ENCODERS[0]
+        for header, expected in (
+                ('', None), ('identity', None), ('gzip;q=0', None), ('br', None),
+                ('gzip', gzip_encoder), ('GZIP ; q=0.5', gzip_encoder), ('*', preferred), ('gzip, zstd', preferred),
+                ('zstd;q=0.4, gzip;q=0.5', gzip_encoder), ('*, gzip;q=0', compression.ZstdEncoder if compression.zstandard else None)):
+            self.assertIs(compression.negotiate(header), expected, header)
+
+    @unittest.skipIf(compression.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        plain = self.client.get(FEED_URL)
+        res = self.client.get(FEED_URL, HTTP_ACCEPT_ENCODING='gzip, zstd')
+        self.assertEqual(res['Content-Encoding'], 'zstd')
+        self.assertEqual(compression.zstandard.ZstdDecompressor().decompressobj().decompress(res.content), plain.content)
+
+    def test_streams_are_flushed_per_chunk(self):
+        with mock.patch.object(compression, 'ENCODERS', [compression.GzipEncoder]), \
+                mock.patch.object(views.UserProfileFeedViewSet, 'export_chunk_size', 10):
+            compression.negotiate.cache_clear()
+            self.addCleanup(compression.negotiate.cache_clear)
+            res = self.client.get(FEED_URL + 'export/', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(res['Content-Encoding'], 'gzip')
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            lines = []
+            for chunk in res.streaming_content:
+                lines.extend(decompressor.decompress(chunk).splitlines())
+                self.assertEqual(len(lines) % 10, 0) # every chunk of rows arrives whole
+        self.assertTrue(decompressor.eof)
+        self.assertEqual(len(lines), 30)
+
+
+class FeedCounterTests(ApiTestCase):
+    """Test the feed aggregates kept on UserProfile"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        self.client = token_client(self.user)
+
+    def totals(self, user=None):
+        user = models.UserProfile.objects.get(pk=(user or self.user).pk)
+        return user.feed_item_count, user.last_posted_at
+
+    def post(self, text):
+        return models.ProfileFeedItem.objects.get(pk=self.client.post(FEED_URL, {'status_text': text}).data['id'])
+
+    def test_migration_backfills(self):
+        """The profiles that existed before the counters get them from the table and the archive"""
+        old = self.post('archived')
+        models.ProfileFeedItem.objects.filter(pk=old.pk).update(created_on=timezone.now() - datetime.timedelta(days=400))
+        archive.archive_before(timezone.now() - datetime.timedelta(days=365))
+        latest = self.post('live')
+        other = create_user('other@example.com', 'Other')
+        models.UserProfile.objects.update(feed_item_count=0, last_posted_at=None) # as migration 0010 left them
+
+        migration = importlib.import_module('profiles_api.migrations.0011_backfill_feed_counters')
+        migration.backfill_counters(django_apps, mock.Mock(connection=connection))
+        self.assertEqual(self.totals(), (2, latest.created_on))
+        self.assertEqual(self.totals(other), (0, None))
+
+    def test_posts_and_deletes(self):
+        self.assertEqual(self.totals(), (0, None))
+        first, second = self.post('first'), self.post('second')
+        self.assertEqual(self.totals(), (2, second.created_on))
+
+        bulk = self.client.post(FEED_URL + 'bulk/', [{'status_text': 'a'}, {'status_text': 'b'}], format='json').data
+        latest = models.ProfileFeedItem.objects.get(pk=bulk[1]['id']).created_on
+        self.assertEqual(self.totals(), (4, latest))
+
+        self.client.delete('%s%d/' % (FEED_URL, first.id)) # not the latest, only the count changes
+        self.assertEqual(self.totals(), (3, latest))
+        self.client.delete(FEED_URL + 'bulk/', {'ids': [item['id'] for item in bulk]}, format='json')
+        self.assertEqual(self.totals(), (1, second.created_on))
+        self.client.delete('%s%d/' % (FEED_URL, second.id))
+        self.assertEqual(self.totals(), (0, None))
+
+    def test_backdated_items_keep_the_latest(self):
+        latest = self.post('latest').created_on
+        older = models.ProfileFeedItem(user_profile=self.user, status_text='older', created_on=latest - datetime.timedelta(days=1))
+        counters.items_created([older]) # eg an imported status
+        self.assertEqual(self.totals(), (2, latest))
+
+    def test_read_only_in_the_api(self):
+        self.post('one')
+        res = self.client.patch('%s%d/' % (PROFILE_URL, self.user.id), {'feed_item_count': 100, 'name': 'Renamed'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['feed_item_count'], 1)
+        self.assertEqual(self.client.get(PROFILE_URL).data[0]['feed_item_count'], 1) # the cached list was invalidated
+
+    def test_saving_a_stale_profile_keeps_the_counters(self):
+        stale = models.UserProfile.objects.get(pk=self.user.pk)
+        self.post('posted meanwhile')
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.totals()[0], 1)
+
+    def test_saving_a_partly_loaded_profile(self):
+        """Deferred fields are neither loaded nor written back"""
+        partial = models.UserProfile.objects.only('id', 'email', 'name').get(pk=self.user.pk)
+        models.UserProfile.objects.filter(pk=self.user.pk).update(is_staff=True) # changed meanwhile
+        partial.name = 'Renamed'
+        with CaptureQueriesContext(connection) as context:
+            partial.save()
+        self.assertEqual([query['sql'].split()[0] for query in context.captured_queries], ['UPDATE'])
+        self.assertEqual(models.UserProfile.objects.filter(pk=self.user.pk, is_staff=True, name='Renamed').count(), 1)
+
+    def test_saving_a_deleted_profile_inserts_it(self):
+        """As a plain save() does, rather than failing on the UPDATE that matched nothing"""
+        profile = models.UserProfile.objects.get(pk=self.user.pk)
+        models.UserProfile.objects.filter(pk=self.user.pk).delete()
+        profile.name = 'Back'
+        profile.save()
+        self.assertEqual(models.UserProfile.objects.get(pk=self.user.pk).name, 'Back')
+
+    def test_archived_items_still_count(self):
+        items = [self.post('status %d' % i) for i in range(3)]
+        old = timezone.now() - datetime.timedelta(days=30)
+        models.ProfileFeedItem.objects.filter(id__in=[item.id for item in items[:2]]).update(created_on=old)
+        call_command('reconcile_feed_counters', stdout=io.StringIO())
+        archive.archive_before(timezone.now() - datetime.timedelta(days=10))
+        self.assertEqual(self.totals(), (3, items[2].created_on))
+
+        self.client.delete('%s%d/' % (FEED_URL, items[2].id)) # the latest was the only one left in the table
+        self.assertEqual(self.totals(), (2, old))
+
+    def test_deleting_a_profile_skips_the_counters(self):
+        for i in range(3):
+            self.post('status %d' % i)
+        with CaptureQueriesContext(connection) as queries:
+            self.user.delete()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "profiles_api_userprofile"')])
+        self.assertFalse(counters._deleting.profiles)
+
+    def test_reconcile(self):
+        other = create_user(email='other@example.com', password=None)
+        first, second = self.post('first'), self.post('second')
+        models.UserProfile.objects.filter(pk=self.user.pk).update(feed_item_count=7, last_posted_at=first.created_on)
+        models.UserProfile.objects.filter(pk=other.pk).update(feed_item_count=1)
+
+        out = io.StringIO()
+        call_command('reconcile_feed_counters', dry_run=True, stdout=out)
+        self.assertIn('Would correct 2 profiles', out.getvalue())
+        self.assertEqual(self.totals()[0], 7)
+
+        out = io.StringIO()
+        call_command('reconcile_feed_counters', stdout=out)
+        self.assertIn('Profile %d: 7 statuses' % self.user.pk, out.getvalue())
+        self.assertEqual(self.totals(), (2, second.created_on))
+        self.assertEqual(self.totals(other), (0, None))
+        self.assertEqual(counters.reconcile(), [])
+
+
+API_WORKER_SCRIPT = """
+import json
+import django
+django.setup()
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from profiles_api import models
+
+setup_test_environment()
+connection.creation.create_test_db(verbosity=0)
+user = models.UserProfile.objects.create_user(email='api@example.com', name='API', password='testpass123')
+client = APIClient()
+client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+print(json.dumps({
+    'apps': settings.INSTALLED_APPS,
+    'post': client.post('/api/feed/', {'status_text': 'from an API worker'}, format='json').status_code,
+    'feed': client.get('/api/feed/').status_code,
+    'html': client.get('/api/feed/', HTTP_ACCEPT='text/html').status_code,
+    'admin': client.get('/admin/').status_code,
+}))
+"""
+
+
+class ApiWorkerTests(SimpleTestCase):
+    """Test the API-only settings and the warm-up before forking workers"""
+
+    def test_api_settings(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='profiles_project.settings_api', THROTTLE_ENABLED='0')
+        output = subprocess.check_output([sys.executable, '-c', API_WORKER_SCRIPT], cwd=settings.BASE_DIR, env=env)
+        result = json.loads(output.decode().splitlines()[-1])
+        self.assertNotIn('django.contrib.sessions', result['apps'])
+        self.assertNotIn('django.contrib.admin', result['apps'])
+        self.assertEqual((result['post'], result['feed']), (201, 200))
+        self.assertEqual(result['html'], 406) # no browsable API
+        self.assertEqual(result['admin'], 404)
+
+    def test_warm_up(self):
+        serializers.ValuesSerializer._compiled.pop(serializers.UserProfileSerializer, None)
+        with mock.patch('gc.freeze') as freeze, mock.patch.object(preload, 'close_pools') as close_pools, \
+                mock.patch.object(preload.connections, 'close_all') as close_all:
+            preload.warm_up()
+        freeze.assert_called_once_with()
+        close_all.assert_called_once_with() # nothing open for the forked workers to share
+        close_pools.assert_any_call('default')
+        self.assertIn(serializers.UserProfileSerializer, serializers.ValuesSerializer._compiled)
+
+    def test_forked_child_starts_over(self):
+        inherited = mock.Mock()
+        with mock.patch.object(writebehind, '_writer', inherited), mock.patch('atexit.unregister') as unregister:
+            writebehind._after_fork_in_child()
+            self.assertIsNone(writebehind._writer)
+        unregister.assert_called_once_with(inherited.stop) # the parent's journal is left alone
+
+        pool = ConnectionPool(connect=FakeConnection)
+        with mock.patch.object(db, '_pools', {('default', 'profiles'): pool}), \
+                mock.patch.object(db, '_inherited_pools', []):
+            db._after_fork_in_child()
+            self.assertEqual(db._pools, {})
+            self.assertEqual(db._inherited_pools, [pool]) # kept, closing them would close the parent's connections
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    """Test the regression gate of the benchmark suite"""
+
+    def results(self, rps, p95, errors=0):
+        return {'meta': {}, 'scenarios': {'feed_list': {'throughput_rps': rps, 'p95_ms': p95, 'errors': errors}}}
+
+    def test_within_tolerance(self):
+        _, regressions = compare.compare(self.results(100, 10), self.results(95, 11))
+        self.assertEqual(regressions, [])
+
+    def test_regressions(self):
+        _, regressions = compare.compare(self.results(100, 10), self.results(80, 13, errors=2))
+        self.assertEqual(len(regressions), 3)
+        _, regressions = compare.compare(self.results(100, 10), {'meta': {}, 'scenarios': {}})
+        self.assertEqual(regressions, ['feed_list: missing from the current results'])
@@ -0,0 +1,226 @@
+"""
+Rate limits on token buckets.
+A bucket holds up to N tokens and refills at N per period, so a client can burst
+N requests and then sustain the rate. Checking one is a dict lookup and some
+arithmetic (or a cache get and set), whatever the rate, unlike DRF's
+SimpleRateThrottle which keeps and filters the timestamp of every request.
+Buckets live in this process unless THROTTLE_CACHE_ALIAS names a cache shared
+between the workers.
+"""
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'120/min' -> (capacity 120, refill 2 tokens per second), None for no limit"""
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period[0]]
+
+
+class LocalBuckets:
+    """Buckets in this process's memory, the least recently used go past `max_entries`"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict() # key -> (tokens, monotonic time they were counted)
+
+    def take(self, key, capacity, refill, cost=1):
+        """Take `cost` tokens, returns 0 or the seconds until they'd be available"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+                if len(self._buckets) >= self.max_entries:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill)
+                self._buckets.move_to_end(key)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                return (cost - tokens) / refill
+            self._buckets[key] = (tokens - cost, now)
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBuckets:
+    """
+    Buckets in a Django cache, shared by every worker using it.
+    The get and set aren't atomic, so concurrent requests of one client can now
+    and then both get the last token, fine for rate limiting.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, capacity, refill, cost=1):
+        now = time.time() # wall clock, the workers don't share a monotonic one
+        bucket = self.cache.get(key)
+        tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * refill)
+        wait = 0 if tokens >= cost else (cost - tokens) / refill
+        if not wait:
+            tokens -= cost
+        self.cache.set(key, (tokens, now), math.ceil((capacity - tokens) / refill) + 1) # gone once it'd be full again
+        return wait
+
+    def clear(self):
+        pass # the cache is cleared as a whole
+
+
+_local = None
+_local_lock = threading.Lock()
+
+
+def buckets():
+    """The bucket store configured by THROTTLE_CACHE_ALIAS"""
+    global _local
+    if settings.THROTTLE_CACHE_ALIAS:
+        return CacheBuckets(settings.THROTTLE_CACHE_ALIAS)
+    if _local is None:
+        with _local_lock:
+            if _local is None:
+                _local = LocalBuckets(settings.THROTTLE_MAX_BUCKETS)
+    return _local
+
+
+def reset():
+    """Forget every local bucket, eg between tests"""
+    if _local is not None:
+        _local.clear()
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    DRF throttle on a token bucket per scope and client. Authenticated requests
+    count against their user, and so against their auth token as every user has
+    one, anonymous ones against their IP (see client_ip(), X-Forwarded-For isn't trusted).
+    Rates come from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].
+    """
+    scope = None
+
+    def get_scope(self, request, view):
+        return self.scope
+
+    def get_client(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return 'user:%s' % user.pk
+        return 'ip:%s' % client_ip(request)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        if not settings.THROTTLE_ENABLED:
+            return True
+        scope = self.get_scope(request, view)
+        rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+        if rate is None:
+            return True
+        self.wait_seconds = buckets().take('throttle:%s:%s' % (scope, self.get_client(request)), *rate)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ReadWriteThrottle(BucketThrottle):
+    """Separate budgets for reads and writes, scopes user_read, user_write, anon_read and anon_write"""
+
+    def get_scope(self, request, view):
+        user = getattr(request, 'user', None)
+        who = 'user' if user is not None and user.is_authenticated else 'anon'
+        return '%s_%s' % (who, 'read' if request.method in SAFE_METHODS else 'write')
+
+
+class LoginThrottle(BucketThrottle):
+    """Login attempts per IP, each one costs a password hash"""
+    scope = 'login'
+
+
+def client_ip(request):
+    """
+    The client's address: the CLIENT_IP_HEADER a trusted proxy sets, when configured,
+    otherwise the peer's. Headers the client can send itself aren't trusted.
+    """
+    header = settings.CLIENT_IP_HEADER
+    value = request.META.get(header) if header else None
+    if value:
+        return value.split(',')[-1].strip() # the address the last proxy added
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def admission_wait(request):
+    """Seconds the request's client has to wait under ADMISSION_RATE, 0 when it's admitted"""
+    rate = parse_rate(settings.ADMISSION_RATE) if settings.THROTTLE_ENABLED else None
+    if rate is None:
+        return 0
+    return buckets().take('admission:%s' % client_ip(request), *rate)
+
+
+class AdmissionMiddleware:
+    """
+    Shed load before a request gets to authentication, the views or the database.
+    Answers 503 while ADMISSION_MAX_IN_FLIGHT requests are already running in this
+    process, and 429 to clients going over ADMISSION_RATE (which is off with
+    THROTTLE_ENABLED), identified by throttling.client_ip(). Both come with a
+    Retry-After header.
+    """
+    exempt_paths = ('/api/_metrics',) # scrapes must get through when the process is busiest
+    # long-polls and event streams mostly wait idle, counting them would let a few subscribers shed everything else
+    uncounted_paths = ('/api/feed/changes/',)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def __call__(self, request):
+        if request.path in self.exempt_paths:
+            return self.get_response(request)
+
+        wait = admission_wait(request)
+        if wait:
+            return self.reject(429, 'Too many requests.', wait)
+
+        limit = settings.ADMISSION_MAX_IN_FLIGHT
+        if request.path in self.uncounted_paths:
+            return self.get_response(request)
+        with self._lock:
+            if limit is not None and self.in_flight >= limit:
+                admitted = False
+            else:
+                admitted = True
+                self.in_flight += 1
+        if not admitted:
+            return self.reject(503, 'Server busy, try again shortly.', 1)
+
+        try:
+            return self.get_response(request)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    @staticmethod
+    def reject(status, detail, wait):
+        response = JsonResponse({'detail': detail}, status=status)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
@@ -0,0 +1,64 @@
+"""
+Per-user timelines materialized on write (fan-out-on-write).
+When a status is posted it is copied as a TimelineEntry onto the timeline of
+every recipient, and each timeline is capped at TIMELINE_MAX_LENGTH entries.
+Reading a timeline is then one index range scan of at most a page of rows.
+Deleting a status removes its entries through the CASCADE on TimelineEntry.item.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from profiles_api import models
+
+
+def recipients(item):
+    """
+    Return the ids of the users whose timeline shows the item.
+    There is no follow graph, so a status only goes on its author's timeline.
+    Fan out to followers here once they exist, and keep timeline_items() in step.
+    """
+    return [item.user_profile_id]
+
+
+def timeline_items(owner_id):
+    """Return the feed items that belong on a user's timeline, the inverse of recipients()"""
+    return models.ProfileFeedItem.objects.filter(user_profile_id=owner_id)
+
+
+def fan_out(items):
+    """Add freshly created feed items to the timelines of their recipients"""
+    entries = [
+        models.TimelineEntry(owner_id=owner_id, item_id=item.id, created_on=item.created_on)
+        for item in items
+        for owner_id in recipients(item)
+    ]
+    if not entries:
+        return
+
+    models.TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    for owner_id in {entry.owner_id for entry in entries}:
+        trim(owner_id)
+
+
+def trim(owner_id):
+    """Drop the entries that fall beyond the timeline cap"""
+    entries = models.TimelineEntry.objects.filter(owner_id=owner_id)
+    oldest_kept = entries.order_by('-created_on', '-item_id').values_list('created_on', flat=True)[
+        settings.TIMELINE_MAX_LENGTH - 1:settings.TIMELINE_MAX_LENGTH
+    ]
+    oldest_kept = list(oldest_kept)
+    if oldest_kept:
+        entries.filter(created_on__lt=oldest_kept[0]).delete()
+
+
+def rebuild(owner_id):
+    """Recreate a user's timeline from the feed items, eg for backfill or after changing recipients()"""
+    items = timeline_items(owner_id).order_by('-created_on', '-id').values_list('id', 'created_on')
+    entries = [
+        models.TimelineEntry(owner_id=owner_id, item_id=item_id, created_on=created_on)
+        for item_id, created_on in items[:settings.TIMELINE_MAX_LENGTH]
+    ]
+    with transaction.atomic():
+        models.TimelineEntry.objects.filter(owner_id=owner_id).delete()
+        models.TimelineEntry.objects.bulk_create(entries)
+    return len(entries)
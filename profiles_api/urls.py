@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from profiles_api import metrics
 from profiles_api import views
 
 router = DefaultRouter()
@@ -10,5 +11,7 @@ router.register('feed', views.UserProfileFeedViewSet)
 urlpatterns = [
     path('hello-view/', views.HelloApiView.as_view()), # it will match webserveraddress/api/hello-view
     path('login/', views.UserLoginApiView.as_view()),
+    path('db-pool/', views.DatabasePoolView.as_view()),
+    path('_metrics', metrics.metrics_view), # Prometheus scrape target
     path('', include(router.urls)) # '' means no prefix is required. 'router.urls' is a list of generated urls
 ]
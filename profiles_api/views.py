@@ -1,21 +1,168 @@
+import itertools
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.views import APIView
 from rest_framework.response import Response # standard Response object that's returned when from APIView
 from rest_framework import status
 from rest_framework import viewsets
-from rest_framework.authentication import TokenAuthentication # token authentication is a type of authentication we use
-                                                              # for users to authenticate themselves with our API.
-                                                              # It works by generating a random token string when the user logs in
-                                                              # and then every request we make to that API that we need to authenticate
-                                                              # we add this token string to the request ie it's effectively a password
-                                                              # to check that every request that's made is authenticated correctly
-from rest_framework import filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import Throttled, ValidationError
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken # DRF comes with an Auth Token view out the box
 from rest_framework.settings import api_settings
 from rest_framework.permissions import IsAuthenticated # blocks access to the entire endpoint unless the user is authenticated
+from rest_framework.permissions import IsAdminUser
+from rest_framework.permissions import SAFE_METHODS
 
+from profiles_project.db import pool_stats
 from profiles_api import serializers
 from profiles_api import models
+from profiles_api import archive
+from profiles_api import changes
+from profiles_api import writebehind
 from profiles_api import permissions
+from profiles_api import pagination
+from profiles_api.caching import CachedResponseMixin
+from profiles_api.renderers import EventStreamRenderer, NDJSONRenderer
+from profiles_api.throttling import LoginThrottle
+from profiles_api.filters import FullTextSearchFilter
+from profiles_api.authentication import CachedTokenAuthentication # token authentication is a type of authentication we use
+                                                                  # for users to authenticate themselves with our API.
+                                                                  # It works by generating a random token string when the user logs in
+                                                                  # and then every request we make to that API that we need to authenticate
+                                                                  # we add this token string to the request ie it's effectively a password
+                                                                  # to check that every request that's made is authenticated correctly
+                                                                  # CachedTokenAuthentication is DRF's TokenAuthentication with the token lookup cached
+
+
+def check_bulk_payload(items, max_items):
+    """Return an error response if a bulk payload isn't a list of a sensible size"""
+    if not isinstance(items, list):
+        return Response({'non_field_errors': ['Expected a list of items.']}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > max_items:
+        return Response(
+            {'non_field_errors': ['At most %d items are allowed per request.' % max_items]},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return None
+
+
+class ValuesListMixin:
+    """
+    Serve list() for JSON and MessagePack clients from queryset.values() through
+    serializers.ValuesSerializer. The output is the same as the serializer's, other
+    formats and serializers with computed fields take the regular path.
+    """
+    values_list = True
+    values_formats = ('json', 'msgpack')
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = serializers.ValuesSerializer.for_serializer(self.get_serializer_class())
+        if not self.values_list or values_serializer is None or request.accepted_renderer.format not in self.values_formats:
+            return super().list(request, *args, **kwargs)
+
+        queryset = values_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.to_representation(page))
+
+        return Response(values_serializer.to_representation(queryset))
+
+
+class NDJSONExportMixin:
+    """
+    Adds an `export` action that streams the whole (filtered) table as NDJSON.
+    Rows are read with queryset.iterator(), which uses server-side cursors where the
+    backend has them, and rendered chunk by chunk, so memory use doesn't depend on
+    the table size. `?after_id=` resumes an export after the row with that id and,
+    when the model has an `export_time_field`, `?created_after=` / `?created_before=`
+    bound it in time. Exports ordered by the time field resume on (time, id), the
+    time of the `after_id` row is read from the table or, for a row deleted since,
+    passed as `?after_<time field>=`.
+    """
+    export_ordering = ('id',)
+    export_time_field = None
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer])
+    def export(self, request):
+        """Stream every row as one JSON document per line"""
+        values_serializer = serializers.ValuesSerializer.for_serializer(self.get_serializer_class())
+        queryset = self.filter_export(self.filter_queryset(self.get_queryset()), request.query_params)
+        rows = values_serializer.values(queryset.order_by(*self.export_ordering)).iterator(chunk_size=self.export_chunk_size)
+
+        response = StreamingHttpResponse(self.export_lines(values_serializer, rows), content_type=NDJSONRenderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="%s.ndjson"' % self.basename
+        return response
+
+    def filter_export(self, queryset, params):
+        """Apply the incremental export parameters, raising ValidationError for bad values"""
+        errors = {}
+        if params.get('after_id'):
+            try:
+                queryset = self.resume_export(queryset, int(params['after_id']), params, errors)
+            except ValueError:
+                errors['after_id'] = ['A valid integer is required.']
+
+        for param, lookup in (('created_after', '__gte'), ('created_before', '__lt')):
+            if not params.get(param):
+                continue
+            value = self.parse_export_time(params[param]) if self.export_time_field else None
+            if value is None:
+                errors[param] = ['A valid ISO 8601 datetime is required.' if self.export_time_field else 'Not supported here.']
+                continue
+            queryset = queryset.filter(**{self.export_time_field + lookup: value})
+
+        if errors:
+            raise ValidationError(errors)
+        return queryset
+
+    def resume_export(self, queryset, after_id, params, errors):
+        """Keep the rows after `after_id` in export_ordering, ids only order the rows within a time"""
+        if self.export_ordering[0] != self.export_time_field:
+            return queryset.filter(id__gt=after_id)
+
+        param = 'after_' + self.export_time_field
+        if params.get(param):
+            after_time = self.parse_export_time(params[param])
+            if after_time is None:
+                errors[param] = ['A valid ISO 8601 datetime is required.']
+                return queryset
+        else:
+            after_time = self.get_queryset().filter(id=after_id).values_list(self.export_time_field, flat=True).first()
+            if after_time is None:
+                errors[param] = ['The after_id row is gone, the %s of the last exported row is required.' % self.export_time_field]
+                return queryset
+        return queryset.filter(
+            Q(**{self.export_time_field + '__gt': after_time}) |
+            Q(**{self.export_time_field: after_time, 'id__gt': after_id})
+        )
+
+    @staticmethod
+    def parse_export_time(value):
+        """Parse an ISO 8601 datetime parameter, None when it isn't one"""
+        try:
+            value = parse_datetime(value)
+        except ValueError: # well formed but out of range, eg month 13
+            return None
+        if value is not None and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def export_lines(self, values_serializer, rows):
+        """Yield rendered NDJSON a chunk of rows at a time"""
+        renderer = NDJSONRenderer()
+        while True:
+            chunk = list(itertools.islice(rows, self.export_chunk_size))
+            if not chunk:
+                return
+            yield b''.join(renderer.render_line(item) for item in values_serializer.to_representation(chunk))
 
 
 class HelloApiView(APIView): # creates a new class based on APIView class that Django REST framework provides
@@ -112,15 +259,35 @@ class HelloViewSet(viewsets.ViewSet):
         return Response({'http_method': 'DELETE'})
 
 
-class UserProfileViewSet(viewsets.ModelViewSet): # ModelViewSet is specifically designed for managing models through our API
+class UserProfileViewSet(CachedResponseMixin, ValuesListMixin, NDJSONExportMixin, viewsets.ModelViewSet): # ModelViewSet is specifically designed for managing models through our API
     """Handle creating and updating profiles"""
+    cache_models = (models.UserProfile,) # list/retrieve responses are cached until a profile changes
     serializer_class = serializers.UserProfileSerializer
-    queryset = models.UserProfile.objects.all() # DRF knows the standard functions that you would want to perform on ModelViewSet: create, list, update, partial_update, destroy.
+    queryset = models.UserProfile.objects.only('id', 'email', 'name', 'feed_item_count', 'last_posted_at') # DRF knows the standard functions that you would want to perform on ModelViewSet: create, list, update, partial_update, destroy.
                                                 # DRF takes care of all that by assigning a a serializer_class to a model Serializer and queryset
-    authentication_classes = (TokenAuthentication,) # tuple, you can add all authentication classes here, but we'll be using AuthToken
+                                                # only() skips the password hash and flag columns the serializer never reads
+    authentication_classes = (CachedTokenAuthentication,) # tuple, you can add all authentication classes here, but we'll be using AuthToken
     permission_classes = (permissions.UpdateOwnProfile,)
-    filter_backends = (filters.SearchFilter,) # tuple
-    search_fields = ('name', 'email',) # searchable fields
+    filter_backends = (FullTextSearchFilter,) # tuple, a SearchFilter that uses the trigram index on name and email
+    search_fields = ('name', 'email',) # searchable fields, used when the index can't serve the search
+
+    bulk_max_items = 1000 # every password is hashed during the request, bigger imports should use `manage.py bulk_create_users`
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        """Create a list of user profiles, staff only"""
+        error = check_bulk_payload(request.data, self.bulk_max_items)
+        if error:
+            return error
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            serializer.save()
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class UserLoginApiView(ObtainAuthToken):
@@ -128,14 +295,32 @@ class UserLoginApiView(ObtainAuthToken):
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES # ObtainAuthToken class doesn't by default enable itself in the browsable Django admin site.
                                                              # So we need to overwrite this class and customize it so it's visible in the browsable API
                                                             # and it makes us easier for us to test. We need to add renderer_classes manually.
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES # ObtainAuthToken has its own list, without MessagePack
+    serializer_class = serializers.LoginSerializer # checks the password on the login hashing pool
+    throttle_classes = (LoginThrottle,) # ObtainAuthToken turns throttling off, logins get their own per-IP budget
 
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        try:
+            token = user.auth_token # loaded along with the user, no query and no write for a returning user
+        except Token.DoesNotExist:
+            token, _ = Token.objects.get_or_create(user=user)
+        return Response({'token': token.key})
 
-class UserProfileFeedViewSet(viewsets.ModelViewSet):
+
+class UserProfileFeedViewSet(CachedResponseMixin, ValuesListMixin, NDJSONExportMixin, viewsets.ModelViewSet):
     """Handles creating, reading and updating profile feed items"""
-    authentication_classes = (TokenAuthentication,)
+    cache_models = (models.ProfileFeedItem,) # the serializer only reads the author's id, so profile changes don't matter
+    export_ordering = ('created_on', 'id') # follows the (created_on, id) index, which also serves the created_on range filters
+    export_time_field = 'created_on'
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = serializers.ProfileFeedItemSerializer
     queryset = models.ProfileFeedItem.objects.all()
     permission_classes = (permissions.UpdateOwnStatus, IsAuthenticated)
+    pagination_class = pagination.ArchiveKeysetPagination # pages are keyed on (created_on, id) so deep pages cost the same as the first one,
+                                                          # past the last item in the table they continue into the archive
 
     def perform_create(self, serializer): # DRF's function that allows you to customize the behavior for creating objects through a model ViewSet. When a request gets made to our ViewSet, it gets passed to our serializer class and validated, and then the serializer.save() is called by default.
         """Sets the user profile to the logged-in user"""
@@ -146,3 +331,171 @@ class UserProfileFeedViewSet(viewsets.ModelViewSet):
                                                         # Request contains all the details about the request being made to the viewset.
                                                         # If the user has authenticated, then the request has a user associated to the authenticated user. So the user field is added whenever the user is authenticated.
                                                         # If the user is not authenticated, it's just set to an anonymous user account.
+
+    def create(self, request, *args, **kwargs):
+        """With FEED_WRITE_BEHIND the status is queued, and answered with a provisional id and a 202"""
+        if not settings.FEED_WRITE_BEHIND:
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            ref = writebehind.writer().enqueue(request.user.id, serializer.validated_data['status_text'])
+        except writebehind.QueueFull:
+            raise Throttled(wait=1)
+
+        location = self.reverse_action('queued', kwargs={'ref': str(ref)})
+        data = {'provisional_id': str(ref), 'user_profile': request.user.id, 'status_text': serializer.validated_data['status_text']}
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+    @action(detail=False, url_path=r'queued/(?P<ref>[0-9a-f-]{36})')
+    def queued(self, request, ref):
+        """The item a queued post became once it's inserted, or a 202 while it's still queued in this process"""
+        item = self.get_queryset().filter(provisional_id=ref).first()
+        if item is not None:
+            return Response(self.get_serializer(item).data)
+        if settings.FEED_WRITE_BEHIND and writebehind.writer().is_pending(uuid.UUID(ref)):
+            return Response({'provisional_id': ref, 'status': 'queued'}, status=status.HTTP_202_ACCEPTED)
+        raise Http404 # unknown, or queued in another worker process
+
+    @action(detail=False, methods=['get'], url_path='changes', renderer_classes=list(api_settings.DEFAULT_RENDERER_CLASSES) + [EventStreamRenderer])
+    def change_stream(self, request):
+        """
+        The items created, updated or deleted after `?since=<cursor>`, waiting up to `?timeout=`
+        seconds for one. Without a cursor it answers at once with the current one.
+        Clients that accept text/event-stream get the changes as Server-Sent Events.
+        """
+        stream = changes.broadcaster()
+        cursor, timeout = changes.parse_params(request.query_params, request.META.get('HTTP_LAST_EVENT_ID'))
+        if cursor is None:
+            cursor, events = stream.published, []
+        elif request.accepted_renderer.format == 'sse':
+            events = stream.changes_after(cursor) # raises CursorExpired before the stream starts
+        else:
+            events = stream.wait(cursor, timeout)
+
+        if request.accepted_renderer.format == 'sse':
+            response = StreamingHttpResponse(changes.event_stream(stream, cursor, events), content_type=EventStreamRenderer.media_type)
+            response['Cache-Control'] = 'no-cache'
+            return response
+        return Response(changes.response_data(cursor, events))
+
+    def get_object(self):
+        """Items moved to the archive (`manage.py archive_feed`) can still be read, but not changed"""
+        try:
+            return super().get_object()
+        except Http404:
+            pk = self._bulk_ids([self.kwargs[self.lookup_url_kwarg or self.lookup_field]])
+            if self.request.method not in SAFE_METHODS or pk is None:
+                raise
+            obj = archive.get_item(pk[0])
+            if obj is None:
+                raise
+            self.check_object_permissions(self.request, obj)
+            return obj
+
+    @action(detail=False, methods=['get'])
+    def timeline(self, request):
+        """Return the logged-in user's materialized timeline, newest first"""
+        entries = models.TimelineEntry.objects.filter(owner=request.user).select_related('item') # one indexed range scan joined to the items of the page
+        paginator = pagination.TimelineCursorPagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        serializer = self.get_serializer([entry.item for entry in page], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    bulk_max_items = 1000 # upper bound on the number of items a single bulk request may touch
+
+    def _bulk_object_errors(self, ids):
+        """
+        Look up the items to update or delete and check UpdateOwnStatus on each of them.
+        Returns the instances by id and one error dict per id, empty when the id is fine.
+        """
+        instances = self.get_queryset().in_bulk(ids)
+        errors = []
+        for pk in ids:
+            obj = instances.get(pk)
+            if obj is None:
+                errors.append({'id': ['Not found.']})
+            elif not all(permission.has_object_permission(self.request, self, obj) for permission in self.get_permissions()):
+                errors.append({'id': ['You do not have permission to perform this action.']})
+            else:
+                errors.append({})
+        return instances, errors
+
+    def _bulk_ids(self, values):
+        """Return the values as a list of ints, or None if any of them isn't one"""
+        try:
+            return [int(value) for value in values]
+        except (TypeError, ValueError):
+            return None
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create a list of statuses in a single transaction"""
+        error = check_bulk_payload(request.data, self.bulk_max_items)
+        if error:
+            return error
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST) # one error dict per item, in request order
+
+        serializer.save(user_profile=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @bulk.mapping.patch
+    def bulk_update(self, request):
+        """Update a list of the user's own statuses, each item needs an 'id'"""
+        error = check_bulk_payload(request.data, self.bulk_max_items)
+        if error:
+            return error
+
+        ids = self._bulk_ids(item.get('id') if isinstance(item, dict) else None for item in request.data)
+        if ids is None:
+            return Response({'non_field_errors': ['Every item needs an integer id.']}, status=status.HTTP_400_BAD_REQUEST)
+        if len(set(ids)) != len(ids):
+            return Response({'non_field_errors': ['Duplicate ids.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            instances, errors = self._bulk_object_errors(ids)
+            data = [{key: value for key, value in item.items() if key != 'id'} for item in request.data]
+            serializer = self.get_serializer([instances.get(pk) for pk in ids], data=data, many=True, partial=True)
+            if not serializer.is_valid():
+                errors = [dict(found, **invalid) for found, invalid in zip(errors, serializer.errors)]
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+            serializer.save()
+
+        return Response(serializer.data)
+
+    @bulk.mapping.delete
+    def bulk_destroy(self, request):
+        """Delete a list of the user's own statuses, given as {"ids": [...]}"""
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        error = check_bulk_payload(ids, self.bulk_max_items)
+        if error:
+            return error
+
+        ids = self._bulk_ids(ids)
+        if ids is None:
+            return Response({'ids': ['Expected a list of integer ids.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            instances, errors = self._bulk_object_errors(ids)
+            if any(errors):
+                return Response({'ids': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+            self.get_queryset().filter(id__in=ids).delete()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DatabasePoolView(APIView):
+    """Report the connection pools of this worker process"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        """Gauges (size, idle, in_use, waiting) and counters since the process started"""
+        return Response({'pools': pool_stats()})
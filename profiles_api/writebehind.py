@@ -0,0 +1,408 @@
+"""
+Write-behind for feed posts, on with FEED_WRITE_BEHIND.
+POST /api/feed/ validates the status, appends it to a journal on local disk and
+answers 202 with a provisional id (a UUID) without touching the database. A
+background thread inserts the queued items with bulk_create, a batch once
+FEED_WRITE_BEHIND_BATCH_SIZE items are waiting or the oldest one has waited
+FEED_WRITE_BEHIND_FLUSH_SECONDS, so a burst of posts becomes a few INSERTs.
+
+Durability: an accepted item is in the journal (fsynced with FEED_WRITE_BEHIND_FSYNC)
+before the 202 goes out. The fsync happens outside the journal's lock, and one
+fsync covers every record written before it, so concurrent posts share them (group
+commit) rather than queue up behind each other's. Each process writes its own
+journal segments and holds a lock file while it runs; the segments of a process
+that died are replayed by the next one to start (or `manage.py replay_feed_journal`). Items keep their provisional
+id in ProfileFeedItem.provisional_id, which is unique, so replaying items that did
+make it to the database before the crash inserts nothing twice.
+
+An item whose insert fails FEED_WRITE_BEHIND_MAX_ATTEMPTS times, the last of them on
+its own, is moved to the dead letter file of the journal directory rather than hold
+up the queue; `manage.py replay_feed_journal --dead-letters` retries those.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from profiles_api import models
+from profiles_api import signals
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_ITEMS = 10000 # items per journal segment, a segment is deleted once all of them are in the database
+DEAD_LETTERS = 'dead-letters.jsonl' # in the journal directory, shared by the processes
+
+
+class QueueFull(Exception):
+    """More than FEED_WRITE_BEHIND_MAX_QUEUE items are waiting"""
+
+
+class Journal:
+    """
+    Append-only journal segments of one process, `<prefix>-<n>.journal`, one JSON
+    record per line, next to the `<prefix>.lock` file this process keeps locked.
+    """
+
+    def __init__(self, directory, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        self.prefix = os.path.join(directory, '%d-%s' % (os.getpid(), uuid.uuid4().hex[:8]))
+        self._lock_file = open(self.prefix + '.lock', 'w')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB) # a fresh name, nobody else can hold it
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock() # one fsync at a time, the others wait and usually find their record covered
+        self._segments = 0
+        self._file = None
+        self._written = 0
+        self._appended = 0 # records written so far
+        self._synced = 0 # records known to be on disk
+        self.unflushed = {} # segment path -> items not yet in the database
+
+    def append(self, record):
+        """Write a record, returns (segment it went to, its sequence number for sync())"""
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            if self._file is None or self._written >= SEGMENT_ITEMS:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            self._appended += 1
+            self.unflushed[self._file.name] += 1
+            return self._file.name, self._appended
+
+    def sync(self, sequence):
+        """Wait until the records up to `sequence` are on disk, a no-op without fsync"""
+        if not self.fsync:
+            return
+        with self._sync_lock:
+            if self._synced >= sequence: # the fsync of another thread covered it
+                return
+            with self._lock: # records of earlier segments were synced by _rotate()
+                upto = self._appended
+                fd = os.dup(self._file.fileno()) # stays valid if the segment rotates meanwhile
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._synced = upto
+
+    def flushed(self, segments):
+        """Count items as safely in the database, dropping the segments that are done"""
+        with self._lock:
+            for segment in segments:
+                self.unflushed[segment] -= 1
+            for segment, count in list(self.unflushed.items()):
+                if not count and segment != self._file.name:
+                    del self.unflushed[segment]
+                    os.remove(segment)
+
+    def _rotate(self):
+        if self._file is not None:
+            if self.fsync:
+                os.fsync(self._file.fileno()) # once per segment, sync() only looks at the current one
+            self._file.close()
+        self._segments += 1
+        self._file = open('%s-%d.journal' % (self.prefix, self._segments), 'ab')
+        self._written = 0
+        self.unflushed[self._file.name] = 0
+
+    def close(self):
+        """Remove the journal, only call it once every item is in the database"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            for segment in self.unflushed:
+                os.remove(segment)
+            self.unflushed.clear()
+            self._file = None
+            os.remove(self.prefix + '.lock')
+            self._lock_file.close()
+
+
+def orphaned_journals(directory):
+    """
+    Yield (lock file, segment paths) of the journals whose process is gone, with the
+    lock held, so two processes starting at once don't both replay them.
+    """
+    for lock_path in sorted(glob.glob(os.path.join(glob.escape(directory), '*.lock'))):
+        lock_file = open(lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError: # its process is still running
+            lock_file.close()
+            continue
+        try:
+            prefix = lock_path[:-len('.lock')]
+            segments = sorted(glob.glob(glob.escape(prefix) + '-*.journal'), key=lambda path: int(path.rsplit('-', 1)[1][:-8]))
+            yield lock_path, segments
+        finally:
+            lock_file.close()
+
+
+def replay(directory, batch_size=500):
+    """Insert the items of dead processes' journals and delete them, returns the number of records read"""
+    if not os.path.isdir(directory):
+        return 0
+    replayed = 0
+    for lock_path, segments in orphaned_journals(directory):
+        for segment in segments:
+            with open(segment, 'rb') as f:
+                records = []
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError: # a torn last line, its request never got its 202
+                        logger.warning('Skipped a corrupt record in %s', segment)
+            for start in range(0, len(records), batch_size):
+                insert(records[start:start + batch_size])
+            replayed += len(records)
+            os.remove(segment)
+        os.remove(lock_path)
+    return replayed
+
+
+def dead_letter(directory, record, fsync=True):
+    """Append a record that can't be inserted to the dead letter file"""
+    with open(os.path.join(directory, DEAD_LETTERS), 'ab') as f: # appends of a line don't interleave
+        f.write((json.dumps(record, separators=(',', ':')) + '\n').encode())
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+
+
+def replay_dead_letters(directory):
+    """Retry the dead letters one at a time, those that fail again stay. Returns (inserted, still failing)."""
+    path = os.path.join(directory, DEAD_LETTERS)
+    replaying = path + '.replaying'
+    try:
+        os.rename(path, replaying) # writers meanwhile start a new file
+    except FileNotFoundError:
+        return 0, 0
+    inserted = failed = 0
+    with open(replaying, 'rb') as f:
+        for line in f:
+            record = json.loads(line)
+            try:
+                insert([record])
+                inserted += 1
+            except Exception:
+                logger.exception('Dead letter %s still fails', record['ref'])
+                dead_letter(directory, record)
+                failed += 1
+    os.remove(replaying)
+    return inserted, failed
+
+
+def insert(records):
+    """
+    Insert journal records as feed items, skipping the ones already inserted and
+    those whose author was deleted meanwhile. Returns the new items.
+    """
+    refs = [uuid.UUID(record['ref']) for record in records]
+    authors = set(models.UserProfile.objects.filter(
+        id__in={record['user_profile_id'] for record in records}
+    ).values_list('id', flat=True))
+    existing = set(models.ProfileFeedItem.objects.filter(provisional_id__in=refs).values_list('provisional_id', flat=True))
+    items = [
+        models.ProfileFeedItem(provisional_id=ref, user_profile_id=record['user_profile_id'], status_text=record['status_text'])
+        for ref, record in zip(refs, records)
+        if ref not in existing and record['user_profile_id'] in authors
+    ]
+    if len(items) + len(existing) < len(records):
+        logger.warning('Dropped %d queued feed items of deleted profiles', len(records) - len(items) - len(existing))
+    if not items:
+        return []
+
+    with transaction.atomic():
+        models.ProfileFeedItem.objects.bulk_create(items, ignore_conflicts=True) # a concurrent replay may have won
+        # SQLite doesn't return ids from bulk inserts, and neither does ignore_conflicts
+        items = list(models.ProfileFeedItem.objects.filter(provisional_id__in=[item.provisional_id for item in items]).order_by('id'))
+        signals.post_bulk_save.send(sender=models.ProfileFeedItem, objs=items, created=True)
+    return items
+
+
+class Writer:
+    """The queue of one process and the thread that flushes it"""
+
+    def __init__(self, journal, batch_size, flush_seconds, max_queue, max_attempts=5):
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self._queue = deque() # (record, journal segment, monotonic time it was queued, failed inserts)
+        self._pending = set() # refs queued or being inserted
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.counters = {'queued': 0, 'flushed': 0, 'batches': 0, 'failures': 0, 'dead_lettered': 0}
+
+    def enqueue(self, user_profile_id, status_text):
+        """Journal and queue a status, returns its provisional id"""
+        ref = uuid.uuid4()
+        record = {'ref': str(ref), 'user_profile_id': user_profile_id, 'status_text': status_text}
+        with self._condition:
+            if len(self._pending) >= self.max_queue:
+                raise QueueFull()
+            segment, sequence = self.journal.append(record) # under the lock so the queue and the journal agree on the order
+            self._queue.append((record, segment, time.monotonic(), 0))
+            self._pending.add(ref)
+            self.counters['queued'] += 1
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size: # starts the flush timer, or a full batch
+                self._condition.notify()
+        self.journal.sync(sequence) # before the 202, but without holding up the other posts
+        return ref
+
+    def is_pending(self, ref):
+        with self._condition:
+            return ref in self._pending
+
+    def stats(self):
+        with self._condition:
+            oldest = time.monotonic() - self._queue[0][2] if self._queue else 0
+            return dict(self.counters, depth=len(self._pending), oldest_seconds=oldest)
+
+    def flush(self):
+        """Insert up to a batch of queued items, returns how many. Raises if the insert fails."""
+        with self._condition:
+            if self._queue and self._queue[0][3] >= self.max_attempts - 1:
+                size = 1 # its last attempt, on its own so it can't take the items after it down with it
+            else:
+                size = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(size)]
+        if not batch:
+            return 0
+        try:
+            insert([record for record, segment, queued_on, attempts in batch])
+        except Exception:
+            batch = [(record, segment, queued_on, attempts + 1) for record, segment, queued_on, attempts in batch]
+            if len(batch) == 1 and batch[0][3] >= self.max_attempts:
+                self._dead_letter(batch[0])
+            else:
+                with self._condition: # back to the front, in order, for the next attempt
+                    self._queue.extendleft(reversed(batch))
+            with self._condition:
+                self.counters['failures'] += 1
+            raise
+        self.journal.flushed([segment for record, segment, queued_on, attempts in batch])
+        with self._condition:
+            self._pending.difference_update(uuid.UUID(record['ref']) for record, segment, queued_on, attempts in batch)
+            self.counters['flushed'] += len(batch)
+            self.counters['batches'] += 1
+        return len(batch)
+
+    def _dead_letter(self, entry):
+        record, segment, queued_on, attempts = entry
+        logger.error('Feed item %s failed %d inserts, moved to the dead letters', record['ref'], attempts)
+        dead_letter(self.journal.directory, record, self.journal.fsync)
+        self.journal.flushed([segment])
+        with self._condition:
+            self._pending.discard(uuid.UUID(record['ref']))
+            self.counters['dead_lettered'] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='feed-write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush what's queued and stop the thread, the journal is removed if everything made it"""
+        with self._condition:
+            if self._stopping: # eg stopped by hand, then at exit
+                return
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        while self._queue:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Feed items left in the journal %s', self.journal.prefix)
+                return
+        self.journal.close()
+
+    def _run(self):
+        backoff = 0
+        while True:
+            with self._condition:
+                while not self._stopping and not self._due():
+                    timeout = self.flush_seconds - (time.monotonic() - self._queue[0][2]) if self._queue else None
+                    self._condition.wait(timeout)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+                backoff = 0
+            except Exception:
+                logger.exception('Feed write-behind flush failed, retrying')
+                backoff = min(backoff * 2 or 0.1, 5)
+                time.sleep(backoff)
+            finally:
+                close_old_connections() # this thread holds a connection like a request would
+
+    def _due(self):
+        """Whether a batch should go now, holds the condition"""
+        if not self._queue:
+            return False
+        return len(self._queue) >= self.batch_size or time.monotonic() - self._queue[0][2] >= self.flush_seconds
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def writer():
+    """This process's writer, started on first use after replaying any orphaned journal"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                directory = settings.FEED_WRITE_BEHIND_JOURNAL_DIR
+                replayed = replay(directory, settings.FEED_WRITE_BEHIND_BATCH_SIZE)
+                if replayed:
+                    logger.info('Replayed %d journaled feed items', replayed)
+                _writer = Writer(
+                    Journal(directory, settings.FEED_WRITE_BEHIND_FSYNC),
+                    settings.FEED_WRITE_BEHIND_BATCH_SIZE,
+                    settings.FEED_WRITE_BEHIND_FLUSH_SECONDS,
+                    settings.FEED_WRITE_BEHIND_MAX_QUEUE,
+                    settings.FEED_WRITE_BEHIND_MAX_ATTEMPTS,
+                )
+                _writer.start()
+                atexit.register(_writer.stop) # a clean shutdown leaves no journal behind
+    return _writer
+
+
+def start_if_enabled():
+    """Start the writer with the server, so it replays crashed workers' journals before taking traffic"""
+    if settings.FEED_WRITE_BEHIND:
+        writer()
+
+
+def _after_fork_in_child():
+    """A forked worker starts a writer of its own, the parent's thread didn't survive the fork and its journal isn't ours"""
+    global _writer, _writer_lock
+    if _writer is not None:
+        atexit.unregister(_writer.stop) # would flush and remove the parent's journal when the child exits
+    _writer = None
+    _writer_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'): # Python 3.7+, eg gunicorn --preload forks its workers after wsgi.py started a writer
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def stats():
+    """Queue gauges and counters of this process, empty until something was queued"""
+    return _writer.stats() if _writer is not None else {}
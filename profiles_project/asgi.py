@@ -0,0 +1,23 @@
+"""
+ASGI config for profiles_project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+eg `uvicorn profiles_project.asgi:application`. Requests still run through the
+regular Django handler, on the bounded thread pools set up in profiles_api.asgi.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+django.setup(set_prefix=False)
+
+from profiles_api import writebehind  # noqa: E402, needs the app registry loaded by django.setup()
+from profiles_api.asgi import AsgiHandler  # noqa: E402
+from profiles_project import preload  # noqa: E402
+
+writebehind.start_if_enabled() # replays crashed workers' feed journals before taking traffic
+preload.warm_up()
+
+application = AsgiHandler()
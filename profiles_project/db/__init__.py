@@ -0,0 +1,98 @@
+"""
+Database configuration from the environment, plus the pooled backends in
+profiles_project.db.postgresql_pool and profiles_project.db.sqlite3.
+
+DATABASE_URL picks the database, eg postgres://user:secret@db:5432/profiles,
+SQLite in WAL mode is used when it isn't set. PostgreSQL connections go through
+a per-process ConnectionPool unless DB_POOL=0, in which case Django keeps each
+thread's connection open for DB_CONN_MAX_AGE seconds instead.
+"""
+import os
+import threading
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from profiles_project.db.pool import ConnectionPool
+
+POOL_SETTINGS = ( # (environment variable, pool argument, default)
+    ('DB_POOL_MIN_SIZE', 'min_size', 2),
+    ('DB_POOL_MAX_SIZE', 'max_size', 20),
+    ('DB_POOL_MAX_IDLE', 'max_idle', 300),
+    ('DB_POOL_MAX_LIFETIME', 'max_lifetime', 3600),
+    ('DB_POOL_CHECK_AFTER', 'check_after', 30),
+    ('DB_POOL_TIMEOUT', 'timeout', 10),
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+_inherited_pools = [] # pools of the parent process, see _after_fork_in_child()
+
+
+def database_from_env(environ, sqlite_path):
+    """Build a settings.DATABASES entry from the environment"""
+    url = environ.get('DATABASE_URL')
+    if not url:
+        return {'ENGINE': 'profiles_project.db.sqlite3', 'NAME': sqlite_path}
+
+    parts = urlsplit(url)
+    options = dict(parse_qsl(parts.query))
+    if parts.scheme == 'sqlite':
+        return {'ENGINE': 'profiles_project.db.sqlite3', 'NAME': unquote(parts.path[1:]) or sqlite_path, 'OPTIONS': options}
+    if parts.scheme not in ('postgres', 'postgresql'):
+        raise ValueError('Unsupported DATABASE_URL scheme: %s' % parts.scheme)
+
+    database = {
+        'NAME': unquote(parts.path[1:]),
+        'USER': unquote(parts.username or ''),
+        'PASSWORD': unquote(parts.password or ''),
+        'HOST': parts.hostname or '',
+        'PORT': str(parts.port or ''),
+        'OPTIONS': options, # the query string passes libpq options through, eg ?sslmode=require
+    }
+    if environ.get('DB_POOL', '1') == '0':
+        database['ENGINE'] = 'django.db.backends.postgresql'
+        database['CONN_MAX_AGE'] = int(environ.get('DB_CONN_MAX_AGE', 60))
+    else:
+        database['ENGINE'] = 'profiles_project.db.postgresql_pool'
+        database['CONN_MAX_AGE'] = 0 # Django "closes" after every request, which returns the connection to the pool
+        database['OPTIONS']['pool'] = {name: int(environ.get(variable, default)) for variable, name, default in POOL_SETTINGS}
+    return database
+
+
+def get_pool(alias, database, **kwargs):
+    """
+    Return the process-wide pool of a database, creating it with kwargs on first use.
+    Pools are per (alias, database name), the test runner uses the same alias for
+    the maintenance database, the test database and the real one.
+    """
+    with _pools_lock:
+        if (alias, database) not in _pools:
+            _pools[alias, database] = ConnectionPool(**kwargs)
+        return _pools[alias, database]
+
+
+def close_pools(alias, database=None):
+    """Close the idle connections of an alias' pools, eg before its database is dropped"""
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[0] == alias and database in (None, key[1])]
+    for pool in pools:
+        pool.close_all()
+
+
+def pool_stats():
+    """Stats of every pool created in this process"""
+    with _pools_lock:
+        pools = sorted(_pools.items())
+    return [dict(alias=alias, database=database, **pool.stats()) for (alias, database), pool in pools]
+
+
+def _after_fork_in_child():
+    """A forked child opens connections of its own, its parent's sockets can't be shared"""
+    global _pools, _pools_lock
+    # Kept referenced rather than closed or garbage collected, closing would end the parent's sessions
+    _inherited_pools.extend(_pools.values())
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'): # Python 3.7+
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,191 @@
+"""
+A small thread-safe pool of DB-API connections, shared by all threads of a process.
+Django opens a connection per thread and closes it at the end of each request,
+the pooled backends hand those calls to ConnectionPool.acquire()/release().
+"""
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the pool's timeout"""
+
+
+class ConnectionPool:
+    """
+    Bounded connection pool.
+    `connect` opens a new raw connection, `check` returns whether an idle connection
+    still works and `reset` gets a returned connection ready for reuse (returning
+    False discards it). The pool opens `min_size` connections when it's created,
+    connections idle for more than `max_idle` seconds are closed while more than
+    `min_size` are open, and none is kept past `max_lifetime`.
+    """
+
+    def __init__(self, connect, check=None, reset=None, min_size=0, max_size=10,
+                 max_idle=300, max_lifetime=3600, check_after=30, timeout=10):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.timeout = timeout
+
+        self._idle = deque() # (connection, opened_at, released_at), the most recently used on the right
+        self._opened_at = {} # id(connection) -> opened_at, for connections handed out
+        self._size = 0
+        self._waiting = 0
+        self._lock = threading.Condition()
+        self._counters = dict.fromkeys(('opened', 'closed', 'acquired', 'timeouts', 'failed_checks'), 0)
+        self._wait_seconds = 0.0
+        self.fill()
+
+    def fill(self):
+        """Open idle connections until `min_size` are open, so the first requests don't pay for them"""
+        opened = []
+        try:
+            while self._size + len(opened) < self.min_size:
+                opened.append(self.connect())
+        except Exception:
+            for connection in opened:
+                self._close(connection)
+            raise
+        now = time.monotonic()
+        with self._lock:
+            self._idle.extend((connection, now, now) for connection in opened)
+            self._size += len(opened)
+            self._counters['opened'] += len(opened)
+            self._lock.notify_all()
+
+    def acquire(self):
+        """Return a connection, opening one if the pool has room, waiting up to `timeout` otherwise"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._lock:
+            while True:
+                self._close_expired()
+                if self._idle:
+                    connection, opened_at, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1 # reserve the slot, the connection is opened outside the lock
+                    connection = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout('No database connection available after %ss' % self.timeout)
+                self._waiting += 1
+                try:
+                    self._lock.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+        if connection is not None and time.monotonic() - released_at >= self.check_after and not self._check(connection):
+            with self._lock:
+                self._counters['failed_checks'] += 1
+            self._discard(connection)
+            return self.acquire() # the failed connection gave its slot back, so this doesn't wait behind it
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+            opened_at = time.monotonic()
+            with self._lock:
+                self._counters['opened'] += 1
+
+        with self._lock:
+            self._opened_at[id(connection)] = opened_at
+            self._counters['acquired'] += 1
+            self._wait_seconds += time.monotonic() - started
+        return connection
+
+    def release(self, connection):
+        """Give a connection back, it's closed instead when it's broken or too old"""
+        with self._lock:
+            opened_at = self._opened_at.pop(id(connection), None)
+        if opened_at is None: # not ours, eg acquired before a reset of the pool
+            self._close(connection)
+            return
+
+        if time.monotonic() - opened_at >= self.max_lifetime or (self.reset and not self._reset(connection)):
+            self._discard(connection)
+            return
+
+        with self._lock:
+            self._idle.append((connection, opened_at, time.monotonic()))
+            self._lock.notify()
+
+    def close_all(self):
+        """Close the idle connections, connections in use are closed when they're released"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle) + len(self._opened_at) # connections in use no longer count against the pool
+            self._opened_at.clear()
+            self._counters['closed'] += len(idle)
+        for connection, _, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        """Snapshot of the pool's gauges and counters"""
+        with self._lock:
+            return dict(
+                self._counters,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                waiting=self._waiting,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                wait_seconds=round(self._wait_seconds, 6),
+            )
+
+    def _close_expired(self):
+        """Drop idle connections past their lifetime, or idle for too long above min_size. Holds the lock."""
+        now = time.monotonic()
+        kept = deque()
+        for connection, opened_at, released_at in self._idle:
+            too_old = now - opened_at >= self.max_lifetime
+            too_idle = now - released_at >= self.max_idle and self._size > self.min_size
+            if too_old or too_idle:
+                self._size -= 1
+                self._counters['closed'] += 1
+                self._close(connection)
+            else:
+                kept.append((connection, opened_at, released_at))
+        self._idle = kept
+
+    def _discard(self, connection):
+        self._close(connection)
+        with self._lock:
+            self._size -= 1
+            self._counters['closed'] += 1
+            self._lock.notify()
+
+    def _check(self, connection):
+        try:
+            return self.check is None or self.check(connection)
+        except Exception:
+            return False
+
+    def _reset(self, connection):
+        try:
+            return self.reset(connection)
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,73 @@
+from django.db.backends.postgresql import base
+
+from profiles_project.db import close_pools, get_pool
+
+
+def _check(connection):
+    """Health check of an idle connection"""
+    if connection.closed:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    connection.rollback() # SELECT 1 opened a transaction if autocommit was off
+    return True
+
+
+def _reset(connection):
+    """Get a returned connection back to a clean state, False when it's unusable"""
+    if connection.closed:
+        return False
+    status = connection.get_transaction_status()
+    if status == base.Database.extensions.TRANSACTION_STATUS_UNKNOWN: # the server went away
+        return False
+    if status != base.Database.extensions.TRANSACTION_STATUS_IDLE: # a transaction left open, eg by a failed request
+        connection.rollback()
+    return True
+
+
+class DatabaseCreation(base.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(self.connection.alias, test_database_name) # pooled connections would keep the database in use
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend that borrows connections from a process-wide ConnectionPool.
+    Django's connect/close at the start and end of each request become a checkout
+    and a return, so small requests don't pay for the TCP, TLS and auth handshakes.
+    Pool sizes come from OPTIONS['pool'], see profiles_project.db.POOL_SETTINGS.
+    """
+
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None) # ours, not a libpq option
+        return params
+
+    @property
+    def pool(self):
+        conn_params = self.get_connection_params()
+        return get_pool(
+            self.alias, conn_params['database'],
+            connect=lambda: base.Database.connect(**conn_params),
+            check=_check,
+            reset=_reset,
+            **self.settings_dict['OPTIONS'].get('pool', {})
+        )
+
+    def get_new_connection(self, conn_params):
+        connection = self.pool.acquire()
+        options = self.settings_dict['OPTIONS']
+        # same isolation level handling as the parent, for new and reused connections alike
+        self.isolation_level = options.get('isolation_level', connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.release(self.connection)
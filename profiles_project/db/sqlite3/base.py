@@ -0,0 +1,16 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite with write-ahead logging, the local fallback when DATABASE_URL isn't set.
+    In WAL mode readers don't block the writer and the writer doesn't block readers,
+    which matters once requests run on several threads (see profiles_project/asgi.py).
+    """
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        if not self.creation.is_in_memory_db(self.settings_dict['NAME']): # in-memory databases have no journal file
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL') # still durable against crashes of the app, fsyncs far less often
+        return connection
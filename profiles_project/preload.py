@@ -0,0 +1,71 @@
+"""
+Application warm-up, run by profiles_project.wsgi and profiles_project.asgi once the
+app registry is loaded.
+
+Django builds a lot lazily on the first request: the URL resolver and its compiled
+regexes, the models' field caches, the serializers' fields, the translation catalogs.
+Doing it up front takes that off the first requests of every worker, and under a
+server that imports the application before forking its workers (gunicorn --preload,
+uWSGI without lazy-apps) it's done once, in pages the workers share copy-on-write.
+gc.freeze() then keeps the garbage collector of each worker from writing to (and so
+copying) those pages. Nothing that can't cross a fork is left open: the database
+connections are closed, and the write-behind writer and the connection pools of a
+worker start over rather than use the ones inherited from the parent.
+"""
+import gc
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+from django.utils import translation
+from rest_framework import serializers as drf_serializers
+
+from profiles_api import serializers
+from profiles_api.throttling import parse_rate
+from profiles_project.db import close_pools
+
+
+def warm_up(freeze=True):
+    """Build the lazily built caches, then close the database connections"""
+    with translation.override(settings.LANGUAGE_CODE): # loads the catalogs, error messages are translated
+        for model in apps.get_models():
+            model._meta.get_fields() # cached per model, also sets up the reverse relations
+
+        views = set()
+        _warm_resolver(get_resolver(), views)
+        for view in views:
+            serializer_class = getattr(view, 'serializer_class', None)
+            if serializer_class is None:
+                continue
+            serializer_class().fields # ModelSerializers build their fields from the model's _meta
+            if issubclass(serializer_class, drf_serializers.ModelSerializer):
+                serializers.ValuesSerializer.for_serializer(serializer_class)
+
+    for rate in settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {}).values():
+        parse_rate(rate)
+    parse_rate(settings.ADMISSION_RATE)
+
+    for alias in connections:
+        connections[alias].ops.compiler('SQLCompiler') # imports the backend's compiler module, without connecting
+
+    connections.close_all()
+    for alias in connections:
+        close_pools(alias) # really closes the pooled connections, closing a Django connection returns it to the pool
+
+    if freeze and hasattr(gc, 'freeze'): # Python 3.7+
+        gc.collect()
+        gc.freeze()
+
+
+def _warm_resolver(resolver, views):
+    """Populate a resolver's lookups and compile its patterns, recursively. Collects the view classes."""
+    resolver.reverse_dict # populates the reverse, namespace and app lookups
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex # compiled once per language
+        if isinstance(pattern, URLResolver):
+            _warm_resolver(pattern, views)
+        else:
+            view = getattr(pattern.callback, 'cls', None) # as_view() of DRF views and viewsets
+            if view is not None:
+                views.add(view)
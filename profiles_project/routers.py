@@ -0,0 +1,129 @@
+"""
+Read-replica routing.
+ReplicaRouter sends reads to the aliases in settings.DATABASE_REPLICAS and writes
+to `default`. Replicas are only used where ReplicaRoutingMiddleware allows it:
+safe-method requests from clients that haven't written in the last
+REPLICA_PIN_SECONDS (read-your-writes). Everything else, including management
+commands and the shell, stays on the primary.
+"""
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from profiles_project.db import pool_stats
+
+PRIMARY = 'default'
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+_state = threading.local() # per thread, so also per request under both WSGI and the ASGI thread pools
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+
+def replicas_allowed():
+    return getattr(_state, 'replicas', False)
+
+
+@contextmanager
+def use_replicas(allowed=True):
+    """Let reads in the block go to the replicas (or, with allowed=False, keep them on the primary)"""
+    previous = replicas_allowed(), getattr(_state, 'wrote', False)
+    _state.replicas, _state.wrote = allowed, False
+    try:
+        yield
+    finally:
+        _state.replicas, _state.wrote = previous
+
+
+def wrote():
+    """Whether a write was routed since use_replicas() was entered"""
+    return getattr(_state, 'wrote', False)
+
+
+def choose_replica(replicas):
+    """Pick a replica according to settings.DATABASE_REPLICA_STRATEGY"""
+    with _counter_lock:
+        turn = next(_counter)
+    if settings.DATABASE_REPLICA_STRATEGY == 'least_loaded':
+        in_use = {stats['alias']: stats['in_use'] for stats in pool_stats() if stats['alias'] in replicas}
+        if in_use: # ties, and replicas without a pool yet, are taken in turn
+            return min(replicas, key=lambda alias: (in_use.get(alias, 0), (replicas.index(alias) - turn) % len(replicas)))
+    return replicas[turn % len(replicas)]
+
+
+class ReplicaRouter:
+    """Reads go to a replica when the current request allows it, writes always go to the primary"""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not replicas_allowed() or wrote():
+            return PRIMARY
+        return choose_replica(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True # any later read in this request must see the write
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # replicas hold the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS # replicas get the schema through replication
+
+
+def pin_key(request):
+    """
+    Identify the client for read-your-writes. The user isn't authenticated yet when
+    the middleware runs, so it goes by the credentials the request carries.
+    """
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION') or
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME) or
+        request.META.get('REMOTE_ADDR', '')
+    )
+    return 'replica-pin:' + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Allow replica reads for safe-method requests, and pin a client to the primary
+    for REPLICA_PIN_SECONDS after a request of theirs wrote to the database.
+    The pins live in the REPLICA_PIN_CACHE_ALIAS cache, which needs to be shared
+    between the workers for the pin to hold across them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        cache = caches[settings.REPLICA_PIN_CACHE_ALIAS]
+        key = pin_key(request)
+        allowed = request.method in ('GET', 'HEAD', 'OPTIONS') and not cache.get(key)
+        with use_replicas(allowed):
+            response = self.get_response(request)
+            if wrote():
+                cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+
+@checks.register(checks.Tags.caches)
+def check_pin_cache(app_configs, **kwargs):
+    """With replicas, the pins need a cache the workers share, or a client's next read can land on a lagging replica"""
+    if not settings.DATABASE_REPLICAS:
+        return []
+    backend = settings.CACHES.get(settings.REPLICA_PIN_CACHE_ALIAS, {}).get('BACKEND')
+    if backend is None or backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            "REPLICA_PIN_CACHE_ALIAS '%s' isn't a cache shared between the workers." % settings.REPLICA_PIN_CACHE_ALIAS,
+            hint='Point it at a shared backend such as profiles_api.cache_backends.RedisCache.',
+            id='profiles.E001',
+        )]
+    return []
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+from profiles_project.db import database_from_env
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -43,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'profiles_api.metrics.MetricsMiddleware', # first, so its timings cover the other middleware too
+    'profiles_api.throttling.AdmissionMiddleware', # sheds load before sessions, auth or the views touch the database
+    'profiles_api.compression.CompressionMiddleware', # before anything else touching the body, so it sees the final one
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'profiles_project.routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'profiles_project.urls'
@@ -76,13 +82,58 @@ WSGI_APPLICATION = 'profiles_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# DATABASE_URL selects the database, eg postgres://user:secret@db:5432/profiles.
+# PostgreSQL connections are pooled per process (sizes in the DB_POOL_* variables, see
+# profiles_project/db/__init__.py), without DATABASE_URL it's SQLite in WAL mode.
 DATABASES = {
+    'default': database_from_env(os.environ, os.path.join(BASE_DIR, 'db.sqlite3')),
+}
+
+# Read replicas, DATABASE_REPLICA_URLS is a comma separated list of URLs in the DATABASE_URL
+# format, eg sqlite:///replica.sqlite3 for a local copy of db.sqlite3. See profiles_project/routers.py.
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = 'replica_%d' % index
+    DATABASES[alias] = database_from_env(dict(os.environ, DATABASE_URL=url.strip()), None)
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'} # the tests read their writes back from the test database
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['profiles_project.routers.ReplicaRouter']
+DATABASE_REPLICA_STRATEGY = 'round_robin' # or 'least_loaded', the pooled replica with the fewest connections in use
+
+# After a write, the client's reads stay on the primary for this long, which should cover the replication lag.
+# Responses cached during the lag can hold stale rows, RESPONSE_CACHE_TIMEOUT bounds how long.
+# The pins need a cache shared between the workers, `manage.py check` fails on a local memory one
+# while replicas are configured.
+REPLICA_PIN_SECONDS = 5
+REPLICA_PIN_CACHE_ALIAS = 'default'
+
+
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Local memory caches are per process. Point these at a shared backend such as
+# profiles_api.cache_backends.RedisCache when running several workers.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'auth-tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth-tokens',
+        'TIMEOUT': 300, # seconds a token -> user lookup is trusted
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000, # least recently used entries are evicted past this
+        },
+    },
 }
 
+TOKEN_CACHE_ALIAS = 'auth-tokens'
+
+# Rendered list/retrieve responses of the profile and feed endpoints, see profiles_api.caching
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 60 # seconds, also bounds staleness when workers don't share the cache
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -102,6 +153,103 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The first hasher hashes new passwords. The others keep older hashes verifying,
+# and those are rehashed with the first one on the user's next login, as are
+# hashes made with a different cost. Argon2 is preferred when argon2-cffi is installed.
+PASSWORD_HASHERS = [
+    'profiles_api.hashers.PBKDF2PasswordHasher',
+    'profiles_api.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+try:
+    import argon2  # noqa: F401
+except ImportError: # optional dependency
+    pass
+else:
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+PASSWORD_PBKDF2_ITERATIONS = None # None keeps Django's default
+PASSWORD_ARGON2_COST = {} # time_cost, memory_cost (KiB), parallelism, unset keys keep Django's defaults
+
+# Bulk user provisioning hashes passwords in worker processes.
+# None uses one process per CPU. 'spawn' is safe to use from a threaded server.
+PASSWORD_HASHING_PROCESSES = None
+PASSWORD_HASHING_START_METHOD = 'spawn'
+
+# Logins verify passwords on their own pool of worker processes, so a login storm
+# can use at most LOGIN_HASHING_PROCESSES CPUs. None uses half of the CPUs, 0 verifies
+# in the request thread. Logins beyond LOGIN_MAX_PENDING waiting verifications get a 429.
+LOGIN_HASHING_PROCESSES = None
+LOGIN_MAX_PENDING = 64
+
+
+# Number of entries kept on each user's materialized timeline (/api/feed/timeline/)
+TIMELINE_MAX_LENGTH = 800
+
+# Feed items older than this move to the compressed archive when `manage.py archive_feed` runs,
+# they stay readable through the feed API (profiles_api/archive.py)
+FEED_RETENTION_DAYS = 365
+
+# Write-behind for feed posts (profiles_api/writebehind.py): POST /api/feed/ answers 202 with
+# a provisional id and a background thread inserts the items in batches of up to BATCH_SIZE,
+# at the latest FLUSH_SECONDS after they were posted. Accepted items are journaled to
+# JOURNAL_DIR first, which must be on local disk and is replayed after a crash.
+# Posts beyond MAX_QUEUE waiting items get a 429. An item that fails to insert MAX_ATTEMPTS
+# times goes to the dead letter file in JOURNAL_DIR (`manage.py replay_feed_journal --dead-letters`).
+FEED_WRITE_BEHIND = os.environ.get('FEED_WRITE_BEHIND', '0') == '1'
+FEED_WRITE_BEHIND_BATCH_SIZE = 500
+FEED_WRITE_BEHIND_FLUSH_SECONDS = 0.05
+FEED_WRITE_BEHIND_MAX_QUEUE = 10000
+FEED_WRITE_BEHIND_MAX_ATTEMPTS = 5
+FEED_WRITE_BEHIND_JOURNAL_DIR = os.path.join(BASE_DIR, 'feed-journal')
+FEED_WRITE_BEHIND_FSYNC = True # False still survives a crash of the process, but not of the machine
+
+# Change stream of the feed (/api/feed/changes/, profiles_api/changes.py). Each process checks
+# the change log every POLL_SECONDS and keeps the last BUFFER changes in memory; long-polls wait
+# up to MAX_WAIT seconds. Changes older than RETENTION_HOURS are dropped, by every process that
+# writes to the feed once per TRIM_SECONDS and by `manage.py archive_feed`; cursors from before
+# then get a 410 and the client reloads the feed.
+FEED_CHANGES_POLL_SECONDS = 1
+FEED_CHANGES_BUFFER = 10000
+FEED_CHANGES_MAX_WAIT = 25
+FEED_CHANGES_RETENTION_HOURS = 24
+FEED_CHANGES_TRIM_SECONDS = 3600
+# A missing change id holds back the changes after it for up to GAP_SECONDS, its transaction may
+# not have committed yet. If it commits within LATE_SECONDS after all, it's logged again and sent.
+FEED_CHANGES_GAP_SECONDS = 2
+FEED_CHANGES_LATE_SECONDS = 600
+
+
+# Thread pools of the ASGI entry point (profiles_project/asgi.py), which runs Django off the event loop.
+# Hot reads and everything else get separate pools, and requests beyond threads + ASGI_MAX_WAITING
+# are answered with a 503 rather than queued without bound.
+ASGI_READ_THREADS = 32
+ASGI_WRITE_THREADS = 8
+ASGI_MAX_WAITING = 256
+# Change streams (/api/feed/changes/) served from the event loop, which hold no thread while they wait.
+# Beyond this many open at once they're answered with a 503.
+ASGI_MAX_STREAMS = 1000
+
+
+# Response compression (profiles_api/compression.py): zstd for clients that accept it when the
+# zstandard package is installed, otherwise gzip. Buffered bodies under MIN_SIZE bytes aren't compressed.
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_ZSTD_LEVEL = 3
+
+
+# Per-view request metrics, served in the Prometheus text format at /api/_metrics.
+# Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`. Without a token the
+# endpoint answers 404, unless DEBUG is on.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Share of requests run under cProfile, the profiles of those slower than the threshold
+# (in seconds) are written to METRICS_PROFILE_DIR. 0 turns profiling off.
+METRICS_PROFILE_SAMPLE_RATE = 0
+METRICS_PROFILE_THRESHOLD = 0.5
+METRICS_PROFILE_DIR = os.path.join(BASE_DIR, 'cprofile')
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -123,3 +271,50 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 AUTH_USER_MODEL = 'profiles_api.UserProfile'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        'profiles_api.renderers.FastJSONRenderer', # same output as DRF's JSONRenderer, encoded with orjson when installed
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'profiles_api.parsers.FastJSONParser', # JSONParser's results, decoded with orjson when installed
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'profiles_api.throttling.ReadWriteThrottle', # token buckets, see profiles_api/throttling.py
+    ),
+    'DEFAULT_THROTTLE_RATES': { # burst / period, the bucket refills at that rate
+        'anon_read': '300/min',
+        'anon_write': '30/min',
+        'user_read': '1200/min',
+        'user_write': '120/min',
+        'login': '20/min',
+    },
+}
+
+# MessagePack (Accept / Content-Type: application/msgpack) when the msgpack package is installed
+try:
+    import msgpack  # noqa: F401
+except ImportError: # optional dependency
+    pass
+else:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] += ('profiles_api.renderers.MessagePackRenderer',)
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] += ('profiles_api.parsers.MessagePackParser',)
+
+# Set THROTTLE_ENABLED=0 in the environment to lift the rate limits, eg for load tests.
+# The buckets are per process, set THROTTLE_CACHE_ALIAS to a cache the workers share
+# (eg Redis) to enforce the rates across them.
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', '1') != '0'
+THROTTLE_CACHE_ALIAS = None
+THROTTLE_MAX_BUCKETS = 100000 # local buckets kept, least recently used first out
+
+# Admission control in front of everything (profiles_api.throttling.AdmissionMiddleware):
+# requests per client IP before any other check, and requests running at once in a process
+# (change streams excluded). The per-IP rate is off unless ADMISSION_RATE is set, eg to 100/s.
+# Behind a proxy or load balancer every request comes from its address, set CLIENT_IP_HEADER
+# to the header it puts the client's address in (eg HTTP_X_REAL_IP), or the rate caps them all together.
+ADMISSION_RATE = os.environ.get('ADMISSION_RATE') or None
+ADMISSION_MAX_IN_FLIGHT = 64
+CLIENT_IP_HEADER = os.environ.get('CLIENT_IP_HEADER') or None
@@ -0,0 +1,42 @@
+"""
+Settings of workers that only serve the API under /api/, eg
+`DJANGO_SETTINGS_MODULE=profiles_project.settings_api gunicorn --preload profiles_project.wsgi`.
+
+Clients authenticate with tokens, so the admin, sessions, messages and static files
+are left out along with their middleware and the browsable API, which logs in through
+a session. That's less to import and initialize per worker and less work per request.
+Serve /admin/ from a process running profiles_project.settings, on the same database.
+"""
+from profiles_project.settings import *  # noqa: F401, F403
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in ( # noqa: F405
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in ( # noqa: F405
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware', # only session authenticated requests need it
+    'django.contrib.auth.middleware.AuthenticationMiddleware', # DRF sets request.user from the token
+    'django.contrib.messages.middleware.MessageMiddleware',
+)]
+
+ROOT_URLCONF = 'profiles_project.urls_api'
+
+TEMPLATES = [dict(TEMPLATES[0], OPTIONS=dict(TEMPLATES[0]['OPTIONS'], context_processors=[ # noqa: F405
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+]))]
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK, # noqa: F405
+    DEFAULT_RENDERER_CLASSES=tuple(
+        renderer for renderer in REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] # noqa: F405
+        if renderer != 'rest_framework.renderers.BrowsableAPIRenderer'
+    ),
+    DEFAULT_AUTHENTICATION_CLASSES=(
+        'profiles_api.authentication.CachedTokenAuthentication',
+    ),
+)
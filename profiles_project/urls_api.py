@@ -0,0 +1,6 @@
+"""URLs of the API-only workers (profiles_project.settings_api), the API without the admin"""
+from django.urls import include, path
+
+urlpatterns = [
+    path('api/', include('profiles_api.urls')),
+]
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
 
 application = get_wsgi_application()
+
+from profiles_api import writebehind  # noqa: E402, needs the app registry loaded above
+from profiles_project import preload  # noqa: E402
+
+writebehind.start_if_enabled() # replays crashed workers' feed journals before taking traffic
+preload.warm_up() # before a preloading server forks, see profiles_project/preload.py